@@ -1,14 +1,25 @@
 
 import os
+import re
+import argparse
 import threading
+import hashlib
+import json
+import math
+import shutil
+import sqlite3
+import subprocess
+import time
+import uuid
+from bisect import bisect_left
+from collections import OrderedDict
+from itertools import chain
 from queue import Queue, Empty
-from flask import Flask, render_template_string, request, Response, redirect, url_for
+from flask import Flask, render_template_string, request, Response, redirect, url_for, jsonify
 from jinja2 import DictLoader, ChoiceLoader
-import yt_dlp
-import tkinter as tk
-from tkinter import filedialog
-import webbrowser
 import logging
+# yt_dlp, tkinter and webbrowser are imported where they are first used: yt_dlp is
+# slow to import, and tkinter is unavailable on servers without a display.
 
 # --- Configure Logging ---
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -17,13 +28,143 @@ logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %
 DEFAULT_DOWNLOAD_FOLDER = os.path.join(os.getcwd(), "downloads")
 os.makedirs(DEFAULT_DOWNLOAD_FOLDER, exist_ok=True)
 
+# Number of URLs downloaded in parallel per batch; each worker owns its own YoutubeDL.
+DEFAULT_CONCURRENCY = 4
+MAX_CONCURRENCY = 16
+
+# Adaptive jobs resize their active download slots with AIMD: every
+# CONCURRENCY_INTERVAL seconds a job whose slots are all busy gains one, and it
+# loses half of them after throttling errors (429/403/network) or when throughput
+# collapses below CONCURRENCY_DROP of its moving average. Slots stay between the
+# floor and the ceiling, which can be changed at runtime through /api/concurrency.
+CONCURRENCY_FLOOR = 1
+CONCURRENCY_CEILING = MAX_CONCURRENCY
+CONCURRENCY_INTERVAL = 5.0
+CONCURRENCY_DECREASE = 0.5
+CONCURRENCY_DROP = 0.5
+THROTTLE_CATEGORIES = ('rate_limited', 'forbidden', 'network')
+
+# Bandwidth governor: process-wide and default per-job byte rates (0 = unlimited),
+# changeable at runtime through /api/bandwidth. Jobs share the global rate in
+# proportion to their priority.
+GLOBAL_RATE_LIMIT = 0
+JOB_RATE_LIMIT = 0
+DEFAULT_PRIORITY = 5
+MAX_PRIORITY = 10
+
+# Parallel connections per download. DASH/HLS formats are fragmented already; plain
+# http(s) formats of known size (most of YouTube's) are split into byte ranges of
+# RANGE_FRAGMENT_SIZE first, so they get the same treatment. Formats of unknown size
+# stay on one connection. A job either fixes the count or leaves it at 0 (auto), in
+# which case it is tuned from measured throughput. All downloads in the process
+# share CONNECTION_BUDGET connections.
+MAX_FRAGMENT_CONCURRENCY = 16
+FRAGMENT_START_CONCURRENCY = 4
+CONNECTION_BUDGET = 64
+# Throughput change (ratio) that counts as better or worse when auto-tuning.
+FRAGMENT_TUNE_GAIN = 1.15
+# Downloads smaller than this are too short to say anything about throughput.
+FRAGMENT_TUNE_MIN_BYTES = 4 * 1024 * 1024
+# The chunk size yt-dlp itself uses for YouTube's https formats.
+RANGE_FRAGMENT_SIZE = 10 * 1024 * 1024
+
+# Bulk submission through /api/jobs: URLs are journaled in batches of this size
+# while the request body is read, and listings are paginated.
+INGEST_BATCH_SIZE = 1000
+# JSON bodies are parsed whole, so they are capped; NDJSON and text are streamed.
+MAX_JSON_BODY = 16 * 1024 * 1024
+# A submission with bad URLs is rejected; this many of them are reported (and read).
+MAX_INVALID_URLS = 20
+JOB_URL_RE = re.compile(r'https?://[^\s/?#]+\S*$', re.IGNORECASE)
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 1000
+
+# Idle YoutubeDL instances kept per option profile for reuse across jobs.
+YDL_POOL_MAX_IDLE = MAX_CONCURRENCY
+
+# SQLite journal of submitted jobs; unfinished jobs are resumed on startup.
+JOB_DB_PATH = os.path.join(os.getcwd(), "download_jobs.db")
+# Events kept per job for late subscribers and Last-Event-ID replay, and how many
+# finished jobs keep their channel around before the oldest is dropped.
+EVENT_BUFFER_SIZE = 2000
+MAX_FINISHED_CHANNELS = 50
+EOF_MARKER = "###EOF###"
+# Upper bound on progress frames per job and subscriber; intermediate updates are
+# coalesced to each download's latest state, the final state is always delivered.
+PROGRESS_MAX_HZ = 4.0
+# Progress stages after which a download publishes nothing more.
+FINAL_PROGRESS_STAGES = ('done', 'error', 'skipped', 'expanded')
+
+# Minimum seconds between byte-offset writes for a single download.
+JOB_PROGRESS_INTERVAL = 2.0
+
+# Extracted info dicts are cached by video ID. Their stream URLs expire after a few
+# hours, so entries older than INFO_CACHE_TTL are re-extracted.
+INFO_CACHE_DIR = os.path.join(os.getcwd(), ".info_cache")
+INFO_CACHE_TTL = 3 * 60 * 60
+INFO_CACHE_MAX_MEMORY = 256
+INFO_CACHE_MAX_DISK = 5000
+
+# Per-folder index of finished downloads (video ID + profile -> file) used to skip
+# videos that are already in the target folder.
+ARCHIVE_FILENAME = ".download_archive.jsonl"
+MEDIA_EXTENSIONS = ('.mp4', '.mp3', '.m4a', '.mkv', '.webm', '.opus', '.mov')
+
+# Output layout of a download folder. 'flat' writes <title>.<ext> into the folder;
+# 'sharded' writes <id[0:2]>/<id[2:4]>/<id>/<title>.<ext>, so no directory grows
+# with the library and equal titles never collide, and links each file from
+# by-title/<t>/<ti>/ (the title's first characters) under a readable name. Folders
+# written or migrated as sharded carry a LAYOUT_MARKER file and stay sharded
+# whatever OUTPUT_LAYOUT says.
+OUTPUT_LAYOUT = 'flat'
+OUTPUT_TEMPLATES = {
+    'flat': '%(title)s.%(ext)s',
+    'sharded': '%(id.0:2)s/%(id.2:4)s/%(id)s/%(title)s.%(ext)s',
+}
+LAYOUT_MARKER = ".sharded"
+TITLE_LINKS_DIRNAME = "by-title"
+
+# Catalog of the media files in download folders, kept in the job database. The
+# reconciler re-lists only directories whose mtime changed since its last pass.
+LIBRARY_RECONCILE_INTERVAL = 60
+# yt-dlp format parts (name.f137.mp4) and finalizer temp files are not library files.
+LIBRARY_SKIP_RE = re.compile(r'\.(?:f\d+|finalize|temp)\.\w+$')
+
+# Transcripts folder (yt_transcript_downloader.py -o) whose search index and
+# related-videos model back /api/transcripts/search and /api/transcripts/related.
+TRANSCRIPTS_FOLDER = os.path.join(os.getcwd(), "transcripts")
+
+# Histogram buckets (seconds) for per-stage timings exported on /metrics.
+STAGE_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+# Target profile for video downloads. Streams already in these codecs are stream-copied;
+# only the incompatible stream is re-encoded with the arguments below.
+TARGET_VIDEO_CODECS = ('h264',)
+TARGET_AUDIO_CODECS = ('aac',)
+TARGET_PIX_FMTS = ('yuv420p',)
+VIDEO_ENCODE_ARGS = [
+    '-c:v', 'libx264',
+    '-preset', 'medium',
+    '-profile:v', 'high',
+    '-level', '4.2',
+    '-pix_fmt', 'yuv420p',
+]
+AUDIO_ENCODE_ARGS = ['-c:a', 'aac', '-b:a', '192k']
+MP3_ENCODE_ARGS = ['-vn', '-c:a', 'libmp3lame', '-b:a', '192k']
+
+# ffmpeg work runs in its own pool, fed by the download workers through a bounded
+# queue: when it is full, downloads wait instead of piling up raw files.
+POSTPROCESS_WORKERS = os.cpu_count() or 2
+POSTPROCESS_QUEUE_SIZE = 2 * POSTPROCESS_WORKERS
+
 # Global variable to store the last selected folder; defaults to DEFAULT_DOWNLOAD_FOLDER.
 last_selected_folder = DEFAULT_DOWNLOAD_FOLDER
 
 # --- Flask App Setup ---
 app = Flask(__name__)
-message_queue = Queue()
 folder_queue = Queue()  # Queue to communicate folder path from Tkinter to Flask
+root = None  # Tkinter root; stays None in --headless mode
+HEADLESS = False
 
 # --- Templates ---
 BASE_HTML = """
@@ -65,7 +206,7 @@ BASE_HTML = """
       margin-top: 0;
       font-size: 1.75rem;
     }
-    textarea, input[type="text"] {
+    textarea, input[type="text"], input[type="number"], input[type="date"] {
       width: 100%;
       padding: var(--padding);
       border: 1px solid var(--border-color);
@@ -93,6 +234,14 @@ BASE_HTML = """
     button:hover {
       opacity: 0.9;
     }
+    .progress-row {
+      font-family: monospace;
+      font-size: 0.85rem;
+      margin-bottom: 0.25rem;
+      white-space: nowrap;
+      overflow: hidden;
+      text-overflow: ellipsis;
+    }
     .log {
       background: #f3f4f6;
       border: 1px solid var(--border-color);
@@ -147,7 +296,7 @@ function openFolderPicker() {
   <h1>Multiple Video Downloader</h1>
   <form action="{{ url_for('start_download') }}" method="POST">
     <label for="folder">Download Folder:</label>
-    <input type="text" id="folder" name="folder" value="{{ default_folder }}" required readonly>
+    <input type="text" id="folder" name="folder" value="{{ default_folder }}" required {{ "" if headless else "readonly" }}>
     <button type="button" onclick="openFolderPicker()">Select Folder</button>
     
     <label for="urls">Video URLs (one per line):</label>
@@ -158,8 +307,32 @@ function openFolderPicker() {
       <label for="download_audio" style="display:inline;">Download Audio Only (MP3)</label>
     </div>
     
+    <label for="concurrency">Parallel Downloads:</label>
+    <input type="number" id="concurrency" name="concurrency" min="1" max="{{ max_concurrency }}" value="{{ default_concurrency }}">
+    
+    <div class="checkbox-group">
+      <input type="checkbox" id="adaptive" name="adaptive">
+      <label for="adaptive" style="display:inline;">Adapt Parallel Downloads to Throughput and Errors</label>
+    </div>
+    
+    <label for="max_items">Max Videos per Playlist/Channel (0 = all):</label>
+    <input type="number" id="max_items" name="max_items" min="0" value="0">
+    
+    <label for="date_after">Only Videos Uploaded After (optional):</label>
+    <input type="date" id="date_after" name="date_after">
+    
+    <label for="priority">Priority (1 = background, {{ max_priority }} = interactive):</label>
+    <input type="number" id="priority" name="priority" min="1" max="{{ max_priority }}" value="{{ default_priority }}">
+    
+    <label for="rate_limit">Bandwidth Limit for This Batch (e.g. 500K, 2M; empty = unlimited):</label>
+    <input type="text" id="rate_limit" name="rate_limit" placeholder="unlimited">
+    
+    <label for="fragments">Connections per Download (0 = auto-tune):</label>
+    <input type="number" id="fragments" name="fragments" min="0" max="{{ max_fragments }}" value="0">
+    
     <button type="submit">Download Videos</button>
   </form>
+  <p><a href="{{ url_for('library') }}">Browse Library</a></p>
 {% endblock %}
 """
 
@@ -167,9 +340,31 @@ PROGRESS_HTML = """
 {% extends "base.html" %}
 {% block head %}
 <script>
+function formatBytes(n) {
+  if (!n) { return "?"; }
+  var units = ["B", "KiB", "MiB", "GiB"], i = 0;
+  while (n >= 1024 && i < units.length - 1) { n /= 1024; i++; }
+  return n.toFixed(1) + " " + units[i];
+}
+
+function formatProgress(p) {
+  var text = p.stage;
+  if (p.total_bytes) {
+    text += " " + (p.downloaded_bytes / p.total_bytes * 100).toFixed(1) + "%";
+  }
+  text += " of " + formatBytes(p.total_bytes);
+  if (p.speed) { text += " at " + formatBytes(p.speed) + "/s"; }
+  if (p.eta != null) { text += ", ETA " + p.eta + "s"; }
+  if (p.connections > 1) { text += " over " + p.connections + " connections"; }
+  return text + " - " + p.url;
+}
+
 document.addEventListener("DOMContentLoaded", function(){
   var logArea = document.getElementById("log");
-  var evtSource = new EventSource("{{ url_for('stream') }}");
+  var progressArea = document.getElementById("progress");
+  var rows = {};
+  // EventSource resends the last seen id on reconnect, so nothing is lost in between.
+  var evtSource = new EventSource("{{ url_for('stream', job_id=job_id) }}");
   evtSource.onmessage = function(e) {
     if(e.data === "###EOF###") {
       evtSource.close();
@@ -178,59 +373,1611 @@ document.addEventListener("DOMContentLoaded", function(){
       logArea.scrollTop = logArea.scrollHeight;
     }
   };
+  var concurrencyArea = document.getElementById("concurrency");
+  evtSource.addEventListener("concurrency", function(e) {
+    var updates = JSON.parse(e.data);
+    var c = updates[updates.length - 1];
+    concurrencyArea.textContent = "Parallel downloads: " + c.limit + (c.reason ? " (" + c.reason + ")" : "");
+  });
+  // One row per URL, updated in place instead of appending to the log. Each event
+  // carries the latest state of every download that changed since the last one.
+  evtSource.addEventListener("progress", function(e) {
+    JSON.parse(e.data).forEach(function(p) {
+      var row = rows[p.url];
+      if (!row) {
+        row = rows[p.url] = document.createElement("div");
+        row.className = "progress-row";
+        progressArea.appendChild(row);
+      }
+      row.textContent = formatProgress(p);
+    });
+  });
 });
 </script>
 {% endblock %}
 {% block content %}
   <h1>Download Progress</h1>
+  <p>Job <code>{{ job_id }}</code></p>
+  <p id="concurrency"></p>
+  <div id="progress"></div>
   <div id="log" class="log"></div>
   <p><a href="{{ url_for('index') }}">Back to Home</a></p>
 {% endblock %}
 """
 
+LIBRARY_HTML = """
+{% extends "base.html" %}
+{% block head %}
+<style>
+  .library { width: 100%; border-collapse: collapse; font-size: 0.85rem; margin-bottom: 1rem; }
+  .library th, .library td { text-align: left; padding: 0.35rem; border-bottom: 1px solid var(--border-color); }
+  .library td { max-width: 260px; overflow: hidden; text-overflow: ellipsis; white-space: nowrap; }
+</style>
+{% endblock %}
+{% block content %}
+  <h1>Library</h1>
+  <form action="{{ url_for('library') }}" method="GET">
+    <label for="q">Title, Channel or Video ID:</label>
+    <input type="text" id="q" name="q" value="{{ filters.search or '' }}">
+    <label for="folder">Folder (empty = all):</label>
+    <input type="text" id="folder" name="folder" value="{{ filters.folder or '' }}">
+    <button type="submit">Search</button>
+  </form>
+  <p>{{ total }} file(s)</p>
+  <table class="library">
+    <tr>
+      {% for column, heading in columns %}
+      <th><a href="{{ page_url(sort=column, order='asc' if filters.sort == column and filters.descending else 'desc', page=1) }}">{{ heading }}</a></th>
+      {% endfor %}
+      <th>Codecs</th>
+    </tr>
+    {% for row in rows %}
+    <tr>
+      <td>{{ row.added }}</td>
+      <td title="{{ row.path }}">{% if row.video_id %}<a href="https://www.youtube.com/watch?v={{ row.video_id }}">{{ row.title }}</a>{% else %}{{ row.title }}{% endif %}</td>
+      <td>{{ row.channel or '' }}</td>
+      <td>{{ row.length }}</td>
+      <td>{{ row.resolution }}</td>
+      <td>{{ row.megabytes }}</td>
+      <td>{{ row.codecs }}</td>
+    </tr>
+    {% endfor %}
+  </table>
+  <p>
+    {% if page > 1 %}<a href="{{ page_url(page=page - 1) }}">&larr; Previous</a>{% endif %}
+    Page {{ page }} of {{ pages }}
+    {% if page < pages %}<a href="{{ page_url(page=page + 1) }}">Next &rarr;</a>{% endif %}
+  </p>
+  <p><a href="{{ url_for('index') }}">Back to Home</a></p>
+{% endblock %}
+"""
+
 # --- Configure Jinja2 Loader ---
 app.jinja_loader = ChoiceLoader([
     DictLoader({"base.html": BASE_HTML}),
     app.jinja_loader,
 ])
 
+# --- Metrics ---
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                                           .replace('\n', '\\n'))
+                          for name, value in pairs) + '}'
+
+class Counter:
+    """
+    Monotonic value per label combination. `function`, if given, is called at scrape
+    time instead and returns a number or a {label values tuple: number} dict, for
+    values another component already tracks.
+    """
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=(), function=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        if self.function is not None:
+            values = self.function()
+            values = values if isinstance(values, dict) else {(): values}
+        else:
+            with self.lock:
+                values = dict(self.values)
+        return [(self.name, key, (), value) for key, value in values.items()]
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+class Histogram(Counter):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self):
+        with self.lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self.values.items()}
+        samples = []
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                samples.append((self.name + '_bucket', key, (('le', bound),), cumulative))
+            samples.append((self.name + '_sum', key, (), total))
+            samples.append((self.name + '_count', key, (), cumulative))
+        return samples
+
+class MetricsRegistry:
+    """Process-wide metrics rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            for name, key, extra, value in metric.samples():
+                lines.append('{}{} {}'.format(name, format_labels(metric.labelnames, key, extra), float(value)))
+        return '\n'.join(lines) + '\n'
+
+# yt-dlp warning/error lines are bucketed by the first pattern they match.
+ERROR_CATEGORIES = [
+    ('rate_limited', re.compile(r'HTTP Error 429|Too Many Requests', re.I)),
+    ('forbidden', re.compile(r'HTTP Error 403|Forbidden', re.I)),
+    ('sign_in', re.compile(r'Sign in to confirm|login required|members[- ]only|age[- ]restricted', re.I)),
+    ('private', re.compile(r'Private video', re.I)),
+    ('geo_blocked', re.compile(r'not available in your country|geo[- ]?restrict', re.I)),
+    ('unavailable', re.compile(r'Video unavailable|has been removed|does not exist|HTTP Error 404', re.I)),
+    ('network', re.compile(r'timed out|Connection|Temporary failure|Name or service|Errno', re.I)),
+    ('format', re.compile(r'Requested format is not available|No video formats', re.I)),
+    ('ffmpeg', re.compile(r'ffmpeg|ffprobe|Postprocessing', re.I)),
+]
+
+def error_category(message):
+    for category, pattern in ERROR_CATEGORIES:
+        if pattern.search(message):
+            return category
+    return 'other'
+
+metrics = MetricsRegistry()
+METRIC_JOBS = metrics.register(Counter('ytdl_jobs_total', 'Jobs by lifecycle event.', ['event']))
+METRIC_JOBS_RUNNING = metrics.register(Gauge('ytdl_jobs_running', 'Jobs currently running.'))
+METRIC_ITEMS = metrics.register(Counter('ytdl_items_total', 'Items by final state.', ['state']))
+METRIC_ITEMS_QUEUED = metrics.register(Gauge('ytdl_items_queued', 'Items waiting for a download worker.'))
+METRIC_DOWNLOADS_ACTIVE = metrics.register(Gauge('ytdl_downloads_active', 'Items in the extract/download stage.'))
+METRIC_POSTPROCESS_ACTIVE = metrics.register(Gauge('ytdl_postprocess_active', 'Items being converted.'))
+METRIC_POSTPROCESS_QUEUED = metrics.register(Gauge(
+    'ytdl_postprocess_queued', 'Downloaded items waiting for a post-processing worker.',
+    function=lambda: postprocess_pool.tasks.qsize()))
+METRIC_BYTES = metrics.register(Counter('ytdl_downloaded_bytes_total', 'Bytes received from media servers.'))
+METRIC_STAGE_SECONDS = metrics.register(Histogram(
+    'ytdl_stage_duration_seconds', 'Time spent per pipeline stage (extract, download, merge, convert).',
+    ['stage']))
+METRIC_STAGE_ERRORS = metrics.register(Counter('ytdl_stage_errors_total', 'Failures per pipeline stage.',
+                                               ['stage']))
+METRIC_LOG_MESSAGES = metrics.register(Counter('ytdl_log_messages_total',
+                                               'yt-dlp warnings and errors by category.', ['level', 'category']))
+METRIC_ARCHIVE_SKIPS = metrics.register(Counter('ytdl_archive_skips_total',
+                                                'Videos skipped because the archive already has them.'))
+metrics.register(Counter('ytdl_info_cache_lookups_total', 'Metadata cache lookups.', ['result'],
+                         function=lambda: {('hit',): info_cache.hits, ('miss',): info_cache.misses}))
+metrics.register(Gauge('ytdl_info_cache_hit_ratio', 'Share of metadata lookups served from the cache.',
+                       function=lambda: info_cache.stats()['hit_rate']))
+metrics.register(Counter('ytdl_ydl_pool_checkouts_total', 'YoutubeDL checkouts by whether an instance was reused.',
+                         ['result'], function=lambda: {('reused',): ydl_pool.reused, ('created',): ydl_pool.created}))
+metrics.register(Gauge('ytdl_fragment_connections_in_use', 'Fragment connections reserved by running downloads.',
+                       function=lambda: fragment_tuner.in_use))
+metrics.register(Gauge('ytdl_fragment_connection_budget', 'Process-wide fragment connection budget.',
+                       function=lambda: fragment_tuner.budget))
+METRIC_CONCURRENCY_CHANGES = metrics.register(Counter(
+    'ytdl_concurrency_adjustments_total', 'Adaptive slot changes by direction.', ['direction']))
+metrics.register(Gauge('ytdl_concurrency_limit', 'Download slots granted to each running adaptive job.', ['job'],
+                       function=lambda: {(job_id,): job['limit']
+                                         for job_id, job in concurrency_controller.snapshot()['jobs'].items()}))
+metrics.register(Gauge('ytdl_ydl_pool_in_use', 'YoutubeDL instances checked out.',
+                       function=lambda: ydl_pool.in_use))
+
+# --- Job Journal ---
+class JobStore:
+    """
+    Crash-safe record of download jobs. A job is one submitted batch; each URL
+    in it is an item row carrying its state, output path, byte offsets and error.
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        folder TEXT NOT NULL,
+        download_audio INTEGER NOT NULL,
+        concurrency INTEGER NOT NULL,
+        state TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        finished_at REAL,
+        max_items INTEGER NOT NULL DEFAULT 0,
+        date_after TEXT,
+        priority INTEGER NOT NULL DEFAULT 5,
+        rate_limit INTEGER NOT NULL DEFAULT 0,
+        fragments INTEGER NOT NULL DEFAULT 0,
+        adaptive INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        job_id TEXT NOT NULL REFERENCES jobs(id),
+        parent_id INTEGER REFERENCES items(id),
+        url TEXT NOT NULL,
+        state TEXT NOT NULL,
+        part_path TEXT,
+        output_path TEXT,
+        downloaded_bytes INTEGER NOT NULL DEFAULT 0,
+        total_bytes INTEGER,
+        error TEXT,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS items_job_state ON items(job_id, state);
+    CREATE INDEX IF NOT EXISTS items_job_url ON items(job_id, url);
+    """
+    # Columns added after the first release; ALTERed into older journals on open.
+    MIGRATIONS = {
+        'jobs': [('max_items', "INTEGER NOT NULL DEFAULT 0"), ('date_after', "TEXT"),
+                 ('priority', "INTEGER NOT NULL DEFAULT 5"), ('rate_limit', "INTEGER NOT NULL DEFAULT 0"),
+                 ('fragments', "INTEGER NOT NULL DEFAULT 0"), ('adaptive', "INTEGER NOT NULL DEFAULT 0")],
+        'items': [('parent_id', "INTEGER REFERENCES items(id)")],
+    }
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # Autocommit so every state change is durable the moment it is made.
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._migrate()
+        self.conn.executescript(self.SCHEMA)
+
+    def _migrate(self):
+        for table, columns in self.MIGRATIONS.items():
+            existing = {row['name'] for row in self.conn.execute("PRAGMA table_info({})".format(table))}
+            if not existing:
+                continue  # Fresh journal; SCHEMA creates the table with every column.
+            for name, declaration in columns:
+                if name not in existing:
+                    self.conn.execute("ALTER TABLE {} ADD COLUMN {} {}".format(table, name, declaration))
+
+    def create_job(self, urls, download_audio, folder, concurrency, max_items=0, date_after=None,
+                   priority=DEFAULT_PRIORITY, rate_limit=0, fragments=0, adaptive=False, state='running'):
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self.conn.execute(
+                "INSERT INTO jobs (id, folder, download_audio, concurrency, state, created_at, max_items, date_after, "
+                "priority, rate_limit, fragments, adaptive) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, folder, int(bool(download_audio)), concurrency, state, now, max_items, date_after,
+                 priority, rate_limit, fragments, int(bool(adaptive))))
+            self.conn.executemany(
+                "INSERT INTO items (job_id, url, state, updated_at) VALUES (?, ?, 'queued', ?)",
+                [(job_id, url, now) for url in urls])
+            self.conn.execute("COMMIT")
+        return job_id
+
+    def get_job(self, job_id):
+        with self.lock:
+            return self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def pending_items(self, job_id):
+        """Items that still need work, including ones interrupted mid-download."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT id, url FROM items WHERE job_id = ? AND state IN ('queued', 'downloading', 'downloaded') "
+                "ORDER BY id", (job_id,)).fetchall()
+
+    def add_items(self, job_id, urls, parent_id=None):
+        """Append URLs discovered while the job runs; returns only the (id, url) rows not already in the job."""
+        added = []
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN")
+            for url in urls:
+                if self.conn.execute("SELECT 1 FROM items WHERE job_id = ? AND url = ?", (job_id, url)).fetchone():
+                    continue
+                cursor = self.conn.execute(
+                    "INSERT INTO items (job_id, parent_id, url, state, updated_at) VALUES (?, ?, ?, 'queued', ?)",
+                    (job_id, parent_id, url, now))
+                added.append((cursor.lastrowid, url))
+            self.conn.execute("COMMIT")
+        return added
+
+    def update_item(self, item_id, **fields):
+        fields['updated_at'] = time.time()
+        columns = ", ".join("{} = ?".format(name) for name in fields)
+        with self.lock:
+            self.conn.execute("UPDATE items SET {} WHERE id = ?".format(columns),
+                              list(fields.values()) + [item_id])
+
+    def update_job(self, job_id, **fields):
+        columns = ", ".join("{} = ?".format(name) for name in fields)
+        with self.lock:
+            self.conn.execute("UPDATE jobs SET {} WHERE id = ?".format(columns), list(fields.values()) + [job_id])
+
+    def finish_job(self, job_id):
+        with self.lock:
+            self.conn.execute("UPDATE jobs SET state = 'finished', finished_at = ? WHERE id = ?",
+                              (time.time(), job_id))
+
+    def finished_outputs(self):
+        """(url, output_path) of every item that finished with a file."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT url, output_path FROM items WHERE state = 'finished' AND output_path IS NOT NULL"
+            ).fetchall()
+
+    def relocate_outputs(self, moves):
+        """Rewrite the output paths of moved files ({old path: new path}) in one pass over the items."""
+        if not moves:
+            return
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS moves (old TEXT PRIMARY KEY, new TEXT NOT NULL)")
+            self.conn.executemany("INSERT OR REPLACE INTO moves (old, new) VALUES (?, ?)", moves.items())
+            self.conn.execute("UPDATE items SET output_path = (SELECT new FROM moves WHERE old = items.output_path) "
+                              "WHERE output_path IN (SELECT old FROM moves)")
+            self.conn.execute("DELETE FROM moves")
+            self.conn.execute("COMMIT")
+
+    def list_jobs(self, limit, offset=0, state=None):
+        """One page of jobs, newest first, with the total count for the same filter."""
+        where, params = ("WHERE state = ?", [state]) if state else ("", [])
+        with self.lock:
+            total = self.conn.execute("SELECT COUNT(*) FROM jobs " + where, params).fetchone()[0]
+            rows = self.conn.execute("SELECT * FROM jobs {} ORDER BY created_at DESC LIMIT ? OFFSET ?".format(where),
+                                     params + [limit, offset]).fetchall()
+        return rows, total
+
+    def item_counts(self, job_id):
+        with self.lock:
+            return dict(self.conn.execute(
+                "SELECT state, COUNT(*) FROM items WHERE job_id = ? GROUP BY state", (job_id,)).fetchall())
+
+    def list_items(self, job_id, after_id=0, limit=API_PAGE_SIZE, state=None):
+        """Keyset-paginated items of a job (stable while the job keeps adding rows)."""
+        sql = "SELECT * FROM items WHERE job_id = ? AND id > ?"
+        params = [job_id, after_id]
+        if state:
+            sql += " AND state = ?"
+            params.append(state)
+        with self.lock:
+            return self.conn.execute(sql + " ORDER BY id LIMIT ?", params + [limit]).fetchall()
+
+    def fail_submitting_jobs(self):
+        """Fail jobs whose submission was cut off by a crash; returns how many there were."""
+        with self.lock:
+            return self.conn.execute("UPDATE jobs SET state = 'failed', finished_at = ? WHERE state = 'submitting'",
+                                     (time.time(),)).rowcount
+
+    def unfinished_jobs(self):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT * FROM jobs WHERE state = 'running' ORDER BY created_at").fetchall()
+
+job_store = JobStore(JOB_DB_PATH)
+
+# --- Metadata Cache ---
+YOUTUBE_ID_RE = re.compile(
+    r'(?:youtube(?:-nocookie)?\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/|v/)|youtu\.be/)([\w-]{11})')
+
+def canonical_video_id(url):
+    """Return the YouTube video ID in `url` (or a bare 11-character ID), else None."""
+    match = YOUTUBE_ID_RE.search(url)
+    if match:
+        return match.group(1)
+    if re.fullmatch(r'[\w-]{11}', url):
+        return url
+    return None
+
+class InfoCache:
+    """
+    Two-level cache of sanitized yt-dlp info dicts: an in-memory LRU in front of
+    one JSON file per entry on disk. Entries expire after `ttl` seconds.
+    """
+
+    def __init__(self, directory, ttl=INFO_CACHE_TTL, max_memory=INFO_CACHE_MAX_MEMORY,
+                 max_disk=INFO_CACHE_MAX_DISK):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_memory = max_memory
+        self.max_disk = max_disk
+        self.memory = OrderedDict()  # key -> (fetched_at, info JSON text)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.puts_since_prune = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, key):
+        """Return a fresh copy of the cached info for `key`, or None if missing or expired."""
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.memory.move_to_end(key)
+        if entry is None:
+            try:
+                with open(self._path(key), encoding='utf-8') as f:
+                    stored = json.load(f)
+                entry = (stored['fetched_at'], json.dumps(stored['info']))
+            except (OSError, ValueError, KeyError):
+                entry = None
+        with self.lock:
+            if entry is None or now - entry[0] > self.ttl:
+                self.memory.pop(key, None)
+                self.misses += 1
+                return None
+            self._remember(key, entry)
+            self.hits += 1
+        return json.loads(entry[1])
+
+    def put(self, key, info):
+        entry = (time.time(), json.dumps(info))
+        with self.lock:
+            self._remember(key, entry)
+            self.puts_since_prune += 1
+            prune = self.puts_since_prune >= 100
+            if prune:
+                self.puts_since_prune = 0
+        temp = self._path(key) + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            f.write('{"fetched_at": %r, "info": %s}' % (entry[0], entry[1]))
+        os.replace(temp, self._path(key))
+        if prune:
+            self.prune_disk()
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory:
+            self.memory.popitem(last=False)
+            self.evictions += 1
+
+    def prune_disk(self):
+        """Delete expired files, then the least recently written ones beyond max_disk."""
+        now = time.time()
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.json'):
+                continue
+            mtime = entry.stat().st_mtime
+            if now - mtime > self.ttl:
+                os.remove(entry.path)
+            else:
+                files.append((mtime, entry.path))
+        files.sort()
+        for _, path in files[:max(0, len(files) - self.max_disk)]:
+            os.remove(path)
+            with self.lock:
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'memory_entries': len(self.memory)}
+
+info_cache = InfoCache(INFO_CACHE_DIR)
+
+def extract_info_cached(ydl, url):
+    """
+    Extract `url` without downloading, reusing a cached info dict when one is still valid.
+    Only single videos are cached; playlists are returned as extracted.
+    """
+    key = canonical_video_id(url) or url
+    info = info_cache.get(key)
+    if info is not None:
+        return info
+    started = time.monotonic()
+    info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+    METRIC_STAGE_SECONDS.observe(time.monotonic() - started, stage='extract')
+    if info.get('_type', 'video') == 'video':
+        info_cache.put(key, info)
+    return info
+
+# --- Download Archive ---
+def download_profile(download_audio):
+    return 'mp3' if download_audio else 'mp4'
+
+class ArchiveIndex:
+    """
+    Append-only JSON-lines index of the videos already downloaded into one folder,
+    keyed by (video ID, profile). Later lines override earlier ones.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, ARCHIVE_FILENAME)
+        self.entries = {}
+        self.lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        self.entries[(record['id'], record['profile'])] = record
+                    except (ValueError, KeyError):
+                        continue  # Torn last line after a crash.
+        except FileNotFoundError:
+            pass
+
+    def lookup(self, video_id, profile):
+        """Return the archived file path for the video, or None if missing or deleted."""
+        with self.lock:
+            record = self.entries.get((video_id, profile))
+        if record is None:
+            return None
+        path = os.path.join(self.folder, record['file'])
+        return path if os.path.exists(path) else None
+
+    def add(self, video_id, profile, path, format_id=None):
+        record = {'id': video_id, 'profile': profile, 'format': format_id,
+                  'file': os.path.relpath(path, self.folder), 'recorded_at': time.time()}
+        with self.lock:
+            self.entries[(video_id, profile)] = record
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + '\n')
+
+    def rebuild(self, probe=True):
+        """
+        Re-create the index from the files on disk. IDs come from the job journal,
+        then from the sharded folder name or a "[<id>]" in the filename, then (if
+        `probe`) from the comment tag finalizing writes (see video_id_metadata).
+        Returns (files indexed, files whose ID could not be determined).
+        """
+        known = {}
+        for row in job_store.finished_outputs():
+            video_id = canonical_video_id(row['url'])
+            if video_id:
+                known[os.path.abspath(row['output_path'])] = video_id
+        entries = {}
+        unknown = 0
+        for directory, subdirs, names in os.walk(self.folder):
+            subdirs[:] = [name for name in subdirs if not name.startswith('.')
+                          and not (directory == self.folder and name == TITLE_LINKS_DIRNAME)]
+            for name in names:
+                if not name.lower().endswith(MEDIA_EXTENSIONS):
+                    continue
+                path = os.path.join(directory, name)
+                relative = os.path.relpath(path, self.folder)
+                video_id = known.get(os.path.abspath(path))
+                if video_id is None:
+                    video_id = sharded_video_id(relative)
+                if video_id is None:
+                    match = re.search(r'\[([\w-]{11})\]', name)
+                    video_id = match.group(1) if match else None
+                if video_id is None and probe:
+                    video_id = probe_video_id(path)
+                if video_id is None:
+                    unknown += 1
+                    continue
+                profile = 'mp3' if name.lower().endswith('.mp3') else 'mp4'
+                entries[(video_id, profile)] = {'id': video_id, 'profile': profile, 'format': None,
+                                                'file': relative, 'recorded_at': os.path.getmtime(path)}
+        with self.lock:
+            self.entries = entries
+            self._write()
+        return len(entries), unknown
+
+    def relocate(self, moves):
+        """Point records at files that were moved ({old path: new path}), rewriting the index once."""
+        if not moves:
+            return
+        with self.lock:
+            for record in self.entries.values():
+                new = moves.get(os.path.join(self.folder, record['file']))
+                if new:
+                    record['file'] = os.path.relpath(new, self.folder)
+            self._write()
+
+    def _write(self):
+        temp = self.path + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            for record in self.entries.values():
+                f.write(json.dumps(record) + '\n')
+        os.replace(temp, self.path)
+
+def probe_video_id(path):
+    """Find a YouTube ID in the comment tag finalizing writes, or yt-dlp's purl/comment tags."""
+    ffprobe = shutil.which('ffprobe')
+    if not ffprobe:
+        return None
+    try:
+        result = subprocess.run([ffprobe, '-v', 'error', '-show_entries', 'format_tags', '-of', 'json', path],
+                                capture_output=True, text=True, check=True)
+        tags = json.loads(result.stdout).get('format', {}).get('tags', {})
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+    return tags_video_id(tags)
+
+def tags_video_id(tags):
+    for name in ('purl', 'PURL', 'comment', 'COMMENT', 'description'):
+        video_id = canonical_video_id(tags.get(name) or '')
+        if video_id and video_id != tags.get(name):
+            return video_id
+    return None
+
+archive_indexes = {}
+archive_indexes_lock = threading.Lock()
+
+def get_archive(folder):
+    folder = os.path.abspath(folder)
+    with archive_indexes_lock:
+        archive = archive_indexes.get(folder)
+        if archive is None:
+            archive = archive_indexes[folder] = ArchiveIndex(folder)
+        return archive
+
+def archive_match_filter(info, context, incomplete=False):
+    """yt-dlp match_filter: skip extracted entries the folder archive already has."""
+    archive = context.get('archive')
+    if archive is None or not info.get('id'):
+        return None
+    path = archive.lookup(info['id'], context.get('profile'))
+    if path:
+        message = "Already downloaded as " + os.path.basename(path) + ", skipping"
+        # yt-dlp asks again in process_ie_result and process_info; report each skip once per item.
+        reported = context.setdefault('archive_skips', set())
+        if info['id'] not in reported:
+            reported.add(info['id'])
+            METRIC_ARCHIVE_SKIPS.inc()
+            log_message(message, context.get('url'), context.get('job_id'))
+        return message
+    return None
+
+# --- Library Catalog ---
+def probe_media(path):
+    """Duration, resolution, codecs and tags of a media file via ffprobe, or None if it cannot be probed."""
+    ffprobe = shutil.which('ffprobe')
+    if not ffprobe:
+        return None
+    try:
+        result = subprocess.run(
+            [ffprobe, '-v', 'error', '-show_entries',
+             'format=duration:format_tags:stream=codec_type,codec_name,width,height:stream_disposition=attached_pic',
+             '-of', 'json', path],
+            capture_output=True, text=True, check=True)
+        data = json.loads(result.stdout)
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+    streams = data.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'
+                  and not (s.get('disposition') or {}).get('attached_pic')), {})
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), {})
+    try:
+        duration = float(data.get('format', {}).get('duration'))
+    except (TypeError, ValueError):
+        duration = None
+    return {'duration': duration, 'width': video.get('width'), 'height': video.get('height'),
+            'vcodec': video.get('codec_name'), 'acodec': audio.get('codec_name'),
+            'tags': data.get('format', {}).get('tags') or {}}
+
+def short_codec(codec):
+    """'avc1.64001F' -> 'avc1'; yt-dlp's 'none' -> None."""
+    return codec.split('.')[0] if codec and codec != 'none' else None
+
+def is_library_file(name):
+    lower = name.lower()
+    return lower.endswith(MEDIA_EXTENSIONS) and not LIBRARY_SKIP_RE.search(lower)
+
+class LibraryCatalog:
+    """
+    Catalog of the media files in download folders, stored next to the job journal.
+    Downloads are recorded with their metadata as they finish; reconcile() picks up
+    files added or removed behind the app's back.
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS library (
+        path TEXT PRIMARY KEY,
+        folder TEXT NOT NULL,
+        dir TEXT NOT NULL,
+        video_id TEXT,
+        title TEXT,
+        channel TEXT,
+        duration REAL,
+        width INTEGER,
+        height INTEGER,
+        vcodec TEXT,
+        acodec TEXT,
+        size INTEGER NOT NULL,
+        profile TEXT,
+        source TEXT NOT NULL,
+        added_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS library_dir ON library(dir);
+    CREATE INDEX IF NOT EXISTS library_folder_added ON library(folder, added_at);
+    CREATE INDEX IF NOT EXISTS library_video ON library(video_id);
+    CREATE TABLE IF NOT EXISTS library_dirs (
+        path TEXT PRIMARY KEY,
+        mtime_ns INTEGER NOT NULL,
+        subdirs TEXT NOT NULL
+    );
+    """
+    COLUMNS = ('path', 'folder', 'dir', 'video_id', 'title', 'channel', 'duration', 'width', 'height',
+               'vcodec', 'acodec', 'size', 'profile', 'source', 'added_at')
+    SORT_COLUMNS = ('added_at', 'title', 'channel', 'duration', 'height', 'size')
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def _insert(self, rows, replace=True):
+        sql = "INSERT OR {} INTO library ({}) VALUES ({})".format(
+            "REPLACE" if replace else "IGNORE", ", ".join(self.COLUMNS), ", ".join("?" * len(self.COLUMNS)))
+        self.conn.executemany(sql, [[row.get(name) for name in self.COLUMNS] for row in rows])
+
+    def record(self, path, folder, info, profile):
+        """Catalog a finished download, preferring what ffprobe reports over yt-dlp's format info."""
+        path = os.path.abspath(path)
+        media = probe_media(path)
+        row = {'path': path, 'folder': os.path.abspath(folder), 'dir': os.path.dirname(path),
+               'video_id': info.get('id'), 'title': info.get('title'),
+               'channel': info.get('channel') or info.get('uploader'), 'duration': info.get('duration'),
+               'size': os.path.getsize(path), 'profile': profile, 'source': 'download', 'added_at': time.time()}
+        if media is not None:
+            row.update((name, media[name]) for name in ('width', 'height', 'vcodec', 'acodec'))
+            row['duration'] = media['duration'] or row['duration']
+        elif profile == 'mp3':
+            row['acodec'] = 'mp3'
+        else:
+            row.update(width=info.get('width'), height=info.get('height'),
+                       vcodec=short_codec(info.get('vcodec')), acodec=short_codec(info.get('acodec')))
+        with self.lock:
+            self._insert([row])
+
+    def _scanned_row(self, folder, path, stat, archive_ids):
+        """Catalog entry for a file found on disk: ID from the archive, the filename or its tags."""
+        media = probe_media(path) or {}
+        tags = {name.lower(): value for name, value in (media.get('tags') or {}).items()}
+        name = os.path.splitext(os.path.basename(path))[0]
+        match = re.search(r'\s*\[([\w-]{11})\]', name)
+        video_id = archive_ids.get(path) or (match.group(1) if match else None) or tags_video_id(tags)
+        return {'path': path, 'folder': folder, 'dir': os.path.dirname(path), 'video_id': video_id,
+                'title': tags.get('title') or (name.replace(match.group(0), '') if match else name),
+                'channel': tags.get('artist'), 'duration': media.get('duration'), 'width': media.get('width'),
+                'height': media.get('height'), 'vcodec': media.get('vcodec'), 'acodec': media.get('acodec'),
+                'size': stat.st_size, 'profile': 'mp3' if path.lower().endswith('.mp3') else 'mp4',
+                'source': 'scan', 'added_at': stat.st_mtime}
+
+    def _forget_trees(self, directories):
+        for directory in directories:
+            prefix = directory + os.sep
+            for table, column in (('library', 'dir'), ('library_dirs', 'path')):
+                self.conn.execute("DELETE FROM {0} WHERE {1} = ? OR substr({1}, 1, ?) = ?".format(table, column),
+                                  (directory, len(prefix), prefix))
+
+    def _scan_dir(self, folder, directory, mtime_ns, known_subdirs, archive_ids):
+        files, subdirs = {}, []
+        for entry in os.scandir(directory):
+            if entry.name.startswith('.'):
+                continue  # .info_cache, .download_archive.jsonl and other app state
+            if entry.is_dir(follow_symlinks=False):
+                if entry.path != os.path.join(folder, TITLE_LINKS_DIRNAME):
+                    subdirs.append(entry.path)
+            elif entry.is_file() and is_library_file(entry.name):
+                files[entry.path] = entry.stat()
+        with self.lock:
+            cataloged = {row['path'] for row in self.conn.execute(
+                "SELECT path FROM library WHERE dir = ?", (directory,))}
+        # ffprobe runs outside the lock; a download recorded meanwhile wins over the scan (INSERT OR IGNORE).
+        new_rows = [self._scanned_row(folder, path, files[path], archive_ids) for path in files
+                    if path not in cataloged]
+        # A download may have landed after the listing: only forget files that are really gone.
+        gone = [path for path in cataloged if path not in files and not os.path.exists(path)]
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("DELETE FROM library WHERE path = ?", [(path,) for path in gone])
+            self._insert(new_rows, replace=False)
+            self._forget_trees(set(known_subdirs) - set(subdirs))
+            self.conn.execute("INSERT OR REPLACE INTO library_dirs (path, mtime_ns, subdirs) VALUES (?, ?, ?)",
+                              (directory, mtime_ns, json.dumps(subdirs)))
+            self.conn.execute("COMMIT")
+        return len(new_rows), len(gone), subdirs
+
+    def reconcile(self, folders):
+        """
+        Bring the catalog in line with the files under `folders`. Directories whose
+        mtime is unchanged are only stat()ed (their subdirectories come from the last
+        pass), so a quiet tree costs one stat per directory. Returns (added, removed).
+        """
+        added = removed = 0
+        for folder in folders:
+            folder = os.path.abspath(folder)
+            if not os.path.isdir(folder):
+                continue  # Maybe an unmounted drive: keep its entries until it is back.
+            with self.lock:
+                known = {row['path']: (row['mtime_ns'], json.loads(row['subdirs'])) for row in self.conn.execute(
+                    "SELECT * FROM library_dirs WHERE path = ? OR substr(path, 1, ?) = ?",
+                    (folder, len(folder) + 1, folder + os.sep))}
+            archive_ids = None
+            stack = [folder]
+            while stack:
+                directory = stack.pop()
+                try:
+                    mtime_ns = os.stat(directory).st_mtime_ns
+                except OSError:
+                    continue  # Removed since the parent was listed; the parent's next pass forgets it.
+                mtime_known, subdirs = known.get(directory, (None, []))
+                if mtime_known != mtime_ns:
+                    if archive_ids is None:
+                        archive = get_archive(folder)
+                        with archive.lock:
+                            archive_ids = {os.path.join(folder, record['file']): video_id
+                                           for (video_id, _), record in archive.entries.items()}
+                    try:
+                        new, gone, subdirs = self._scan_dir(folder, directory, mtime_ns, subdirs, archive_ids)
+                    except OSError as e:
+                        logging.warning("Library scan of %s failed: %s", directory, e)
+                        continue
+                    added += new
+                    removed += gone
+                stack.extend(subdirs)
+        return added, removed
+
+    def relocate(self, moves):
+        """Follow files that were moved ({old path: new path})."""
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("UPDATE OR REPLACE library SET path = ?, dir = ? WHERE path = ?",
+                                  [(new, os.path.dirname(new), old) for old, new in moves.items()])
+            self.conn.execute("COMMIT")
+
+    def folders(self):
+        """Every folder a job downloaded into or the catalog already covers."""
+        with self.lock:
+            rows = self.conn.execute("SELECT folder FROM jobs UNION SELECT folder FROM library").fetchall()
+        return sorted({os.path.abspath(row[0]) for row in rows})
+
+    def list_files(self, limit, offset=0, folder=None, search=None, channel=None, profile=None,
+                   sort='added_at', descending=True):
+        """One page of catalog entries with the total count for the same filter."""
+        clauses, params = [], []
+        if folder:
+            clauses.append("folder = ?")
+            params.append(os.path.abspath(folder))
+        if channel:
+            clauses.append("channel = ?")
+            params.append(channel)
+        if profile:
+            clauses.append("profile = ?")
+            params.append(profile)
+        if search:
+            pattern = "%" + re.sub(r'([\\%_])', r'\\\1', search) + "%"
+            clauses.append("(title LIKE ? ESCAPE '\\' OR channel LIKE ? ESCAPE '\\' OR video_id = ?)")
+            params += [pattern, pattern, search]
+        where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+        order = "{} {}".format(sort if sort in self.SORT_COLUMNS else 'added_at', "DESC" if descending else "ASC")
+        if sort in ('title', 'channel'):
+            order = order.replace(" ", " COLLATE NOCASE ", 1)
+        with self.lock:
+            total = self.conn.execute("SELECT COUNT(*) FROM library " + where, params).fetchone()[0]
+            rows = self.conn.execute("SELECT * FROM library {} ORDER BY {}, path LIMIT ? OFFSET ?".format(
+                where, order), params + [limit, offset]).fetchall()
+        return rows, total
+
+library_catalog = LibraryCatalog(JOB_DB_PATH)
+
+def run_library_reconciler(interval=LIBRARY_RECONCILE_INTERVAL):
+    """Background loop keeping the catalog in line with files added or deleted outside the app."""
+    while True:
+        try:
+            folders = set(library_catalog.folders())
+            folders.add(os.path.abspath(last_selected_folder))
+            added, removed = library_catalog.reconcile(sorted(folders))
+            if added or removed:
+                logging.info("Library: %d file(s) added, %d removed outside the app", added, removed)
+        except Exception:
+            logging.exception("Library reconcile failed")
+        time.sleep(interval)
+
+# --- Output Layout ---
+def folder_layout(folder):
+    return 'sharded' if os.path.exists(os.path.join(folder, LAYOUT_MARKER)) else OUTPUT_LAYOUT
+
+def mark_sharded(folder):
+    with open(os.path.join(folder, LAYOUT_MARKER), 'a', encoding='utf-8'):
+        pass
+
+def shard_dir(folder, video_id):
+    """Directory of a video in the sharded layout (mirrors OUTPUT_TEMPLATES['sharded'])."""
+    return os.path.join(folder, video_id[0:2], video_id[2:4], video_id)
+
+def sharded_video_id(relative):
+    """The video ID of a path relative to a sharded folder (<ab>/<cd>/<id>/<file>), else None."""
+    parts = relative.split(os.sep)
+    if len(parts) != 4 or not re.fullmatch(r'[\w-]{11}', parts[2]):
+        return None
+    return parts[2] if parts[0] == parts[2][0:2] and parts[1] == parts[2][2:4] else None
+
+def title_links_dir(folder, title):
+    """by-title/<t>/<ti>/ for a title, so the links are spread like the files ('_' for other characters)."""
+    chars = [char if char.isalnum() else '_' for char in title.casefold()[:2].ljust(2, '_')]
+    return os.path.join(folder, TITLE_LINKS_DIRNAME, chars[0], chars[0] + chars[1])
+
+def link_title(folder, path, video_id):
+    """Link by-title/<t>/<ti>/<title> [<id>].<ext> to a sharded file; skipped where symlinks are not allowed."""
+    stem, ext = os.path.splitext(os.path.basename(path))
+    links = title_links_dir(folder, stem)
+    if video_id and "[" + video_id + "]" not in stem:
+        stem += " [" + video_id + "]"
+    link = os.path.join(links, stem + ext)
+    try:
+        os.makedirs(links, exist_ok=True)
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(os.path.relpath(path, links), link)
+    except OSError as e:
+        logging.debug("No title link for %s: %s", path, e)
+
+def migrate_to_sharded(folder, probe=True):
+    """
+    Move the media files at the top of a flat folder into the sharded layout, then
+    point the archive, catalog and job journal at the new paths in one batch each.
+    Moves are renames within the folder, and a run interrupted halfway is completed
+    by the next one. Returns (files moved, files left in place without a known ID).
+    """
+    folder = os.path.abspath(folder)
+    archive = get_archive(folder)
+    with archive.lock:
+        records = list(archive.entries.values())
+    # New downloads go straight into shards while the old files are moved.
+    mark_sharded(folder)
+    ids = {}
+    moves = {}
+    for record in records:
+        old = os.path.join(folder, record['file'])
+        ids[old] = record['id']
+        new = os.path.join(shard_dir(folder, record['id']), os.path.basename(old))
+        if not os.path.exists(old) and os.path.exists(new):
+            moves[old] = new  # Moved by an interrupted run that never updated the archive.
+    unarchived = set()
+    skipped = 0
+    for entry in os.scandir(folder):
+        if not entry.is_file(follow_symlinks=False) or not is_library_file(entry.name):
+            continue
+        video_id = ids.get(entry.path)
+        if video_id is None:
+            match = re.search(r'\[([\w-]{11})\]', entry.name)
+            video_id = match.group(1) if match else (probe_video_id(entry.path) if probe else None)
+            if video_id is not None:
+                unarchived.add(video_id)
+        if video_id is None:
+            skipped += 1
+            continue
+        target = os.path.join(shard_dir(folder, video_id), entry.name)
+        if os.path.exists(target):
+            logging.warning("Not moving %s: %s already exists", entry.path, target)
+            skipped += 1
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.rename(entry.path, target)
+        moves[entry.path] = target
+    archive.relocate(moves)
+    library_catalog.relocate(moves)
+    job_store.relocate_outputs(moves)
+    for old, new in moves.items():
+        video_id = os.path.basename(os.path.dirname(new))
+        if video_id in unarchived:
+            archive.add(video_id, 'mp3' if new.lower().endswith('.mp3') else 'mp4', new)
+        link_title(folder, new, video_id)
+    return len(moves), skipped
+
+# --- Bandwidth Governor ---
+def parse_rate(value):
+    """Parse a byte rate such as "500K", "2.5M" or "1048576" into bytes/s (0 = unlimited)."""
+    text = str(value or "").strip().upper().rstrip("B/S").rstrip("I")
+    if not text:
+        return 0
+    multiplier = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}.get(text[-1], 1)
+    if multiplier != 1:
+        text = text[:-1]
+    rate = float(text) * multiplier
+    if not math.isfinite(rate):
+        raise ValueError("rate must be a finite number: " + str(value))
+    return max(0, int(rate))
+
+class BandwidthGovernor:
+    """
+    Token buckets throttling every download in the process. Each running job gets
+    a bucket whose rate is the smaller of its own limit and its priority-weighted
+    share of the global limit; limits and priorities can change at any time and
+    take effect on the next chunk.
+    """
+
+    def __init__(self, global_rate=GLOBAL_RATE_LIMIT, job_rate=JOB_RATE_LIMIT):
+        self.global_rate = global_rate
+        self.job_rate = job_rate
+        self.jobs = {}  # job_id -> {'priority', 'rate_limit', 'allowance', 'updated'}
+        self.lock = threading.Lock()
+
+    def register(self, job_id, priority=DEFAULT_PRIORITY, rate_limit=0):
+        with self.lock:
+            self.jobs[job_id] = {'priority': priority, 'rate_limit': rate_limit,
+                                 'allowance': 0.0, 'updated': time.monotonic()}
+
+    def unregister(self, job_id):
+        with self.lock:
+            self.jobs.pop(job_id, None)
+
+    def configure(self, global_rate=None, job_rate=None):
+        with self.lock:
+            if global_rate is not None:
+                self.global_rate = global_rate
+            if job_rate is not None:
+                self.job_rate = job_rate
+
+    def configure_job(self, job_id, priority=None, rate_limit=None):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return False
+            if priority is not None:
+                job['priority'] = priority
+            if rate_limit is not None:
+                job['rate_limit'] = rate_limit
+            return True
+
+    def _job_rate(self, job):
+        rates = [rate for rate in (job['rate_limit'] or self.job_rate,) if rate]
+        if self.global_rate:
+            total_priority = sum(other['priority'] for other in self.jobs.values())
+            rates.append(self.global_rate * job['priority'] / total_priority)
+        return min(rates) if rates else 0
+
+    def consume(self, job_id, nbytes):
+        """Charge `nbytes` to the job's bucket and sleep off any deficit."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return
+            rate = self._job_rate(job)
+            now = time.monotonic()
+            if not rate:
+                job['allowance'] = 0.0
+                job['updated'] = now
+                return
+            # Allow up to one second of burst, and go into debt for the chunk just read.
+            job['allowance'] = min(rate, job['allowance'] + (now - job['updated']) * rate) - nbytes
+            job['updated'] = now
+            delay = -job['allowance'] / rate if job['allowance'] < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+    def snapshot(self):
+        with self.lock:
+            return {'global_limit': self.global_rate, 'job_limit': self.job_rate,
+                    'jobs': {job_id: {'priority': job['priority'], 'rate_limit': job['rate_limit'],
+                                      'effective_rate': self._job_rate(job)}
+                             for job_id, job in self.jobs.items()}}
+
+bandwidth_governor = BandwidthGovernor()
+
+def bandwidth_hook(d, context):
+    """Feed bytes read since the last callback to the governor (this may sleep the download thread)."""
+    if d.get("status") != "downloading" or context.get('job_id') is None:
+        return
+    with context['lock']:
+        filename = d.get("filename")
+        downloaded = d.get("downloaded_bytes") or 0
+        if context.get('bandwidth_file') != filename:
+            context['bandwidth_file'] = filename
+            context['bandwidth_bytes'] = downloaded
+        delta = downloaded - context['bandwidth_bytes']
+        context['bandwidth_bytes'] = downloaded
+    if delta > 0:
+        METRIC_BYTES.inc(delta)
+        concurrency_controller.record_bytes(context['job_id'], delta)
+        bandwidth_governor.consume(context['job_id'], delta)
+
+# --- Fragment Connections ---
+def parse_fragments(value):
+    """Clamp a user-supplied connection count to 0 (auto) or 1..MAX_FRAGMENT_CONCURRENCY."""
+    if str(value or "").strip().lower() in ("", "auto"):
+        return 0
+    try:
+        fragments = int(value)
+    except (TypeError, ValueError):
+        return 0
+    return max(0, min(fragments, MAX_FRAGMENT_CONCURRENCY))
+
+def range_fragments(fmt):
+    """
+    Describe a plain http(s) format of known size as DASH-style fragments, one per
+    RANGE_FRAGMENT_SIZE bytes, so yt-dlp fetches it over concurrent_fragment_downloads
+    connections. The range goes in googlevideo's `range` query parameter, the way
+    yt-dlp's own "dashy" YouTube formats do it.
+    """
+    size = fmt.get('filesize')
+    if fmt.get('protocol') not in ('http', 'https') or not size or size <= RANGE_FRAGMENT_SIZE:
+        return fmt
+    from yt_dlp.utils import update_url_query
+    return dict(fmt, protocol='http_dash_segments', fragments=[
+        {'url': update_url_query(fmt['url'], {'range': '{}-{}'.format(start, min(start + RANGE_FRAGMENT_SIZE, size) - 1)})}
+        for start in range(0, size, RANGE_FRAGMENT_SIZE)])
+
+def with_range_fragments(info):
+    """A copy of a YouTube `info` (which may be the cached one) with its formats passed through range_fragments."""
+    if info.get('extractor_key') != 'Youtube' or not info.get('formats'):
+        return info
+    return dict(info, formats=[range_fragments(fmt) for fmt in info['formats']])
+
+class FragmentTuner:
+    """
+    Decides yt-dlp's concurrent_fragment_downloads for each download and keeps the
+    total across the process within a connection budget. Auto jobs hill-climb: the
+    count doubles while throughput improves by FRAGMENT_TUNE_GAIN, reverses direction
+    when it drops, and holds on a plateau. A finished job's level seeds the next one,
+    so single-video jobs start from what earlier jobs learned. Only fragmented
+    downloads use the connections: DASH/HLS formats and http(s) formats split by
+    range_fragments.
+    """
+
+    def __init__(self, budget=CONNECTION_BUDGET, maximum=MAX_FRAGMENT_CONCURRENCY):
+        self.budget = budget
+        self.maximum = maximum
+        self.in_use = 0
+        self.learned = min(FRAGMENT_START_CONCURRENCY, maximum)
+        self.jobs = {}  # job_id -> {'fixed', 'level', 'direction', 'last_rate'}
+        self.lock = threading.Lock()
+
+    def register(self, job_id, fixed=0):
+        with self.lock:
+            self.jobs[job_id] = {'fixed': fixed, 'level': fixed or self.learned, 'direction': 1, 'last_rate': None}
+
+    def unregister(self, job_id):
+        with self.lock:
+            job = self.jobs.pop(job_id, None)
+            if job and not job['fixed'] and job['last_rate'] is not None:
+                self.learned = job['level']
+
+    def configure(self, budget=None):
+        with self.lock:
+            if budget is not None:
+                self.budget = max(1, budget)
+
+    def configure_job(self, job_id, fixed):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return False
+            job['fixed'] = fixed
+            job['level'] = fixed or job['level']
+            return True
+
+    def acquire(self, job_id):
+        """Reserve connections for one download; always at least one so downloads never stall."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            wanted = job['level'] if job else 1
+            granted = max(1, min(wanted, self.budget - self.in_use))
+            self.in_use += granted
+            return granted
+
+    def release(self, granted):
+        with self.lock:
+            self.in_use -= granted
+
+    def observe(self, job_id, connections, nbytes, elapsed):
+        """Feed the throughput of a finished fragmented download back into the job's level."""
+        if not elapsed or nbytes < FRAGMENT_TUNE_MIN_BYTES:
+            return
+        rate = nbytes / elapsed
+        with self.lock:
+            job = self.jobs.get(job_id)
+            # Samples cut short by the budget say nothing about the level being tried.
+            if job is None or job['fixed'] or connections != job['level']:
+                return
+            last = job['last_rate']
+            job['last_rate'] = rate
+            if last is not None and rate < last * FRAGMENT_TUNE_GAIN:
+                if rate > last / FRAGMENT_TUNE_GAIN:
+                    return
+                job['direction'] = -job['direction']
+            if job['direction'] > 0:
+                job['level'] = min(self.maximum, job['level'] * 2)
+            else:
+                job['level'] = max(1, job['level'] // 2)
+
+    def snapshot(self):
+        with self.lock:
+            return {'budget': self.budget, 'in_use': self.in_use, 'learned': self.learned,
+                    'jobs': {job_id: {'fixed': job['fixed'], 'level': job['level'], 'last_rate': job['last_rate']}
+                             for job_id, job in self.jobs.items()}}
+
+fragment_tuner = FragmentTuner()
+
+def fragment_hook(d, context):
+    """Report the throughput of each finished fragmented (DASH/HLS or range-split) file to the tuner."""
+    if context.get('job_id') is None:
+        return
+    status = d.get("status")
+    if status == "downloading" and d.get("fragment_count"):
+        context['fragmented'] = True
+    elif status == "finished" and context.pop('fragmented', False):
+        fragment_tuner.observe(context['job_id'], context.get('connections'),
+                               d.get("total_bytes") or d.get("downloaded_bytes") or 0, d.get("elapsed"))
+
+# --- Adaptive Concurrency ---
+class ConcurrencyController:
+    """
+    AIMD control of how many downloads each adaptive job runs at once. run_job starts
+    enough workers for the ceiling and each one takes a slot before pulling the next
+    item; a control thread resizes the slots from the bytes and throttling errors
+    recorded during the last interval. Jobs that are not registered are never gated.
+    """
+
+    def __init__(self, floor=CONCURRENCY_FLOOR, ceiling=CONCURRENCY_CEILING, interval=CONCURRENCY_INTERVAL):
+        self.floor = floor
+        self.ceiling = ceiling
+        self.interval = interval
+        self.jobs = {}  # job_id -> {'limit', 'workers', 'active', 'waiting', 'bytes', 'errors', 'average'}
+        self.cond = threading.Condition()
+        self.thread = None
+
+    def _clamp(self, limit, job):
+        return max(min(self.floor, job['workers']), min(limit, self.ceiling, job['workers']))
+
+    def configure(self, floor=None, ceiling=None):
+        with self.cond:
+            floor = self.floor if floor is None else floor
+            ceiling = self.ceiling if ceiling is None else ceiling
+            if not 1 <= floor <= ceiling:
+                raise ValueError("floor must be at least 1 and not above the ceiling")
+            self.floor = floor
+            self.ceiling = ceiling
+            for job in self.jobs.values():
+                job['limit'] = self._clamp(job['limit'], job)
+            self.cond.notify_all()
+
+    def register(self, job_id, initial, workers):
+        with self.cond:
+            job = {'workers': workers, 'active': 0, 'waiting': 0, 'bytes': 0, 'errors': 0, 'average': None}
+            job['limit'] = self._clamp(initial, job)
+            self.jobs[job_id] = job
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            return job['limit']
+
+    def unregister(self, job_id):
+        with self.cond:
+            self.jobs.pop(job_id, None)
+            self.cond.notify_all()
+
+    def acquire(self, job_id):
+        with self.cond:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return
+            job['waiting'] += 1
+            while job['active'] >= job['limit'] and self.jobs.get(job_id) is job:
+                self.cond.wait()
+            job['waiting'] -= 1
+            job['active'] += 1
+
+    def release(self, job_id):
+        with self.cond:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job['active'] -= 1
+                self.cond.notify_all()
+
+    def record_bytes(self, job_id, nbytes):
+        with self.cond:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job['bytes'] += nbytes
+
+    def record_error(self, job_id, category):
+        if category not in THROTTLE_CATEGORIES:
+            return
+        with self.cond:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job['errors'] += 1
+
+    def _adjust(self, job):
+        """One AIMD step; returns (old limit, new limit, bytes/s, reason) when the limit changed."""
+        rate = job['bytes'] / self.interval
+        errors = job['errors']
+        job['bytes'] = job['errors'] = 0
+        old = job['limit']
+        average = job['average']
+        reason = None
+        if errors:
+            job['limit'] = self._clamp(int(old * CONCURRENCY_DECREASE), job)
+            reason = "{} throttling error(s)".format(errors)
+        elif average and rate < average * CONCURRENCY_DROP and job['active'] >= old:
+            job['limit'] = self._clamp(int(old * CONCURRENCY_DECREASE), job)
+            reason = "throughput dropped"
+        elif job['active'] >= old and job['waiting']:
+            job['limit'] = self._clamp(old + 1, job)
+            reason = "all slots busy"
+        # Start a fresh average after a decrease so one slow interval is not punished twice.
+        job['average'] = rate if average is None or job['limit'] < old else 0.7 * average + 0.3 * rate
+        if job['limit'] == old:
+            return None
+        return old, job['limit'], rate, reason
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.cond:
+                decisions = [(job_id, self._adjust(job)) for job_id, job in self.jobs.items()]
+                self.cond.notify_all()
+            for job_id, decision in decisions:
+                if decision is None:
+                    continue
+                old, new, rate, reason = decision
+                METRIC_CONCURRENCY_CHANGES.inc(direction='up' if new > old else 'down')
+                publish_concurrency(job_id, new, rate, reason)
+                log_message("Parallel downloads {} -> {} ({}, {:.1f} MB/s)".format(old, new, reason, rate / 1e6),
+                            job_id=job_id)
+
+    def snapshot(self):
+        with self.cond:
+            return {'floor': self.floor, 'ceiling': self.ceiling, 'interval': self.interval,
+                    'jobs': {job_id: {'limit': job['limit'], 'active': job['active'], 'workers': job['workers'],
+                                      'average_rate': job['average']}
+                             for job_id, job in self.jobs.items()}}
+
+concurrency_controller = ConcurrencyController()
+
+def publish_concurrency(job_id, limit, rate=None, reason=None):
+    """Tell progress pages how many downloads the job currently runs in parallel."""
+    get_channel(job_id, create=True).publish({'limit': limit, 'rate': rate, 'reason': reason},
+                                             event='concurrency', key='concurrency')
+
+# --- Event Channels ---
+class EventChannel:
+    """
+    One job's events, fanned out to any number of subscribers. Log lines go to a
+    bounded ring buffer. Keyed events (per-download progress) only keep their latest
+    state, outside the ring, and reach subscribers coalesced: one frame per event type
+    listing every key that changed, at most PROGRESS_MAX_HZ times a second. A key's
+    final event is moved into the ring and the key is dropped.
+    """
+
+    def __init__(self, maxlen=EVENT_BUFFER_SIZE):
+        self.maxlen = maxlen
+        self.events = OrderedDict()  # event id -> (event id, event type, data)
+        self.keyed = {}  # key -> (event id, event type, latest value)
+        self.next_id = 1
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def publish(self, data, event=None, key=None, final=False):
+        with self.cond:
+            event_id = self.next_id
+            self.next_id += 1
+            if key is not None:
+                if not final:
+                    # Readers poll keyed state at the coalescing rate, so no wakeup here.
+                    self.keyed[key] = (event_id, event, data)
+                    return
+                self.keyed.pop(key, None)
+                data = json.dumps([data])
+            self.events[event_id] = (event_id, event, data)
+            while len(self.events) > self.maxlen:
+                self.events.popitem(last=False)
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def read_since(self, last_id, timeout, keyed_after=0.0):
+        """
+        Return (events newer than last_id, whether keyed frames are among them, closed),
+        waiting up to `timeout` for new ones. Events that already fell out of the ring
+        buffer are skipped. Keyed changes alone do not end the wait before the monotonic
+        time `keyed_after`; they always ride along with log events so last_id stays exact.
+        """
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                events = [event for event in self.events.values() if event[0] > last_id]
+                changed = [entry for entry in self.keyed.values() if entry[0] > last_id]
+                if events or self.closed or (changed and now >= keyed_after) or now >= deadline:
+                    break
+                wake = deadline if not changed else min(deadline, keyed_after)
+                self.cond.wait(min(wake - now, 1.0 / PROGRESS_MAX_HZ))
+            frames = {}  # event type -> (id of its newest change, values)
+            for event_id, event, value in sorted(changed, key=lambda entry: entry[0]):
+                values = frames[event][1] if event in frames else []
+                values.append(value)
+                frames[event] = (event_id, values)
+            events.extend((event_id, event, json.dumps(values)) for event, (event_id, values) in frames.items())
+            events.sort(key=lambda event: event[0])
+            return events, bool(changed), self.closed
+
+job_channels = OrderedDict()
+job_channels_lock = threading.Lock()
+
+def get_channel(job_id, create=False):
+    with job_channels_lock:
+        channel = job_channels.get(job_id)
+        if channel is None and create:
+            channel = job_channels[job_id] = EventChannel()
+            # Drop the oldest finished channels so memory stays bounded.
+            finished = [key for key, value in job_channels.items() if value.closed]
+            for key in finished[:max(0, len(finished) - MAX_FINISHED_CHANNELS)]:
+                del job_channels[key]
+        return channel
+
+def close_channel(job_id):
+    channel = get_channel(job_id, create=True)
+    channel.publish(EOF_MARKER)
+    channel.close()
+
 # --- Video Downloading Logic ---
-def log_message(message):
-    message_queue.put(message)
-
-def yt_dlp_hook(d):
-    if d.get("status") == "downloading":
-        downloaded = d.get("downloaded_bytes", 0)
-        total = d.get("total_bytes", 0) or d.get("total_bytes_estimate", 0)
-        if total:
-            percent = downloaded / total * 100
-            log_message("Downloading: {:.2f}%".format(percent))
-    elif d.get("status") == "finished":
-        log_message("Download finished, post-processing...")
+def log_message(message, url=None, job_id=None):
+    # Tag messages with their URL so parallel downloads can be told apart in the log.
+    if url:
+        message = "[{}] {}".format(url, message)
+    if job_id is None:
+        logging.info(message)
+        return
+    get_channel(job_id, create=True).publish(message)
+
+def publish_progress(context, stage, **fields):
+    """
+    Publish the progress of the download described by `context`. The job's channel
+    coalesces updates, so this only records the latest state.
+    """
+    job_id = context.get('job_id')
+    if job_id is None:
+        return
+    # Later stages keep the byte counts reported by the download stage.
+    event = context.setdefault('progress_fields', {})
+    event.update(fields, url=context.get('url'), stage=stage)
+    get_channel(job_id, create=True).publish(dict(event), event='progress', key=context.get('url'),
+                                             final=stage in FINAL_PROGRESS_STAGES)
+
+def yt_dlp_hook(d, context=None):
+    context = context if context is not None else {}
+    status = d.get("status")
+    if status not in ("downloading", "finished", "error"):
+        return
+    publish_progress(context, status,
+                     downloaded_bytes=d.get("downloaded_bytes") or 0,
+                     total_bytes=d.get("total_bytes") or d.get("total_bytes_estimate"),
+                     speed=d.get("speed"),
+                     eta=d.get("eta"),
+                     connections=context.get('connections'),
+                     filename=os.path.basename(d.get("filename") or ""))
+    if status == "finished":
+        if d.get("elapsed") is not None:
+            METRIC_STAGE_SECONDS.observe(d["elapsed"], stage='download')
+        log_message("Download finished, post-processing...", context.get('url'), context.get('job_id'))
+
+def postprocessor_hook(d, context):
+    """Time yt-dlp's own merge step, which runs inside the download stage."""
+    if d.get("postprocessor") != "Merger":
+        return
+    if d.get("status") == "started":
+        context['merge_started'] = time.monotonic()
+    elif d.get("status") == "finished" and context.get('merge_started') is not None:
+        METRIC_STAGE_SECONDS.observe(time.monotonic() - context.pop('merge_started'), stage='merge')
 
 class QueueLogger:
+    # `context` is shared with the owning worker, which updates context['url']
+    # before each download so log lines are tagged with the URL in progress
+    # and published to the channel of context['job_id'].
+    def __init__(self, context=None):
+        self.context = context if context is not None else {}
     def debug(self, msg):
         pass
     def warning(self, msg):
-        log_message("WARNING: " + msg)
+        METRIC_LOG_MESSAGES.inc(level='warning', category=error_category(msg))
+        log_message("WARNING: " + msg, self.context.get('url'), self.context.get('job_id'))
     def error(self, msg):
-        log_message("ERROR: " + msg)
+        category = error_category(msg)
+        METRIC_LOG_MESSAGES.inc(level='error', category=category)
+        if self.context.get('job_id') is not None:
+            concurrency_controller.record_error(self.context['job_id'], category)
+        log_message("ERROR: " + msg, self.context.get('url'), self.context.get('job_id'))
+
+def journal_hook(d, context):
+    """Persist the .part path and byte offset of the item in progress (rate limited)."""
+    item_id = context.get('item_id')
+    if item_id is None:
+        return
+    status = d.get("status")
+    now = time.time()
+    if status == "downloading" and now - context.get('journal_time', 0) < JOB_PROGRESS_INTERVAL:
+        return
+    if status in ("downloading", "finished"):
+        context['journal_time'] = now
+        job_store.update_item(item_id,
+                              part_path=d.get("tmpfilename") or d.get("filename"),
+                              downloaded_bytes=d.get("downloaded_bytes") or 0,
+                              total_bytes=d.get("total_bytes") or d.get("total_bytes_estimate"))
+
+def parse_concurrency(value):
+    """Clamp a user-supplied concurrency value to 1..MAX_CONCURRENCY."""
+    try:
+        concurrency = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_CONCURRENCY
+    return max(1, min(concurrency, MAX_CONCURRENCY))
+
+def parse_priority(value):
+    """Clamp a user-supplied priority to 1..MAX_PRIORITY."""
+    try:
+        priority = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PRIORITY
+    return max(1, min(priority, MAX_PRIORITY))
 
-def download_videos(urls, download_audio, folder):
-    os.makedirs(folder, exist_ok=True)
+def build_ydl_opts(download_audio, folder):
     ydl_opts = {
-        'outtmpl': os.path.join(folder, '%(title)s.%(ext)s'),
+        # The folder goes in 'paths' so pooled instances can be pointed at another one.
+        'outtmpl': OUTPUT_TEMPLATES[folder_layout(folder)],
+        'paths': {'home': folder},
+        # Resume from existing .part files, which is what makes job resumption cheap.
+        'continuedl': True,
         'progress_hooks': [yt_dlp_hook],
         'logger': QueueLogger()
     }
     if download_audio:
-        # Audio only: download best audio and convert to mp3
+        # Audio only: download best audio; the post-processing stage converts it to mp3
         ydl_opts['format'] = 'bestaudio/best'
-        ydl_opts['postprocessors'] = [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }]
     
     # else:
         # # Video download: download best video and best audio then convert to mp4
@@ -282,49 +2029,568 @@ def download_videos(urls, download_audio, folder):
         )
     
         # If the first expression (MP4/H.264) exists yt-dlp uses it.
-        # If not, it falls back to ANY best combination and we re-encode.
+        # If not, it falls back to ANY best combination and finalize_mp4()
+        # re-encodes only the streams that are not H.264/AAC.
     
         ydl_opts['merge_output_format'] = 'mp4'
-    
-        # Always run ffmpeg afterwards; forces H.264/AAC when input was VP9/WebM
-        ydl_opts['postprocessors'] = [{
-            'key': 'FFmpegVideoConvertor',
-            'preferedformat': 'mp4'
-        }]
-    
-    # Explicit re-encode flags (slower but guarantees compatibility)
-    ydl_opts['postprocessor_args'] = [
-        '-c:v', 'libx264',
-        '-preset', 'medium',
-        '-profile:v', 'high',
-        '-level', '4.2',
-        '-pix_fmt', 'yuv420p',
-        '-c:a', 'aac',
-        '-b:a', '192k'
-    ]
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        for url in urls:
+    return ydl_opts
+
+# --- MP4 Finalizing (remux fast path) ---
+def downloaded_entries(info):
+    """Return (video info, final file path) pairs yt-dlp wrote for `info` (walking playlist entries)."""
+    if not info:
+        return []
+    if info.get('entries') is not None:
+        pairs = []
+        for entry in info['entries']:
+            pairs.extend(downloaded_entries(entry))
+        return pairs
+    return [(info, d['filepath']) for d in info.get('requested_downloads') or [] if d.get('filepath')]
+
+def video_id_metadata(video_id):
+    """
+    ffmpeg arguments tagging the output with the video's URL as its comment, which
+    probe_video_id reads back when the archive index is rebuilt. They go on every
+    ffmpeg pass that rewrites a download anyway (yt-dlp's merge, or finalizing a file
+    whose container or codecs need it); a file that is already fine is not rewritten
+    just for the tag, as the job journal maps it to its ID for rebuild too.
+    """
+    if not video_id:
+        return []
+    return ['-metadata', 'comment=https://www.youtube.com/watch?v=' + video_id]
+
+def probe_streams(path):
+    """Return ffprobe's stream list for `path`, or None if ffprobe is unavailable or fails."""
+    ffprobe = shutil.which('ffprobe')
+    if not ffprobe:
+        return None
+    try:
+        result = subprocess.run(
+            [ffprobe, '-v', 'error', '-show_entries',
+             'stream=index,codec_type,codec_name,pix_fmt:stream_disposition=attached_pic',
+             '-of', 'json', path],
+            capture_output=True, text=True, check=True)
+        return json.loads(result.stdout).get('streams', [])
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+
+def plan_mp4_transcode(streams, ext):
+    """
+    Decide how to turn a file with `streams` into an H.264/AAC MP4.
+    Returns None when the file already matches, otherwise the ffmpeg codec arguments:
+    stream copy for compatible streams, re-encode only for the incompatible ones.
+    """
+    video = [s for s in streams if s.get('codec_type') == 'video'
+             and not (s.get('disposition') or {}).get('attached_pic')]
+    audio = [s for s in streams if s.get('codec_type') == 'audio']
+    video_ok = all(s.get('codec_name') in TARGET_VIDEO_CODECS
+                   and s.get('pix_fmt', TARGET_PIX_FMTS[0]) in TARGET_PIX_FMTS for s in video)
+    audio_ok = all(s.get('codec_name') in TARGET_AUDIO_CODECS for s in audio)
+    if video_ok and audio_ok and ext == 'mp4':
+        return None
+    args = ['-map', '0:V?', '-map', '0:a?']
+    args += ['-c:v', 'copy'] if video_ok else VIDEO_ENCODE_ARGS
+    args += ['-c:a', 'copy'] if audio_ok else AUDIO_ENCODE_ARGS
+    return args
+
+def finalize_mp4(path, url=None, job_id=None, video_id=None):
+    """
+    Remux or partially re-encode `path` into an H.264/AAC MP4 tagged with `video_id`
+    (an H.264/AAC MP4 is kept as-is); returns the final path. Raises RuntimeError if
+    ffprobe or ffmpeg fails, so the item is not archived as done.
+    """
+    streams = probe_streams(path)
+    if streams is None:
+        raise RuntimeError("could not probe " + os.path.basename(path) + " with ffprobe")
+    base, ext = os.path.splitext(path)
+    codec_args = plan_mp4_transcode(streams, ext.lstrip('.').lower())
+    if codec_args is None:
+        log_message("Streams already H.264/AAC MP4, no re-encode needed", url, job_id)
+        return path
+    if codec_args.count('copy') == 2:
+        log_message("Remuxing to MP4 without re-encoding...", url, job_id)
+    else:
+        log_message("Re-encoding {} to match H.264/AAC...".format(
+            " and ".join(kind for kind, flag in (('video', '-c:v'), ('audio', '-c:a'))
+                         if codec_args[codec_args.index(flag) + 1] != 'copy')), url, job_id)
+    target = base + '.mp4'
+    temp = base + '.finalize.mp4'
+    try:
+        subprocess.run([shutil.which('ffmpeg') or 'ffmpeg', '-y', '-v', 'error', '-i', path]
+                       + codec_args + video_id_metadata(video_id) + ['-movflags', '+faststart', temp],
+                       capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise RuntimeError("ffmpeg failed: " + (getattr(e, 'stderr', None) or str(e)).strip())
+    os.replace(temp, target)
+    if path != target:
+        os.remove(path)
+    return target
+
+# --- YoutubeDL Pool ---
+def apply_date_after(ydl, date_after):
+    """
+    Make `ydl` skip uploads older than `date_after`. yt-dlp only puts dates on flat
+    channel/playlist entries with youtubetab's approximate_date, which is what lets
+    iter_playlist_entries stop early; daterange catches the entries that still come
+    without a date once they are fully extracted.
+    """
+    from yt_dlp.utils import DateRange
+    extractor_args = {key: dict(value) for key, value in (ydl.params.get('extractor_args') or {}).items()}
+    tab_args = extractor_args.setdefault('youtubetab', {})
+    if date_after:
+        tab_args['approximate_date'] = ['']
+        ydl.params['daterange'] = DateRange(date_after)
+    else:
+        tab_args.pop('approximate_date', None)
+        ydl.params.pop('daterange', None)
+    if not tab_args:
+        del extractor_args['youtubetab']
+    ydl.params['extractor_args'] = extractor_args
+
+class YoutubeDLPool:
+    """
+    Warm YoutubeDL instances keyed by option profile (MP4 or MP3), so extractor
+    state, HTTP connections, cookies and cached player JS survive between jobs.
+    Each instance's hooks, logger and match_filter read a context dict that is
+    rebound to the borrowing job on checkout.
+    """
+
+    def __init__(self, max_idle=YDL_POOL_MAX_IDLE):
+        self.max_idle = max_idle
+        self.idle = {}  # profile -> [(ydl, context), ...]
+        self.lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.in_use = 0
+
+    def _create(self, download_audio, folder):
+        import yt_dlp
+        context = {}
+        opts = build_ydl_opts(download_audio, folder)
+        opts['progress_hooks'] = [lambda d: yt_dlp_hook(d, context),
+                                  lambda d: journal_hook(d, context),
+                                  lambda d: bandwidth_hook(d, context),
+                                  lambda d: fragment_hook(d, context)]
+        opts['postprocessor_hooks'] = [lambda d: postprocessor_hook(d, context)]
+        opts['logger'] = QueueLogger(context)
+        opts['match_filter'] = lambda info, incomplete=False: archive_match_filter(info, context, incomplete)
+        return yt_dlp.YoutubeDL(opts), context
+
+    def checkout(self, download_audio, folder, date_after=None, **bindings):
+        """
+        Borrow an instance writing into `folder`; `bindings` become its hook context.
+        `date_after` (YYYYMMDD) limits downloads to newer uploads; unset, any previous
+        job's limit is cleared.
+        """
+        profile = download_profile(download_audio)
+        with self.lock:
+            idle = self.idle.get(profile)
+            entry = idle.pop() if idle else None
+            if entry:
+                self.reused += 1
+            else:
+                self.created += 1
+            self.in_use += 1
+        if entry is None:
+            entry = self._create(download_audio, folder)
+        ydl, context = entry
+        context.clear()
+        context.update(bindings, lock=threading.Lock())
+        ydl.params['paths'] = {'home': folder}
+        ydl.params['outtmpl']['default'] = OUTPUT_TEMPLATES[folder_layout(folder)]
+        apply_date_after(ydl, date_after)
+        return ydl, context
+
+    def checkin(self, ydl, context, download_audio):
+        # Unbind first so nothing can publish into the previous job any more.
+        context.clear()
+        with self.lock:
+            self.in_use -= 1
+            idle = self.idle.setdefault(download_profile(download_audio), [])
+            if len(idle) < self.max_idle:
+                idle.append((ydl, context))
+                return
+        ydl.close()
+
+    def warm(self, folder, profiles=(False, True)):
+        """Pre-create one instance per profile so the first request skips initialization."""
+        for download_audio in profiles:
+            ydl, context = self.checkout(download_audio, folder)
+            self.checkin(ydl, context, download_audio)
+
+    def stats(self):
+        with self.lock:
+            checkouts = self.created + self.reused
+            return {'idle': {profile: len(entries) for profile, entries in self.idle.items()},
+                    'in_use': self.in_use, 'created': self.created, 'reused': self.reused,
+                    'reuse_rate': self.reused / checkouts if checkouts else 0.0}
+
+ydl_pool = YoutubeDLPool()
+
+# --- Playlist Expansion ---
+PLAYLIST_URL_RE = re.compile(r'[?&]list=|/playlist\b|/(?:channel|c|user)/|/@[^/?#]+|/(?:videos|shorts|streams)/?(?:$|[?#])')
+
+def is_playlist_url(url):
+    return bool(PLAYLIST_URL_RE.search(url))
+
+def parse_date_after(value):
+    """Turn a form date (YYYY-MM-DD or YYYYMMDD) into yt-dlp's YYYYMMDD, or None."""
+    digits = (value or "").replace("-", "").strip()
+    return digits if re.fullmatch(r'\d{8}', digits) else None
+
+def entry_upload_date(entry):
+    if entry.get('upload_date'):
+        return entry['upload_date']
+    if entry.get('timestamp'):
+        return time.strftime('%Y%m%d', time.gmtime(entry['timestamp']))
+    return None
+
+def iter_playlist_entries(ydl, info, max_items=0, date_after=None):
+    """
+    Lazily yield the video URLs of an unprocessed playlist info dict, following nested
+    playlists (channel tabs). yt-dlp pages through `entries` as they are consumed, so
+    stopping at `max_items` or at the first upload older than `date_after` (uploads are
+    listed newest first) avoids enumerating the rest.
+    """
+    count = 0
+    for entry in info.get('entries') or []:
+        if not entry:
+            continue
+        if entry.get('_type') in ('playlist', 'multi_video') or (
+                entry.get('_type') == 'url' and is_playlist_url(entry.get('url') or '')):
+            nested = entry if entry.get('entries') is not None else \
+                ydl.extract_info(entry['url'], download=False, process=False)
+            for url in iter_playlist_entries(ydl, nested, max_items and max_items - count, date_after):
+                yield url
+                count += 1
+            if max_items and count >= max_items:
+                return
+            continue
+        upload_date = entry_upload_date(entry)
+        if date_after and upload_date and upload_date < date_after:
+            return
+        url = entry.get('webpage_url') or entry.get('url') or entry.get('id')
+        if url:
+            yield url
+            count += 1
+        if max_items and count >= max_items:
+            return
+
+def expand_playlist(ydl, job, item_id, url, item_queue):
+    """Feed a playlist's entries into the running job as they are discovered."""
+    info = ydl.extract_info(url, download=False, process=False)
+    if info.get('_type') not in ('playlist', 'multi_video'):
+        return None
+    added = 0
+    for entry_url in iter_playlist_entries(ydl, info, job['max_items'], job['date_after']):
+        for item in job_store.add_items(job['id'], [entry_url], parent_id=item_id):
+            METRIC_ITEMS_QUEUED.inc()
+            item_queue.put(item)
+            added += 1
+    return added
+
+# --- Post-processing Stage ---
+def finalize_mp3(path, url=None, job_id=None, video_id=None):
+    """
+    Convert a downloaded audio file to MP3 tagged with `video_id` (an MP3 is kept
+    as-is); returns the final path.
+    """
+    base, ext = os.path.splitext(path)
+    if ext.lower() == '.mp3':
+        return path
+    log_message("Converting audio to MP3...", url, job_id)
+    target = base + '.mp3'
+    temp = base + '.finalize.mp3'
+    try:
+        subprocess.run([shutil.which('ffmpeg') or 'ffmpeg', '-y', '-v', 'error', '-i', path]
+                       + MP3_ENCODE_ARGS + video_id_metadata(video_id) + [temp],
+                       capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise RuntimeError("ffmpeg failed: " + (getattr(e, 'stderr', None) or str(e)).strip())
+    os.replace(temp, target)
+    if path != target:
+        os.remove(path)
+    return target
+
+class StageTracker:
+    """Counts one job's outstanding post-processing tasks so run_job can wait for them."""
+
+    def __init__(self):
+        self.pending = 0
+        self.cond = threading.Condition()
+
+    def add(self):
+        with self.cond:
+            self.pending += 1
+
+    def done(self):
+        with self.cond:
+            self.pending -= 1
+            self.cond.notify_all()
+
+    def wait(self):
+        with self.cond:
+            while self.pending:
+                self.cond.wait()
+
+class PostprocessPool:
+    """
+    Process-wide pool of threads running the ffmpeg step of finished downloads.
+    submit() blocks while the hand-off queue is full, which throttles the network stage.
+    """
+
+    def __init__(self, workers=POSTPROCESS_WORKERS, queue_size=POSTPROCESS_QUEUE_SIZE):
+        self.workers = workers
+        self.tasks = Queue(maxsize=queue_size)
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def submit(self, tracker, func, *args):
+        with self.lock:
+            if not self.threads:
+                self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(self.workers)]
+                for thread in self.threads:
+                    thread.start()
+        tracker.add()
+        self.tasks.put((tracker, func, args))
+
+    def _run(self):
+        while True:
+            tracker, func, args = self.tasks.get()
+            try:
+                func(*args)
+            except Exception:
+                logging.exception("Post-processing task failed")
+            finally:
+                tracker.done()
+
+postprocess_pool = PostprocessPool()
+
+def postprocess_item(job, context, item_id, entries):
+    """Second pipeline stage: convert the raw files of one item, archive, catalog and journal them."""
+    url = context['url']
+    job_id = job['id']
+    publish_progress(context, 'postprocessing')
+    METRIC_POSTPROCESS_ACTIVE.inc()
+    try:
+        paths = []
+        for video, path in entries:
+            started = time.monotonic()
+            if job['download_audio']:
+                path = finalize_mp3(path, url, job_id, video.get('id'))
+            else:
+                path = finalize_mp4(path, url, job_id, video.get('id'))
+            METRIC_STAGE_SECONDS.observe(time.monotonic() - started, stage='convert')
+            context['archive'].add(video.get('id'), context['profile'], path, video.get('format_id'))
+            library_catalog.record(path, job['folder'], video, context['profile'])
+            if context.get('sharded'):
+                link_title(job['folder'], path, video.get('id'))
+            paths.append(path)
+        job_store.update_item(item_id, state='finished', error=None,
+                              output_path=paths[0] if paths else None)
+        METRIC_ITEMS.inc(state='finished')
+        publish_progress(context, 'done')
+        log_message("Finished download", url, job_id)
+    except Exception as e:
+        job_store.update_item(item_id, state='error', error=str(e))
+        METRIC_ITEMS.inc(state='error')
+        METRIC_STAGE_ERRORS.inc(stage='convert')
+        publish_progress(context, 'error')
+        log_message("Error post-processing: " + str(e), url, job_id)
+    finally:
+        METRIC_POSTPROCESS_ACTIVE.dec()
+
+def download_worker(item_queue, job, tracker):
+    """
+    Pull (item_id, url) pairs off `item_queue` until run_job sends the None sentinel,
+    using one pooled YoutubeDL per worker. Playlist URLs are expanded into new items
+    and finished downloads are handed to the post-processing pool.
+    """
+    download_audio = bool(job['download_audio'])
+    ydl, context = ydl_pool.checkout(download_audio, job['folder'], date_after=job['date_after'],
+                                     url=None, item_id=None, job_id=job['id'],
+                                     archive=get_archive(job['folder']), profile=download_profile(download_audio))
+    try:
+        while True:
+            item = item_queue.get()
+            if item is None:
+                return
+            # Adaptive jobs park surplus workers here until the controller grants a slot,
+            # so waiting workers are exactly the demand the controller sees.
+            concurrency_controller.acquire(job['id'])
+            METRIC_ITEMS_QUEUED.dec()
+            METRIC_DOWNLOADS_ACTIVE.inc()
             try:
-                log_message("Starting download: " + url)
-                ydl.download([url])
-                log_message("Finished download: " + url)
-            except Exception as e:
-                log_message("Error downloading " + url + ": " + str(e))
-    log_message("###EOF###")
+                download_item(ydl, job, context, item_queue, tracker, *item)
+            finally:
+                METRIC_DOWNLOADS_ACTIVE.dec()
+                concurrency_controller.release(job['id'])
+                item_queue.task_done()
+    finally:
+        ydl_pool.checkin(ydl, context, download_audio)
+
+def download_item(ydl, job, context, item_queue, tracker, item_id, url):
+    job_id = job['id']
+    archive = context['archive']
+    profile = context['profile']
+    context.update(url=url, item_id=item_id, journal_time=0,
+                   progress_fields={}, bandwidth_file=None, archive_skips=set())
+    job_store.update_item(item_id, state='downloading')
+    playlist = is_playlist_url(url)
+    # Skip before any network I/O when the URL names a video already in the folder.
+    video_id = None if playlist else canonical_video_id(url)
+    existing = archive.lookup(video_id, profile) if video_id else None
+    if existing:
+        job_store.update_item(item_id, state='finished', error=None, output_path=existing)
+        METRIC_ITEMS.inc(state='skipped')
+        METRIC_ARCHIVE_SKIPS.inc()
+        publish_progress(context, 'skipped')
+        log_message("Already downloaded as " + os.path.basename(existing) + ", skipping", url, job_id)
+        return
+    stage = 'extract'
+    try:
+        if playlist:
+            log_message("Expanding playlist", url, job_id)
+            added = expand_playlist(ydl, job, item_id, url, item_queue)
+            if added is not None:
+                job_store.update_item(item_id, state='expanded', error=None)
+                METRIC_ITEMS.inc(state='expanded')
+                publish_progress(context, 'expanded', entries=added)
+                log_message("Queued {} video(s) from playlist".format(added), url, job_id)
+                return
+        log_message("Starting download", url, job_id)
+        info = extract_info_cached(ydl, url)
+        stage = 'download'
+        # The merge rewrites the file anyway, so it writes the ID tag (see video_id_metadata).
+        merged_id = info.get('id') if info.get('_type', 'video') == 'video' else None
+        ydl.params['postprocessor_args'] = {'merger+ffmpeg_o': video_id_metadata(merged_id)}
+        # yt-dlp reads this when each fragmented download starts.
+        connections = fragment_tuner.acquire(job_id)
+        context['connections'] = ydl.params['concurrent_fragment_downloads'] = connections
+        try:
+            info = ydl.process_ie_result(with_range_fragments(info), download=True)
+        finally:
+            fragment_tuner.release(connections)
+        entries = downloaded_entries(info)
+        if not entries:
+            # Skipped by the archive match_filter; nothing to post-process.
+            job_store.update_item(item_id, state='finished', error=None)
+            METRIC_ITEMS.inc(state='skipped')
+            publish_progress(context, 'done')
+            return
+        job_store.update_item(item_id, state='downloaded', error=None)
+        publish_progress(context, 'queued')
+        # The worker's context is reused for its next item, so the post stage gets a snapshot.
+        post_context = {'url': url, 'job_id': job_id, 'archive': archive, 'profile': profile,
+                        'sharded': folder_layout(job['folder']) == 'sharded',
+                        'progress_fields': dict(context.get('progress_fields') or {})}
+        postprocess_pool.submit(tracker, postprocess_item, job, post_context, item_id, entries)
+    except Exception as e:
+        job_store.update_item(item_id, state='error', error=str(e))
+        METRIC_ITEMS.inc(state='error')
+        METRIC_STAGE_ERRORS.inc(stage=stage)
+        publish_progress(context, 'error')
+        log_message("Error downloading: " + str(e), url, job_id)
+
+def run_job(job_id):
+    """Download every unfinished item of a journaled job, then mark the job finished."""
+    job = job_store.get_job(job_id)
+    items = job_store.pending_items(job_id)
+    os.makedirs(job['folder'], exist_ok=True)
+    if folder_layout(job['folder']) == 'sharded':
+        mark_sharded(job['folder'])  # Stays sharded if OUTPUT_LAYOUT changes later.
+    item_queue = Queue()
+    for item in items:
+        item_queue.put((item['id'], item['url']))
+    METRIC_ITEMS_QUEUED.inc(len(items))
+    # Never start more workers than there are URLs to hand out, unless a playlist
+    # will add more while the job runs. Adaptive jobs start enough for the ceiling
+    # and let the controller decide how many of them run.
+    worker_count = max(job['concurrency'], concurrency_controller.ceiling) if job['adaptive'] else job['concurrency']
+    if not any(is_playlist_url(item['url']) for item in items):
+        worker_count = max(1, min(worker_count, len(items)))
+    if job['adaptive']:
+        limit = concurrency_controller.register(job_id, job['concurrency'], worker_count)
+        publish_concurrency(job_id, limit)
+        log_message("Downloading {} URL(s), starting with {} of up to {} parallel download(s)".format(
+            len(items), limit, worker_count), job_id=job_id)
+    else:
+        log_message("Downloading {} URL(s) with {} parallel worker(s)".format(len(items), worker_count),
+                    job_id=job_id)
+    tracker = StageTracker()
+    METRIC_JOBS.inc(event='started')
+    METRIC_JOBS_RUNNING.inc()
+    bandwidth_governor.register(job_id, job['priority'], job['rate_limit'])
+    fragment_tuner.register(job_id, job['fragments'])
+    workers = [threading.Thread(target=download_worker, args=(item_queue, job, tracker), daemon=True)
+               for _ in range(worker_count)]
+    for worker in workers:
+        worker.start()
+    # Expanded playlist entries are queued before their playlist item is marked done,
+    # so join() only returns once every discovered video has been handled.
+    item_queue.join()
+    for worker in workers:
+        item_queue.put(None)
+    for worker in workers:
+        worker.join()
+    tracker.wait()
+    bandwidth_governor.unregister(job_id)
+    fragment_tuner.unregister(job_id)
+    concurrency_controller.unregister(job_id)
+    job_store.finish_job(job_id)
+    METRIC_JOBS.inc(event='finished')
+    METRIC_JOBS_RUNNING.dec()
+    close_channel(job_id)
 
-def start_download_thread(urls, download_audio, folder):
-    threading.Thread(target=download_videos, args=(urls, download_audio, folder), daemon=True).start()
+def download_videos(urls, download_audio, folder, concurrency=DEFAULT_CONCURRENCY, max_items=0, date_after=None,
+                    priority=DEFAULT_PRIORITY, rate_limit=0, fragments=0, adaptive=False):
+    job_id = job_store.create_job(urls, download_audio, folder, concurrency, max_items, date_after,
+                                  priority, rate_limit, fragments, adaptive)
+    run_job(job_id)
+    return job_id
+
+def start_download_thread(urls, download_audio, folder, concurrency=DEFAULT_CONCURRENCY, max_items=0,
+                          date_after=None, priority=DEFAULT_PRIORITY, rate_limit=0, fragments=0, adaptive=False):
+    job_id = job_store.create_job(urls, download_audio, folder, concurrency, max_items, date_after,
+                                  priority, rate_limit, fragments, adaptive)
+    start_job_thread(job_id)
+    return job_id
+
+def start_job_thread(job_id):
+    threading.Thread(target=run_job, args=(job_id,), daemon=True).start()
+
+def resume_unfinished_jobs():
+    """Restart jobs left running by a previous process; yt-dlp picks up their .part files."""
+    abandoned = job_store.fail_submitting_jobs()
+    if abandoned:
+        # The upload was cut off mid-body and its client never got a job ID back.
+        logging.info("Marked %d interrupted submission(s) as failed", abandoned)
+    for job in job_store.unfinished_jobs():
+        remaining = len(job_store.pending_items(job['id']))
+        logging.info("Resuming job %s (%d URL(s) remaining)", job['id'], remaining)
+        log_message("Resuming job {} ({} URL(s) remaining)".format(job['id'], remaining), job_id=job['id'])
+        start_job_thread(job['id'])
 
 # --- Flask Routes ---
 @app.route("/")
 def index():
     logging.debug("Rendering index page")
     # Use the current value of last_selected_folder so that the favored folder is shown
-    return render_template_string(INDEX_HTML, default_folder=last_selected_folder)
+    return render_template_string(INDEX_HTML, default_folder=last_selected_folder,
+                                  default_concurrency=DEFAULT_CONCURRENCY, max_concurrency=MAX_CONCURRENCY,
+                                  default_priority=DEFAULT_PRIORITY, max_priority=MAX_PRIORITY,
+                                  max_fragments=MAX_FRAGMENT_CONCURRENCY, headless=HEADLESS)
 
 @app.route("/pick_folder", methods=["POST"])
 def pick_folder():
     logging.debug("Received request to pick folder")
+    if root is None:
+        # Headless: there is no dialog; the folder comes from --download-folder/config or /api/folder.
+        return last_selected_folder
     # Clear the folder queue to make sure we have a fresh start.
     with folder_queue.mutex:
         folder_queue.queue.clear()
@@ -338,43 +2604,485 @@ def pick_folder():
         logging.error("Timeout waiting for folder selection")
         return ""
 
+def parse_job_options(values):
+    """
+    Read job options from form/query values or a JSON object; raises ValueError
+    with a user-facing message when one is invalid.
+    """
+    folder = str(values.get("folder") or "").strip()
+    if not folder:
+        raise ValueError("No folder path provided. Please select a folder.")
+    if not os.path.exists(folder):
+        raise ValueError("Invalid folder path. Please select a valid folder.")
+    try:
+        max_items = max(0, int(values.get("max_items") or 0))
+    except (TypeError, ValueError):
+        raise ValueError("Max items must be a whole number.")
+    try:
+        rate_limit = parse_rate(values.get("rate_limit"))
+    except ValueError:
+        raise ValueError("Invalid bandwidth limit. Use a number of bytes/s, optionally with K or M (e.g. 500K).")
+    return {
+        'folder': folder,
+        'download_audio': values.get("download_audio") in (True, 1, "on", "true", "1"),
+        'adaptive': values.get("adaptive") in (True, 1, "on", "true", "1"),
+        'concurrency': parse_concurrency(values.get("concurrency", DEFAULT_CONCURRENCY)),
+        'max_items': max_items,
+        'date_after': parse_date_after(values.get("date_after")),
+        'priority': parse_priority(values.get("priority")),
+        'rate_limit': rate_limit,
+        'fragments': parse_fragments(values.get("fragments")),
+    }
+
+@app.route("/api/folder", methods=["GET", "POST"])
+def api_folder():
+    """Read or set the default download folder (the folder picker's replacement in headless mode)."""
+    global last_selected_folder
+    if request.method == "POST":
+        values = request.get_json(silent=True) or request.values
+        folder = str(values.get("folder") or "").strip()
+        if not folder or not os.path.isdir(folder):
+            return jsonify(error="Invalid folder path"), 400
+        last_selected_folder = os.path.abspath(folder)
+    return jsonify(folder=last_selected_folder)
+
 @app.route("/start", methods=["POST"])
 def start_download():
-    folder = request.form.get("folder", "").strip()
     urls_raw = request.form.get("urls", "")
     urls = [line.strip() for line in urls_raw.splitlines() if line.strip()]
-    
-    if not folder:
-        return "Error: No folder path provided. Please select a folder."
+    try:
+        options = parse_job_options(request.values)
+    except ValueError as e:
+        return "Error: " + str(e)
     if not urls:
         return "Error: No URLs provided. Please enter at least one URL."
-    if not os.path.exists(folder):
-        return "Error: Invalid folder path. Please select a valid folder."
-    
-    download_audio = (request.form.get("download_audio") == "on")
-    with message_queue.mutex:
-        message_queue.queue.clear()
-    start_download_thread(urls, download_audio, folder)
-    return render_template_string(PROGRESS_HTML)
-
-@app.route("/stream")
-def stream():
-    def event_stream():
+    job_id = start_download_thread(urls, **options)
+    return redirect(url_for('progress', job_id=job_id))
+
+# --- JSON Job API ---
+def parse_url_line(line):
+    """A URL from one line of a text, NDJSON ({"url": ...}) or JSON-string upload; None for blanks/comments."""
+    if isinstance(line, bytes):
+        line = line.decode('utf-8', errors='replace')
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    if line[0] in '{"':
+        value = json.loads(line)
+        return (value.get('url') if isinstance(value, dict) else value) or None
+    return line
+
+def is_job_url(value):
+    return isinstance(value, str) and bool(JOB_URL_RE.match(value.strip()))
+
+def ingest_urls(job_id, urls, invalid):
+    """
+    Journal URLs from an iterable in batches, never holding the whole upload in memory.
+    Entries that are not http(s) URLs go to `invalid`; reading stops once it holds
+    MAX_INVALID_URLS of them, since the submission will be rejected anyway.
+    """
+    count = 0
+    batch = []
+    for url in urls:
+        if url is None:
+            continue
+        if not is_job_url(url):
+            invalid.append(url)
+            if len(invalid) >= MAX_INVALID_URLS:
+                break
+            continue
+        batch.append(url.strip())
+        if len(batch) >= INGEST_BATCH_SIZE:
+            count += len(job_store.add_items(job_id, batch))
+            batch = []
+    if batch:
+        count += len(job_store.add_items(job_id, batch))
+    return count
+
+def job_summary(job):
+    summary = dict(job)
+    summary['download_audio'] = bool(summary['download_audio'])
+    summary['adaptive'] = bool(summary['adaptive'])
+    summary['items'] = job_store.item_counts(job['id'])
+    summary['status_url'] = url_for('api_job', job_id=job['id'])
+    summary['stream_url'] = url_for('stream', job_id=job['id'])
+    return summary
+
+def page_size(value):
+    try:
+        return max(1, min(int(value), API_MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return API_PAGE_SIZE
+
+@app.route("/api/jobs", methods=["POST"])
+def api_submit_job():
+    """
+    Submit a batch. Accepts a JSON object ({"urls": [...], options...}), an NDJSON or
+    plain-text body (options in the query string), or a multipart upload of a URL file
+    in the "file" field. Bodies are streamed into the journal; returns 202 with the job ID.
+    """
+    json_body = request.mimetype == 'application/json'
+    if json_body:
+        if (request.content_length or 0) > MAX_JSON_BODY:
+            return jsonify(error="JSON body too large; send big batches as NDJSON or text, which are streamed"), 413
+        data = request.stream.read(MAX_JSON_BODY + 1)
+        if len(data) > MAX_JSON_BODY:
+            return jsonify(error="JSON body too large; send big batches as NDJSON or text, which are streamed"), 413
+        try:
+            values = json.loads(data.decode('utf-8'))
+        except ValueError as e:
+            return jsonify(error="Invalid JSON: " + str(e)), 400
+        if not isinstance(values, dict):
+            return jsonify(error="JSON body must be an object with a \"urls\" list"), 400
+        if not isinstance(values.get("urls") or [], list):
+            return jsonify(error="\"urls\" must be a list"), 400
+        invalid = [url for url in values.get("urls") or [] if not is_job_url(url)][:MAX_INVALID_URLS]
+        if invalid:
+            return jsonify(error="Invalid URLs", invalid=invalid), 400
+    elif request.mimetype == 'multipart/form-data':
+        values = request.values
+    else:
+        # Raw bodies (curl --data-binary sends them as form-urlencoded) are the URL list
+        # itself: touching request.form would consume them, so options come from the query.
+        values = request.args
+    try:
+        options = parse_job_options(values)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    try:
+        if json_body:
+            urls = iter(values.get("urls") or [])
+        elif request.mimetype == 'multipart/form-data':
+            upload = request.files.get('file')
+            urls = (parse_url_line(line) for line in upload.stream) if upload else iter(())
+        else:
+            urls = (parse_url_line(line) for line in request.stream)
+        # Read up to the first URL before journaling anything, so empty uploads leave no job behind.
+        first = next((url for url in urls if url is not None), None)
+    except ValueError as e:
+        return jsonify(error="Invalid input: " + str(e)), 400
+    if first is None:
+        return jsonify(error="No URLs provided"), 400
+    # Not picked up by resume_unfinished_jobs() until the whole body is journaled.
+    job_id = job_store.create_job([], state='submitting', **options)
+    invalid = []
+    try:
+        count = ingest_urls(job_id, chain([first], urls), invalid)
+    except ValueError as e:
+        job_store.update_job(job_id, state='failed', finished_at=time.time())
+        return jsonify(error="Invalid input: " + str(e), job_id=job_id), 400
+    if invalid:
+        job_store.update_job(job_id, state='failed', finished_at=time.time())
+        return jsonify(error="Invalid URLs", invalid=invalid, job_id=job_id), 400
+    job_store.update_job(job_id, state='running')
+    start_job_thread(job_id)
+    return jsonify(job_id=job_id, items=count, status_url=url_for('api_job', job_id=job_id),
+                   stream_url=url_for('stream', job_id=job_id)), 202
+
+@app.route("/api/jobs", methods=["GET"])
+def api_list_jobs():
+    per_page = page_size(request.args.get("per_page"))
+    try:
+        page = max(1, int(request.args.get("page", 1)))
+    except ValueError:
+        page = 1
+    rows, total = job_store.list_jobs(per_page, (page - 1) * per_page, request.args.get("state"))
+    return jsonify(jobs=[job_summary(row) for row in rows], page=page, per_page=per_page, total=total)
+
+@app.route("/api/jobs/<job_id>")
+def api_job(job_id):
+    job = job_store.get_job(job_id)
+    if job is None:
+        return jsonify(error="Unknown job"), 404
+    return jsonify(job_summary(job))
+
+@app.route("/api/jobs/<job_id>/items")
+def api_job_items(job_id):
+    """Per-URL results, paginated with ?after=<last item id>&limit=N[&state=...]."""
+    if job_store.get_job(job_id) is None:
+        return jsonify(error="Unknown job"), 404
+    try:
+        after_id = int(request.args.get("after", 0))
+    except ValueError:
+        after_id = 0
+    rows = job_store.list_items(job_id, after_id, page_size(request.args.get("limit")), request.args.get("state"))
+    items = [dict(row) for row in rows]
+    return jsonify(items=items, next_after=items[-1]['id'] if items else None)
+
+@app.route("/api/info")
+def video_info():
+    """Dry run: resolve a URL's metadata (through the cache) without downloading."""
+    url = request.args.get("url", "").strip()
+    if not url:
+        return jsonify(error="Missing url parameter"), 400
+    ydl, context = ydl_pool.checkout(False, last_selected_folder)
+    try:
+        info = extract_info_cached(ydl, url)
+    except Exception as e:
+        return jsonify(error=str(e)), 502
+    finally:
+        ydl_pool.checkin(ydl, context, False)
+    return jsonify(id=info.get('id'), title=info.get('title'), channel=info.get('channel'),
+                   duration=info.get('duration'), type=info.get('_type', 'video'),
+                   formats=len(info.get('formats') or []), cache=info_cache.stats())
+
+@app.route("/api/pool")
+def pool_stats():
+    return jsonify(ydl_pool.stats())
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus scrape target."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/api/archive/rebuild", methods=["POST"])
+def rebuild_archive():
+    """Index a folder that was populated before its download archive existed."""
+    folder = (request.values.get("folder") or last_selected_folder).strip()
+    if not os.path.isdir(folder):
+        return jsonify(error="Invalid folder path"), 400
+    indexed, unknown = get_archive(folder).rebuild(probe=request.values.get("probe", "1") != "0")
+    return jsonify(folder=folder, indexed=indexed, unknown=unknown)
+
+def library_filters(args):
+    return {'folder': args.get("folder", "").strip() or None, 'search': args.get("q", "").strip() or None,
+            'channel': args.get("channel") or None, 'profile': args.get("profile") or None,
+            'sort': args.get("sort", "added_at"), 'descending': args.get("order", "desc") != "asc"}
+
+@app.route("/api/library")
+def api_library():
+    """
+    One page of the library catalog. Filters: folder, q (title/channel substring or
+    video ID), channel, profile; sort by added_at, title, channel, duration, height
+    or size with order=asc|desc; paginate with limit and offset.
+    """
+    limit = page_size(request.args.get("limit"))
+    try:
+        offset = max(0, int(request.args.get("offset", 0)))
+    except ValueError:
+        return jsonify(error="Invalid offset"), 400
+    rows, total = library_catalog.list_files(limit, offset, **library_filters(request.args))
+    return jsonify(items=[dict(row) for row in rows], total=total, limit=limit, offset=offset)
+
+@app.route("/api/library/reconcile", methods=["POST"])
+def api_library_reconcile():
+    """Pick up out-of-band changes now instead of at the reconciler's next pass."""
+    folder = (request.values.get("folder") or "").strip()
+    folders = [folder] if folder else set(library_catalog.folders()) | {os.path.abspath(last_selected_folder)}
+    added, removed = library_catalog.reconcile(sorted(folders))
+    return jsonify(added=added, removed=removed)
+
+@app.route("/library")
+def library():
+    filters = library_filters(request.args)
+    try:
+        page = max(1, int(request.args.get("page", 1)))
+    except ValueError:
+        page = 1
+    rows, total = library_catalog.list_files(API_PAGE_SIZE, (page - 1) * API_PAGE_SIZE, **filters)
+    entries = []
+    for row in rows:
+        entry = dict(row)
+        duration = int(row['duration'] or 0)
+        entry.update(added=time.strftime("%Y-%m-%d %H:%M", time.localtime(row['added_at'])),
+                     length="{}:{:02d}:{:02d}".format(duration // 3600, duration // 60 % 60, duration % 60)
+                     if row['duration'] else "",
+                     resolution="{}x{}".format(row['width'], row['height']) if row['height'] else "",
+                     megabytes="{:.1f} MB".format(row['size'] / 1e6),
+                     codecs="/".join(codec for codec in (row['vcodec'], row['acodec']) if codec))
+        entries.append(entry)
+    args = request.args.to_dict()
+
+    def page_url(**changes):
+        return url_for('library', **dict(args, **changes))
+
+    return render_template_string(LIBRARY_HTML, rows=entries, total=total, page=page,
+                                  pages=max(1, -(-total // API_PAGE_SIZE)), filters=filters, page_url=page_url,
+                                  columns=[('added_at', 'Added'), ('title', 'Title'), ('channel', 'Channel'),
+                                           ('duration', 'Length'), ('height', 'Resolution'), ('size', 'Size')])
+
+@app.route("/api/bandwidth", methods=["GET", "POST"])
+def bandwidth():
+    """
+    Inspect or change bandwidth limits without restarting downloads. POST accepts
+    global_limit and job_limit, or job_id with priority and/or rate_limit.
+    """
+    if request.method == "POST":
+        values = request.get_json(silent=True) or request.values
+        try:
+            bandwidth_governor.configure(
+                global_rate=parse_rate(values["global_limit"]) if "global_limit" in values else None,
+                job_rate=parse_rate(values["job_limit"]) if "job_limit" in values else None)
+            job_id = values.get("job_id")
+            if job_id:
+                priority = parse_priority(values["priority"]) if "priority" in values else None
+                rate_limit = parse_rate(values["rate_limit"]) if "rate_limit" in values else None
+                if not bandwidth_governor.configure_job(job_id, priority, rate_limit):
+                    return jsonify(error="Job is not running"), 404
+                changes = {name: value for name, value in (('priority', priority), ('rate_limit', rate_limit))
+                           if value is not None}
+                if changes:
+                    job_store.update_job(job_id, **changes)
+        except ValueError:
+            return jsonify(error="Invalid rate; use bytes/s, optionally with K, M or G"), 400
+    return jsonify(bandwidth_governor.snapshot())
+
+@app.route("/api/connections", methods=["GET", "POST"])
+def connections():
+    """
+    Inspect or change fragment connection settings. POST accepts budget, or job_id
+    with fragments (0 = auto-tune) for a running job.
+    """
+    if request.method == "POST":
+        values = request.get_json(silent=True) or request.values
+        try:
+            fragment_tuner.configure(budget=int(values["budget"]) if "budget" in values else None)
+        except (TypeError, ValueError):
+            return jsonify(error="Invalid budget; use a number of connections"), 400
+        job_id = values.get("job_id")
+        if job_id and "fragments" in values:
+            fragments = parse_fragments(values["fragments"])
+            if not fragment_tuner.configure_job(job_id, fragments):
+                return jsonify(error="Job is not running"), 404
+            job_store.update_job(job_id, fragments=fragments)
+    return jsonify(fragment_tuner.snapshot())
+
+@app.route("/api/concurrency", methods=["GET", "POST"])
+def concurrency():
+    """Inspect adaptive jobs, or POST floor and/or ceiling to change the slot bounds."""
+    if request.method == "POST":
+        values = request.get_json(silent=True) or request.values
+        try:
+            concurrency_controller.configure(
+                floor=int(values["floor"]) if "floor" in values else None,
+                ceiling=int(values["ceiling"]) if "ceiling" in values else None)
+        except (TypeError, ValueError) as e:
+            return jsonify(error="Invalid floor/ceiling: " + str(e)), 400
+    return jsonify(concurrency_controller.snapshot())
+
+# The search index and related-videos model are opened once and re-read only when they change on disk.
+transcript_index = None
+transcript_index_lock = threading.Lock()
+
+@app.route("/api/transcripts/search")
+def search_transcripts():
+    """Full-text transcript search: words, "quoted phrases" and prefix* terms, with timestamps."""
+    global transcript_index
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify(error="Missing q parameter"), 400
+    try:
+        import transcript_search
+    except ImportError:
+        return jsonify(error="Transcript search needs numpy"), 501
+    with transcript_index_lock:
+        if transcript_index is None:
+            transcript_index = transcript_search.open_index(TRANSCRIPTS_FOLDER)
+            if transcript_index is None:
+                return jsonify(error="No search index in " + TRANSCRIPTS_FOLDER), 404
+        else:
+            transcript_index.refresh()
+        result = transcript_index.search(query, page_size(request.args.get("limit")))
+    return jsonify(result)
+
+related_model = None
+
+@app.route("/api/transcripts/related")
+def related_transcripts():
+    """Videos whose transcripts are most like video_id's, or best match free text q (TF-IDF cosine)."""
+    global related_model
+    video_id = request.args.get("video_id", "").strip()
+    query = request.args.get("q", "").strip()
+    if not video_id and not query:
+        return jsonify(error="Missing video_id or q parameter"), 400
+    try:
+        import transcript_related
+    except ImportError:
+        return jsonify(error="Related videos need numpy and scipy"), 501
+    limit = page_size(request.args.get("limit", transcript_related.DEFAULT_TOP_K))
+    with transcript_index_lock:
+        if related_model is None:
+            related_model = transcript_related.open_related(TRANSCRIPTS_FOLDER)
+            if related_model is None:
+                return jsonify(error="No related-videos model in " + TRANSCRIPTS_FOLDER), 404
+        else:
+            related_model.refresh()
+        if video_id:
+            results = related_model.similar(video_id, limit)
+            if results is None:
+                return jsonify(error="Video is not in the model"), 404
+        else:
+            results = related_model.query(query, limit)
+    return jsonify(results=results)
+
+@app.route("/progress/<job_id>")
+def progress(job_id):
+    # Any number of tabs can open this page; each gets its own subscription to the job.
+    return render_template_string(PROGRESS_HTML, job_id=job_id)
+
+def format_sse(event_id, data, event=None):
+    # Multi-line messages (e.g. ffmpeg errors) need one data: field per line.
+    lines = "".join("data: {}\n".format(line) for line in str(data).splitlines() or [""])
+    if event:
+        lines = "event: {}\n".format(event) + lines
+    return "id: {}\n{}\n".format(event_id, lines)
+
+TERMINAL_JOB_STATES = ('finished', 'failed')
+
+def replay_journal(job):
+    """SSE events for a job without a live channel: each item's outcome from the journal, then EOF."""
+    event_id = 0
+    after_id = 0
+    while True:
+        items = job_store.list_items(job['id'], after_id)
+        if not items:
+            break
+        for item in items:
+            event_id += 1
+            outcome = "Error: " + item['error'] if item['error'] else item['state'].capitalize()
+            yield format_sse(event_id, "[{}] {}".format(item['url'], outcome))
+        after_id = items[-1]['id']
+    yield format_sse(event_id + 1, "Job already finished." if job['state'] == 'finished' else "Job failed.")
+    yield format_sse(event_id + 2, EOF_MARKER)
+
+@app.route("/stream/<job_id>")
+def stream(job_id):
+    channel = get_channel(job_id)
+    if channel is None:
+        job = job_store.get_job(job_id)
+        if job is None:
+            return Response("Unknown job", status=404)
+        if job['state'] in TERMINAL_JOB_STATES:
+            # Ended before this process started (or was rejected): no channel will ever close.
+            return Response(replay_journal(job), mimetype="text/event-stream")
+        channel = get_channel(job_id, create=True)
+    try:
+        last_id = int(request.headers.get("Last-Event-ID") or request.args.get("last_event_id") or 0)
+    except ValueError:
+        last_id = 0
+
+    def event_stream(last_id):
+        keyed_after = 0.0
         while True:
-            try:
-                message = message_queue.get(timeout=1.0)
-                yield f"data: {message}\n\n"
-                if message == "###EOF###":
+            events, keyed, closed = channel.read_since(last_id, 15.0, keyed_after)
+            if keyed:
+                keyed_after = time.monotonic() + 1.0 / PROGRESS_MAX_HZ
+            for event_id, event, data in events:
+                yield format_sse(event_id, data, event)
+                last_id = event_id
+            if not events:
+                if closed:
                     break
-            except Empty:
-                continue
-    return Response(event_stream(), mimetype="text/event-stream")
+                yield ": keep-alive\n\n"
+    return Response(event_stream(last_id), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache"})
 
 # --- Tkinter and Flask Integration ---
-def run_flask():
-    app.run(debug=True, use_reloader=False, threaded=True, host="127.0.0.1", port=5000)
+def run_flask(host="127.0.0.1", port=5000, debug=True):
+    app.run(debug=debug, use_reloader=False, threaded=True, host=host, port=port)
 
 def pick_folder_handler(event):
+    from tkinter import filedialog
     global last_selected_folder
     # Use the last_selected_folder (or DEFAULT_DOWNLOAD_FOLDER if none set) as the initial directory.
     folder_path = filedialog.askdirectory(initialdir=last_selected_folder, title="Select Download Folder")
@@ -384,16 +3092,79 @@ def pick_folder_handler(event):
         last_selected_folder = folder_path
     folder_queue.put(folder_path if folder_path else "")
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local web UI for downloading videos with yt-dlp.")
+    parser.add_argument('--headless', action='store_true',
+                        help='Run only the web server: no Tkinter folder picker, no browser launch')
+    parser.add_argument('--host', help='Interface to listen on (default 127.0.0.1)')
+    parser.add_argument('--port', type=int, help='Port to listen on (default 5000)')
+    parser.add_argument('--download-folder', help='Default download folder')
+    parser.add_argument('--output-layout', choices=sorted(OUTPUT_TEMPLATES),
+                        help='Layout of new download folders (default flat): <title>.<ext>, or <ab>/<cd>/<id>/ shards')
+    parser.add_argument('--migrate-layout', metavar='FOLDER',
+                        help='Move the files of a flat download folder into the sharded layout, then exit')
+    parser.add_argument('--config', help='JSON file with any of: host, port, download_folder, output_layout, '
+                                         'transcripts_folder, global_rate_limit, connection_budget, '
+                                         'concurrency_floor, concurrency_ceiling (command-line options win)')
+    return parser.parse_args(argv)
+
+def load_config(path):
+    if not path:
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def main(argv=None):
+    global HEADLESS, last_selected_folder, root, TRANSCRIPTS_FOLDER, OUTPUT_LAYOUT
+    args = parse_args(argv)
+    config = load_config(args.config)
+    HEADLESS = args.headless
+    host = args.host or config.get('host', "127.0.0.1")
+    port = args.port or config.get('port', 5000)
+    folder = args.download_folder or config.get('download_folder')
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+        last_selected_folder = os.path.abspath(folder)
+    layout = args.output_layout or config.get('output_layout')
+    if layout in OUTPUT_TEMPLATES:
+        OUTPUT_LAYOUT = layout
+    if args.migrate_layout:
+        moved, skipped = migrate_to_sharded(args.migrate_layout)
+        print("Moved {} file(s) into the sharded layout; {} left in place.".format(moved, skipped))
+        return
+    if config.get('transcripts_folder'):
+        TRANSCRIPTS_FOLDER = os.path.abspath(config['transcripts_folder'])
+    if config.get('global_rate_limit'):
+        bandwidth_governor.configure(global_rate=parse_rate(config['global_rate_limit']))
+    if config.get('connection_budget'):
+        fragment_tuner.configure(budget=int(config['connection_budget']))
+    if config.get('concurrency_floor') or config.get('concurrency_ceiling'):
+        concurrency_controller.configure(floor=config.get('concurrency_floor'),
+                                         ceiling=config.get('concurrency_ceiling'))
+
+    # Pick up any batch interrupted by a crash or a closed window.
+    resume_unfinished_jobs()
+    # Catch up with files added or deleted while the app was not running, then keep watching.
+    threading.Thread(target=run_library_reconciler, daemon=True).start()
+    # Initialize one YoutubeDL per profile in the background so the first job starts warm.
+    threading.Thread(target=ydl_pool.warm, args=(last_selected_folder,), daemon=True).start()
+
+    if HEADLESS:
+        logging.info("Serving headless on http://%s:%d", host, port)
+        run_flask(host, port, debug=False)
+        return
+
+    import tkinter as tk
+    import webbrowser
+
     # Start Flask in a separate thread.
-    flask_thread = threading.Thread(target=run_flask, daemon=True)
+    flask_thread = threading.Thread(target=run_flask, args=(host, port), daemon=True)
     flask_thread.start()
 
     # Open browser.
-    threading.Timer(1, lambda: webbrowser.open("http://127.0.0.1:5000")).start()
+    threading.Timer(1, lambda: webbrowser.open("http://{}:{}".format(host, port))).start()
 
     # Set up Tkinter in the main thread.
-    global root
     root = tk.Tk()
     root.withdraw()  # Hide the main window.
     root.protocol("WM_DELETE_WINDOW", root.quit)
@@ -0,0 +1,477 @@
+"""
+Benchmarks for the V5 downloader server and transcript search. Results are printed as JSON so runs can be
+saved and diffed between commits.
+
+    python benchmark.py startup
+    python benchmark.py startup --runs 10 --max-import-ms 400 --output bench_output.txt
+    python benchmark.py download
+    python benchmark.py download --jobs 1,8 --profiles mp4 --transcode off --duration 5
+    python benchmark.py download --jobs 1 --profiles mp4 --transcode off --connections 1,4,auto \
+        --origin-mbps 2 --range-mb 1
+    python benchmark.py search --docs 500,2000,8000 --max-query-ms 250
+
+The startup scenario measures how long `import V5` takes, which heavy modules that
+import pulls in, and how long `V5.py --headless` needs to answer its first request.
+The --max-* options turn it into a regression check: the exit status is 1 when a
+limit is exceeded.
+
+The download scenario never touches YouTube. It serves ffmpeg-generated media from
+a local HTTP server and seeds V5's metadata cache with info dicts whose formats
+point at it, so the real download, merge and post-processing paths run unchanged.
+Every case (jobs x profile x transcode x connections) runs in a fresh child process
+and reports jobs/min, MB/s, CPU seconds (including ffmpeg children) and peak RSS.
+
+The formats are plain http, so V5 splits them into range fragments like any YouTube
+https format of known size, and --connections sets the job's parallel connections
+(auto lets the fragment tuner pick; the level it ends on is reported). Connections
+only pay off against an origin that throttles each one, like googlevideo:
+--origin-mbps paces every connection of the fake origin, and --range-mb shrinks the
+fragments so short synthetic media still splits into several.
+
+The search scenario builds transcript search indexes of growing size from synthetic
+transcripts (Zipf-distributed words w0, w1, ...) and reports the median time of
+word, phrase, prefix and multi-word queries at each size, so a query path that
+scales with the corpus instead of with the returned hits shows up as a trend.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import logging
+import argparse
+import platform
+import resource
+import threading
+import statistics
+import subprocess
+import tempfile
+import urllib.parse
+import urllib.request
+import urllib.error
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+V5_PATH = os.path.join(REPO_DIR, "V5.py")
+
+# Modules that must not be imported just by importing V5 (see the lazy imports there).
+HEAVY_MODULES = ("yt_dlp", "tkinter", "webbrowser")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_python(code, cwd, extra_args=()):
+    env = dict(os.environ, PYTHONPATH=REPO_DIR)
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable] + list(extra_args) + ["-c", code],
+                            cwd=cwd, env=env, capture_output=True, text=True, check=True)
+    return time.perf_counter() - start, result
+
+
+def measure_import(runs, workdir):
+    """Wall-clock cost of `import V5` over a bare interpreter start, plus the slowest imports."""
+    baseline = [run_python("pass", workdir)[0] for _ in range(runs)]
+    probe = "import sys, json, V5; print(json.dumps({m: m in sys.modules for m in %r}))" % (HEAVY_MODULES,)
+    timings = []
+    loaded = {}
+    for _ in range(runs):
+        elapsed, result = run_python(probe, workdir)
+        timings.append(elapsed)
+        loaded = json.loads(result.stdout.strip().splitlines()[-1])
+
+    # -X importtime lines look like: "import time:   self [us] | cumulative | package"
+    _, result = run_python("import V5", workdir, ["-X", "importtime"])
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not line.startswith("import time:"):
+            continue
+        try:
+            cumulative[parts[2].strip()] = int(parts[1])
+        except ValueError:
+            continue
+    slowest = sorted(((name, us) for name, us in cumulative.items() if "." not in name),
+                     key=lambda item: item[1], reverse=True)[:10]
+    return {
+        "interpreter_ms": round(statistics.median(baseline) * 1000, 1),
+        "import_ms": round((statistics.median(timings) - statistics.median(baseline)) * 1000, 1),
+        "import_v5_cumulative_ms": round(cumulative.get("V5", 0) / 1000, 1),
+        "slowest_top_level_imports_ms": {name: round(us / 1000, 1) for name, us in slowest},
+        "heavy_modules_loaded": loaded,
+    }
+
+
+def measure_first_response(runs, workdir, timeout=30.0):
+    """Time from spawning `V5.py --headless` until GET / answers 200."""
+    timings = []
+    for _ in range(runs):
+        port = free_port()
+        start = time.perf_counter()
+        server = subprocess.Popen([sys.executable, V5_PATH, "--headless", "--port", str(port)],
+                                  cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while True:
+                if time.perf_counter() - start > timeout:
+                    raise RuntimeError("server did not answer within %.0fs" % timeout)
+                if server.poll() is not None:
+                    raise RuntimeError("server exited with status %d" % server.returncode)
+                try:
+                    with urllib.request.urlopen("http://127.0.0.1:%d/" % port, timeout=1) as response:
+                        if response.status == 200:
+                            break
+                except (urllib.error.URLError, ConnectionError, socket.timeout):
+                    time.sleep(0.01)
+            timings.append(time.perf_counter() - start)
+        finally:
+            server.terminate()
+            server.wait()
+    return {"first_response_ms": round(statistics.median(timings) * 1000, 1),
+            "first_response_max_ms": round(max(timings) * 1000, 1)}
+
+
+def startup(args):
+    # V5 creates its journal, caches and downloads folder in the working directory.
+    with tempfile.TemporaryDirectory() as workdir:
+        results = measure_import(args.runs, workdir)
+        results.update(measure_first_response(args.runs, workdir))
+    failures = []
+    if args.max_import_ms is not None and results["import_ms"] > args.max_import_ms:
+        failures.append("import_ms %.1f > %.1f" % (results["import_ms"], args.max_import_ms))
+    if args.max_first_response_ms is not None and results["first_response_ms"] > args.max_first_response_ms:
+        failures.append("first_response_ms %.1f > %.1f" % (results["first_response_ms"], args.max_first_response_ms))
+    if any(results["heavy_modules_loaded"].values()):
+        failures.append("heavy modules imported eagerly: " +
+                        ", ".join(name for name, loaded in results["heavy_modules_loaded"].items() if loaded))
+    return results, failures
+
+
+# Synthetic media served by the fake origin: (file name, ffmpeg output arguments).
+# "transcode off" cases use sources already in the target codecs (H.264/AAC for
+# MP4, MP3 for MP3), "transcode on" cases force the re-encode paths.
+MEDIA_FILES = {
+    "video_h264.mp4": ["-f", "lavfi", "-i", "testsrc2=size=1280x720:rate=30",
+                       "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p", "-an"],
+    "video_vp9.webm": ["-f", "lavfi", "-i", "testsrc2=size=1280x720:rate=30",
+                       "-c:v", "libvpx-vp9", "-deadline", "realtime", "-cpu-used", "8", "-b:v", "2M", "-an"],
+    "audio_aac.m4a": ["-f", "lavfi", "-i", "sine=frequency=440", "-c:a", "aac", "-b:a", "128k", "-vn"],
+    "audio_opus.webm": ["-f", "lavfi", "-i", "sine=frequency=440", "-c:a", "libopus", "-b:a", "128k", "-vn"],
+    "audio_mp3.mp3": ["-f", "lavfi", "-i", "sine=frequency=440", "-c:a", "libmp3lame", "-b:a", "192k", "-vn"],
+}
+
+# (file, ext, vcodec, acodec) per profile and transcode setting.
+CASE_FORMATS = {
+    ("mp4", False): [("video_h264.mp4", "mp4", "avc1.64001f", "none"), ("audio_aac.m4a", "m4a", "none", "mp4a.40.2")],
+    ("mp4", True): [("video_vp9.webm", "webm", "vp9", "none"), ("audio_opus.webm", "webm", "none", "opus")],
+    ("mp3", False): [("audio_mp3.mp3", "mp3", "none", "mp3")],
+    ("mp3", True): [("audio_aac.m4a", "m4a", "none", "mp4a.40.2")],
+}
+
+
+def generate_media(media_dir, duration):
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        raise RuntimeError("the download benchmark needs ffmpeg on PATH")
+    for name, arguments in MEDIA_FILES.items():
+        subprocess.run([ffmpeg, "-y", "-v", "error"] + arguments + ["-t", str(duration), os.path.join(media_dir, name)],
+                       check=True)
+
+
+class QuietRangeHandler(SimpleHTTPRequestHandler):
+    """
+    Static file handler with single-range support, from the Range header or
+    googlevideo's `range` query parameter, and optional per-connection pacing.
+    """
+
+    rate = 0  # bytes/s per connection, 0 for unlimited
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_head(self):
+        path_text, _, query = self.path.partition("?")
+        path = self.translate_path(path_text)
+        range_text = (urllib.parse.parse_qs(query).get("range") or [None])[0]
+        range_text = range_text or (self.headers.get("Range") or "").replace("bytes=", "")
+        if not range_text or not os.path.isfile(path):
+            return super().send_head()
+        size = os.path.getsize(path)
+        start_text, _, end_text = range_text.partition("-")
+        start = int(start_text or 0)
+        end = min(int(end_text) if end_text else size - 1, size - 1)
+        if start >= size:
+            self.send_error(416)
+            return None
+        f = open(path, "rb")
+        f.seek(start)
+        self.send_response(206)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end, size))
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        return _LimitedFile(f, end - start + 1)
+
+    def copyfile(self, source, outputfile):
+        if not self.rate:
+            return super().copyfile(source, outputfile)
+        started = time.monotonic()
+        sent = 0
+        while True:
+            data = source.read(64 * 1024)
+            if not data:
+                return
+            outputfile.write(data)
+            sent += len(data)
+            delay = started + sent / self.rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+
+class _LimitedFile:
+    """File wrapper that stops after `remaining` bytes (copyfile reads until EOF)."""
+
+    def __init__(self, f, remaining):
+        self.f = f
+        self.remaining = remaining
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b""
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+def start_origin(media_dir, rate=0):
+    handler_class = type("PacedRangeHandler", (QuietRangeHandler,), {"rate": rate})
+    handler = lambda *handler_args: handler_class(*handler_args, directory=media_dir)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def fake_info(video_id, base_url, media_dir, profile, transcode):
+    """An info dict shaped like yt-dlp's YouTube extractor output, with formats on the fake origin."""
+    formats = []
+    for name, ext, vcodec, acodec in CASE_FORMATS[(profile, transcode)]:
+        formats.append({
+            "format_id": os.path.splitext(name)[0],
+            "url": "%s/%s?v=%s" % (base_url, name, video_id),
+            "protocol": "http",
+            "ext": ext,
+            "vcodec": vcodec,
+            "acodec": acodec,
+            "width": 1280 if vcodec != "none" else None,
+            "height": 720 if vcodec != "none" else None,
+            "filesize": os.path.getsize(os.path.join(media_dir, name)),
+        })
+    return {
+        "_type": "video",
+        "id": video_id,
+        "title": "Benchmark %s" % video_id,
+        "extractor": "youtube",
+        "extractor_key": "Youtube",
+        "webpage_url": "https://www.youtube.com/watch?v=" + video_id,
+        "formats": formats,
+    }
+
+
+def download_case(args):
+    """Child process: run `args.jobs` concurrent single-URL jobs and print one JSON result."""
+    os.chdir(args.workdir)  # V5 creates its journal and caches in the working directory.
+    sys.path.insert(0, REPO_DIR)
+    import V5
+    logging.getLogger().setLevel(logging.WARNING)
+    if args.range_mb:
+        V5.RANGE_FRAGMENT_SIZE = int(args.range_mb * 1024 * 1024)
+    fragments = V5.parse_fragments(args.connections)
+    transcode = args.transcode == "on"
+    folder = os.path.join(args.workdir, "out")
+    os.makedirs(folder, exist_ok=True)
+    urls = []
+    for index in range(args.jobs):
+        video_id = "bench%06d" % index
+        V5.info_cache.put(video_id, fake_info(video_id, args.base_url, args.media_dir, args.profile, transcode))
+        urls.append("https://www.youtube.com/watch?v=" + video_id)
+
+    job_ids = []
+    cpu_start = resource.getrusage(resource.RUSAGE_SELF)
+    wall_start = time.perf_counter()
+    threads = [threading.Thread(target=lambda url=url: job_ids.append(
+                   V5.download_videos([url], args.profile == "mp3", folder, 1, fragments=fragments)))
+               for url in urls]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - wall_start
+    usage_self = resource.getrusage(resource.RUSAGE_SELF)
+    usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    errors = sum(V5.job_store.item_counts(job_id).get('error', 0) for job_id in job_ids)
+    # The journal only records progress periodically, so count what the origin served instead.
+    per_job = sum(os.path.getsize(os.path.join(args.media_dir, name))
+                  for name, _, _, _ in CASE_FORMATS[(args.profile, transcode)])
+    downloaded = per_job * (args.jobs - errors)
+    cpu = (usage_self.ru_utime - cpu_start.ru_utime + usage_self.ru_stime - cpu_start.ru_stime
+           + usage_children.ru_utime + usage_children.ru_stime)
+    print(json.dumps({
+        "jobs": args.jobs,
+        "profile": args.profile,
+        "transcode": args.transcode,
+        "connections": args.connections,
+        # The level auto jobs finished on, which seeds the next job.
+        "fragment_level": V5.fragment_tuner.learned,
+        "wall_s": round(wall, 3),
+        "jobs_per_min": round(args.jobs / wall * 60, 2),
+        "mb_per_s": round(downloaded / wall / 1e6, 2),
+        "downloaded_mb": round(downloaded / 1e6, 2),
+        "cpu_s": round(cpu, 2),
+        "cpu_ffmpeg_s": round(usage_children.ru_utime + usage_children.ru_stime, 2),
+        # ru_maxrss is in KiB on Linux.
+        "peak_rss_mb": round(usage_self.ru_maxrss / 1024, 1),
+        "peak_rss_ffmpeg_mb": round(usage_children.ru_maxrss / 1024, 1),
+        "errors": errors,
+    }))
+
+
+def download(args):
+    results = []
+    failures = []
+    with tempfile.TemporaryDirectory() as media_dir:
+        generate_media(media_dir, args.duration)
+        origin = start_origin(media_dir, args.origin_mbps * 1e6 / 8)
+        base_url = "http://127.0.0.1:%d" % origin.server_address[1]
+        cases = [(jobs, profile, transcode, connections)
+                 for jobs in [int(value) for value in args.jobs.split(",")]
+                 for profile in args.profiles.split(",")
+                 for transcode in args.transcode.split(",")
+                 for connections in args.connections.split(",")]
+        try:
+            for jobs, profile, transcode, connections in cases:
+                name = "%d/%s/%s/%s" % (jobs, profile, transcode, connections)
+                with tempfile.TemporaryDirectory() as workdir:
+                    result = subprocess.run(
+                        [sys.executable, os.path.abspath(__file__), "download-case",
+                         "--jobs", str(jobs), "--profile", profile, "--transcode", transcode,
+                         "--connections", connections, "--range-mb", str(args.range_mb),
+                         "--base-url", base_url, "--media-dir", media_dir, "--workdir", workdir],
+                        capture_output=True, text=True)
+                if result.returncode != 0:
+                    failures.append("%s: %s" % (name, result.stderr.strip().splitlines()[-1:]))
+                    continue
+                case = json.loads(result.stdout.strip().splitlines()[-1])
+                if case["errors"]:
+                    failures.append("%s: %d job(s) failed" % (name, case["errors"]))
+                results.append(case)
+        finally:
+            origin.shutdown()
+    return results, failures
+
+
+SEARCH_QUERIES = ["w0", '"w0 w1"', "w1*", "w0 w2 w3"]
+
+
+def synthetic_transcript(rng, words=3000, per_entry=10, vocabulary=50000):
+    tokens = rng.zipf(1.3, size=words) % vocabulary
+    return [{"text": " ".join("w%d" % token for token in tokens[i:i + per_entry]), "start": i / 2.0}
+            for i in range(0, words, per_entry)]
+
+
+def search(args):
+    import numpy as np
+    import transcript_search
+    results = []
+    failures = []
+    rng = np.random.default_rng(1)
+    with tempfile.TemporaryDirectory() as workdir:
+        index = transcript_search.SearchIndex(os.path.join(workdir, "index"))
+        indexed = 0
+        for docs in sorted(int(value) for value in args.docs.split(",")):
+            started = time.perf_counter()
+            for number in range(indexed, docs):
+                index.add("v%010d" % number, synthetic_transcript(rng))
+            indexed = max(indexed, docs)
+            index.commit()
+            build_s = time.perf_counter() - started
+            reader = transcript_search.SearchIndex(index.directory)
+            queries = {}
+            for query in SEARCH_QUERIES:
+                times = []
+                for _ in range(args.runs):
+                    started = time.perf_counter()
+                    result = reader.search(query)
+                    times.append((time.perf_counter() - started) * 1000)
+                queries[query] = {"median_ms": round(statistics.median(times), 2),
+                                  "total_hits": result["total_hits"], "videos": result["videos"]}
+                if args.max_query_ms is not None and queries[query]["median_ms"] > args.max_query_ms:
+                    failures.append("%d docs, %s: %.1f ms > %.1f ms" % (docs, query, queries[query]["median_ms"],
+                                                                        args.max_query_ms))
+            results.append({"docs": docs, "segments": len(reader.segments), "build_s": round(build_s, 2),
+                            "queries": queries})
+    return results, failures
+
+
+SCENARIOS = {
+    "startup": startup,
+    "download": download,
+    "search": search,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the V5 downloader server and transcript search.")
+    parser.add_argument("scenario", choices=sorted(SCENARIOS), help="What to measure")
+    parser.add_argument("--runs", type=int, default=5, help="Repetitions per measurement (median is reported)")
+    parser.add_argument("--max-import-ms", type=float, help="Fail if importing V5 takes longer")
+    parser.add_argument("--max-first-response-ms", type=float, help="Fail if the first response takes longer")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    parser.add_argument("--jobs", default="1,8,64", help="download: comma-separated concurrent job counts")
+    parser.add_argument("--profiles", default="mp4,mp3", help="download: comma-separated profiles")
+    parser.add_argument("--transcode", default="off,on", help="download: comma-separated transcode settings")
+    parser.add_argument("--duration", type=float, default=10, help="download: seconds of synthetic media per video")
+    parser.add_argument("--connections", default="auto",
+                        help="download: comma-separated connections per download (1..16 or auto)")
+    parser.add_argument("--origin-mbps", type=float, default=0,
+                        help="download: per-connection rate of the fake origin in Mbit/s (0 = unlimited)")
+    parser.add_argument("--range-mb", type=float, default=0,
+                        help="download: range fragment size in MiB (0 = V5's RANGE_FRAGMENT_SIZE)")
+    parser.add_argument("--docs", default="500,2000,8000", help="search: comma-separated corpus sizes")
+    parser.add_argument("--max-query-ms", type=float, help="search: fail if a query's median time is longer")
+    if sys.argv[1:2] == ["download-case"]:
+        case_parser = argparse.ArgumentParser()
+        for name in ("--jobs", "--profile", "--transcode", "--connections", "--base-url", "--media-dir", "--workdir"):
+            case_parser.add_argument(name, required=True, type=int if name == "--jobs" else str)
+        case_parser.add_argument("--range-mb", type=float, default=0)
+        download_case(case_parser.parse_args(sys.argv[2:]))
+        return
+    args = parser.parse_args()
+
+    results, failures = SCENARIOS[args.scenario](args)
+    report = {
+        "scenario": args.scenario,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+        "failures": failures,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# V5 opens its job journal, info cache and library catalog in the working
+# directory at import time, so tests run from a scratch directory.
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+os.chdir(tempfile.mkdtemp(prefix='ytdl-tests-'))
@@ -0,0 +1,19 @@
+import V5
+
+
+def test_archive_skip_is_reported_once_per_item(tmp_path, monkeypatch):
+    path = tmp_path / 'Some video.mp4'
+    path.write_bytes(b'')
+    archive = V5.ArchiveIndex(str(tmp_path))
+    archive.add('dQw4w9WgXcQ', 'mp4', str(path))
+    logged = []
+    monkeypatch.setattr(V5, 'log_message', lambda message, *args: logged.append(message))
+    skips = sum(V5.METRIC_ARCHIVE_SKIPS.values.values())
+    context = {'archive': archive, 'profile': 'mp4', 'archive_skips': set()}
+
+    # yt-dlp runs the match_filter from extract_info, process_ie_result and process_info.
+    for incomplete in (True, False, False):
+        assert V5.archive_match_filter({'id': 'dQw4w9WgXcQ'}, context, incomplete)
+    assert V5.archive_match_filter({'id': '9bZkp7q19f0'}, context) is None
+    assert len(logged) == 1
+    assert sum(V5.METRIC_ARCHIVE_SKIPS.values.values()) == skips + 1
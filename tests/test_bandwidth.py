@@ -0,0 +1,30 @@
+import pytest
+
+import V5
+
+
+@pytest.mark.parametrize('value, expected', [('', 0), (None, 0), ('1048576', 1048576), ('500K', 512000),
+                                             ('2.5M', 2621440), ('1 MiB/s', 1048576), ('-5', 0)])
+def test_parse_rate(value, expected):
+    assert V5.parse_rate(value) == expected
+
+
+@pytest.mark.parametrize('value', ['inf', '-inf', 'nan', '1e400', '1e400K', 'fast'])
+def test_parse_rate_rejects_non_numbers(value):
+    with pytest.raises(ValueError):
+        V5.parse_rate(value)
+
+
+def test_start_with_an_infinite_rate_limit_is_a_form_error(tmp_path, monkeypatch):
+    started = []
+    monkeypatch.setattr(V5, 'start_download_thread', lambda urls, **options: started.append(urls))
+    response = V5.app.test_client().post('/start', data={'urls': 'https://youtu.be/dQw4w9WgXcQ',
+                                                         'folder': str(tmp_path), 'rate_limit': 'inf'})
+    assert response.status_code == 200
+    assert b'Invalid bandwidth limit' in response.data
+    assert not started
+
+
+def test_bandwidth_api_rejects_an_infinite_limit():
+    response = V5.app.test_client().post('/api/bandwidth', json={'global_limit': '1e400'})
+    assert response.status_code == 400
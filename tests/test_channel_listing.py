@@ -0,0 +1,82 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import yt_transcript_downloader
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+# Continuation token -> saved browse response
+BROWSE_PAGES = {'page-2-token': 'channel_browse_page2.json', 'page-3-token': 'channel_browse_page3.json'}
+ALL_IDS = ['vid%08d' % number for number in range(1, 11)]
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), 'rb') as f:
+        return f.read()
+
+
+@pytest.fixture
+def youtube():
+    """Local stand-in for youtube.com serving the saved channel page and browse continuations."""
+    posts = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def reply(self, body, content_type):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path != '/@fixture/videos':
+                self.send_error(404)
+                return
+            self.reply(read_fixture('channel_videos.html'), 'text/html; charset=utf-8')
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            posts.append((self.path, body))
+            page = BROWSE_PAGES.get(body.get('continuation'))
+            if page is None:
+                self.send_error(400)
+                return
+            self.reply(read_fixture(page), 'application/json')
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    server.channel_url = 'http://127.0.0.1:{}/@fixture'.format(server.server_address[1])
+    server.posts = posts
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_channel_listing_follows_continuations(youtube):
+    assert yt_transcript_downloader.get_videos_from_channel(youtube.channel_url) == ALL_IDS
+    assert [body['continuation'] for _, body in youtube.posts] == ['page-2-token', 'page-3-token']
+    path, body = youtube.posts[0]
+    assert path == '/youtubei/v1/browse?key=fixture-key'
+    assert body['context']['client']['clientVersion'] == '2.20260101.00.00'
+
+
+@pytest.mark.parametrize('limit, pages_fetched', [(3, 0), (4, 0), (6, 1), (9, 2)])
+def test_channel_listing_stops_paging_at_the_limit(youtube, limit, pages_fetched):
+    ids = yt_transcript_downloader.get_videos_from_channel(youtube.channel_url, limit)
+    assert ids == ALL_IDS[:limit]
+    assert len(youtube.posts) == pages_fetched
+
+
+def test_iterating_lazily_requests_no_page_ahead(youtube):
+    ids = yt_transcript_downloader.iter_channel_video_ids(youtube.channel_url)
+    assert [next(ids) for _ in range(4)] == ALL_IDS[:4]
+    assert not youtube.posts
+    assert next(ids) == ALL_IDS[4]
+    assert len(youtube.posts) == 1
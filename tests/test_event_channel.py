@@ -0,0 +1,43 @@
+import json
+import time
+
+import V5
+
+
+def test_progress_does_not_evict_log_lines():
+    channel = V5.EventChannel(maxlen=3)
+    channel.publish('line 1')
+    channel.publish('line 2')
+    for downloaded in range(500):
+        for url in ('a', 'b'):
+            channel.publish({'url': url, 'stage': 'downloading', 'downloaded_bytes': downloaded},
+                            event='progress', key=url)
+    events, keyed, closed = channel.read_since(0, timeout=0)
+    assert [data for _, event, data in events if event is None] == ['line 1', 'line 2']
+    frames = [json.loads(data) for _, event, data in events if event == 'progress']
+    assert frames == [[{'url': 'a', 'stage': 'downloading', 'downloaded_bytes': 499},
+                       {'url': 'b', 'stage': 'downloading', 'downloaded_bytes': 499}]]
+    assert keyed and not closed
+
+
+def test_final_progress_is_kept_and_its_key_dropped():
+    channel = V5.EventChannel()
+    channel.publish({'url': 'a', 'stage': 'downloading'}, event='progress', key='a')
+    channel.publish({'url': 'a', 'stage': 'done'}, event='progress', key='a', final=True)
+    assert not channel.keyed
+    events, keyed, _ = channel.read_since(0, timeout=0)
+    assert [json.loads(data) for _, _, data in events] == [[{'url': 'a', 'stage': 'done'}]]
+    assert not keyed
+
+
+def test_progress_frames_are_rate_limited_per_job():
+    channel = V5.EventChannel()
+    channel.publish({'url': 'a', 'stage': 'downloading'}, event='progress', key='a')
+    events, keyed, _ = channel.read_since(0, timeout=0)
+    last_id = events[-1][0]
+    keyed_after = time.monotonic() + 0.3
+    channel.publish({'url': 'b', 'stage': 'downloading'}, event='progress', key='b')
+    started = time.monotonic()
+    events, keyed, _ = channel.read_since(last_id, timeout=5, keyed_after=keyed_after)
+    assert time.monotonic() - started >= 0.25
+    assert keyed and [json.loads(data)[0]['url'] for _, _, data in events] == ['b']
@@ -0,0 +1,105 @@
+import os
+import shutil
+import subprocess
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import V5
+
+
+def broken_download(tmp_path):
+    path = tmp_path / 'Broken.webm'
+    path.write_bytes(b'not a media file')
+    return str(path)
+
+
+def test_finalize_mp4_raises_instead_of_keeping_the_input(tmp_path):
+    with pytest.raises(RuntimeError):
+        V5.finalize_mp4(broken_download(tmp_path))
+
+
+def test_failed_finalize_leaves_the_item_in_error_and_unarchived(tmp_path):
+    folder = str(tmp_path)
+    path = broken_download(tmp_path)
+    job_id = V5.job_store.create_job(['https://www.youtube.com/watch?v=brokenvideo'], False, folder, 1)
+    job = V5.job_store.get_job(job_id)
+    item_id = V5.job_store.pending_items(job_id)[0]['id']
+    archive = V5.get_archive(folder)
+    context = {'url': 'https://www.youtube.com/watch?v=brokenvideo', 'job_id': job_id, 'archive': archive,
+               'profile': 'mp4', 'progress_fields': {}}
+
+    V5.postprocess_item(job, context, item_id, [({'id': 'brokenvideo', 'title': 'Broken'}, path)])
+
+    item = V5.job_store.list_items(job_id)[0]
+    assert item['state'] == 'error'
+    assert archive.lookup('brokenvideo', 'mp4') is None
+    rows, total = V5.library_catalog.list_files(10, folder=folder)
+    assert total == 0
+    assert os.path.exists(path)
+
+
+def lavfi_media(path, *codec_args):
+    subprocess.run(['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', 'testsrc=size=64x48:rate=10:duration=1',
+                    '-f', 'lavfi', '-i', 'sine=duration=1', '-shortest', *codec_args, str(path)], check=True)
+    return str(path)
+
+
+needs_ffmpeg = pytest.mark.skipif(not shutil.which('ffmpeg') or not shutil.which('ffprobe'),
+                                  reason='needs ffmpeg and ffprobe')
+
+
+@needs_ffmpeg
+def test_only_files_that_need_converting_are_rewritten_and_tagged(tmp_path):
+    video = lavfi_media(tmp_path / 'Some title.mp4', '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-c:a', 'aac')
+    audio = lavfi_media(tmp_path / 'Other title.m4a', '-vn', '-c:a', 'aac')
+    stamp = os.stat(video).st_mtime_ns
+
+    assert V5.finalize_mp4(video, video_id='dQw4w9WgXcQ') == video
+    assert os.stat(video).st_mtime_ns == stamp
+    assert V5.finalize_mp3(audio, video_id='9bZkp7q19f0') == str(tmp_path / 'Other title.mp3')
+
+    archive = V5.ArchiveIndex(str(tmp_path))
+    assert archive.rebuild() == (1, 1)
+    assert archive.lookup('9bZkp7q19f0', 'mp3') == str(tmp_path / 'Other title.mp3')
+
+
+@needs_ffmpeg
+def test_merged_download_is_tagged_by_the_merge_and_not_rewritten(tmp_path, monkeypatch):
+    media = tmp_path / 'media'
+    media.mkdir()
+    lavfi_media(media / 'video.mp4', '-map', '0:v', '-c:v', 'libx264', '-pix_fmt', 'yuv420p')
+    lavfi_media(media / 'audio.m4a', '-map', '1:a', '-c:a', 'aac')
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=str(media)))
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    base_url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    formats = [{'format_id': name, 'url': base_url + name + '.' + ext, 'protocol': 'http', 'ext': ext,
+                'vcodec': vcodec, 'acodec': acodec, 'filesize': os.path.getsize(media / (name + '.' + ext))}
+               for name, ext, vcodec, acodec in (('video', 'mp4', 'avc1.64001f', 'none'),
+                                                 ('audio', 'm4a', 'none', 'mp4a.40.2'))]
+    V5.info_cache.put('mergedvideo', {'_type': 'video', 'id': 'mergedvideo', 'title': 'Merged', 'formats': formats,
+                                      'extractor': 'youtube', 'extractor_key': 'Youtube',
+                                      'webpage_url': 'https://www.youtube.com/watch?v=mergedvideo'})
+    finalize_runs = []
+    run = subprocess.run
+    monkeypatch.setattr(V5.subprocess, 'run', lambda args, **kwargs: (
+        finalize_runs.append(args) if os.path.basename(args[0]).startswith('ffmpeg') else None) or run(args, **kwargs))
+    folder = str(tmp_path / 'out')
+    os.makedirs(folder)
+    try:
+        job_id = V5.download_videos(['https://www.youtube.com/watch?v=mergedvideo'], False, folder, 1)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    item = V5.job_store.list_items(job_id)[0]
+    assert item['state'] == 'finished', item['error']
+    assert V5.probe_video_id(item['output_path']) == 'mergedvideo'
+    assert finalize_runs == []
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
@@ -0,0 +1,65 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import V5
+
+SIZE = 2 * 1024 * 1024 + 12345
+
+
+@pytest.fixture
+def origin():
+    """Stands in for googlevideo: serves one file, honouring the `range` query parameter."""
+    body = os.urandom(SIZE)
+    ranges = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            query = parse_qs(urlsplit(self.path).query)
+            start, end = 0, SIZE - 1
+            if 'range' in query:
+                ranges.append(query['range'][0])
+                start, end = (int(value) for value in query['range'][0].split('-'))
+            self.send_response(200)
+            self.send_header('Content-Length', str(end - start + 1))
+            self.end_headers()
+            self.wfile.write(body[start:end + 1])
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    server.url = 'http://127.0.0.1:{}/videoplayback?itag=18'.format(server.server_address[1])
+    server.body, server.ranges = body, ranges
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_https_format_is_downloaded_in_range_fragments(origin, tmp_path, monkeypatch):
+    monkeypatch.setattr(V5, 'RANGE_FRAGMENT_SIZE', 1024 * 1024)
+    info = {'_type': 'video', 'id': 'aaaaaaaaaaa', 'title': 'ranged', 'extractor': 'youtube',
+            'extractor_key': 'Youtube', 'webpage_url': 'https://www.youtube.com/watch?v=aaaaaaaaaaa',
+            'formats': [{'format_id': '18', 'url': origin.url, 'protocol': 'https', 'ext': 'mp4',
+                         'vcodec': 'avc1.42001E', 'acodec': 'mp4a.40.2', 'filesize': SIZE}]}
+    import yt_dlp
+    with yt_dlp.YoutubeDL({'outtmpl': str(tmp_path / '%(id)s.%(ext)s'), 'quiet': True,
+                           'concurrent_fragment_downloads': 3}) as ydl:
+        ydl.process_ie_result(V5.with_range_fragments(info), download=True)
+
+    assert (tmp_path / 'aaaaaaaaaaa.mp4').read_bytes() == origin.body
+    assert sorted(origin.ranges) == ['0-1048575', '1048576-2097151', '2097152-2109496']
+    # The cached info dict is left as extracted.
+    assert info['formats'][0]['protocol'] == 'https'
+
+
+def test_formats_of_unknown_size_stay_on_one_connection():
+    fmt = {'url': 'https://example.com/v', 'protocol': 'https', 'filesize_approx': 50 * 1024 * 1024}
+    assert V5.range_fragments(fmt) is fmt
+    hls = {'url': 'https://example.com/v.m3u8', 'protocol': 'm3u8_native', 'filesize': 50 * 1024 * 1024}
+    assert V5.range_fragments(hls) is hls
@@ -0,0 +1,87 @@
+import pytest
+
+import V5
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    started = []
+    monkeypatch.setattr(V5, 'start_job_thread', started.append)
+    client = V5.app.test_client()
+    client.folder = str(tmp_path)
+    client.started = started
+    return client
+
+
+def test_json_array_body_is_rejected(client):
+    response = client.post('/api/jobs', json=['https://www.youtube.com/watch?v=dQw4w9WgXcQ'])
+    assert response.status_code == 400
+    assert 'object' in response.get_json()['error']
+
+
+def test_json_urls_are_validated_before_a_job_is_created(client):
+    response = client.post('/api/jobs', json={'folder': client.folder,
+                                              'urls': ['https://youtu.be/dQw4w9WgXcQ', 42, 'not a url', None]})
+    assert response.status_code == 400
+    assert response.get_json()['invalid'] == [42, 'not a url', None]
+    assert not client.started
+
+
+def test_valid_json_submission_is_journaled_and_started(client):
+    response = client.post('/api/jobs', json={'folder': client.folder,
+                                              'urls': ['https://youtu.be/dQw4w9WgXcQ', 'https://youtu.be/9bZkp7q19f0']})
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body['items'] == 2
+    assert client.started == [body['job_id']]
+
+
+def test_oversized_json_body_is_refused(client, monkeypatch):
+    monkeypatch.setattr(V5, 'MAX_JSON_BODY', 64)
+    response = client.post('/api/jobs', json={'folder': client.folder, 'urls': ['https://youtu.be/dQw4w9WgXcQ'] * 10})
+    assert response.status_code == 413
+
+
+def test_text_body_with_bad_lines_fails_the_job(client):
+    body = 'https://youtu.be/dQw4w9WgXcQ\nftp://example.com/video\n{"url": 5}\n'
+    response = client.post('/api/jobs?folder=' + client.folder, data=body, content_type='text/plain')
+    assert response.status_code == 400
+    result = response.get_json()
+    assert result['invalid'] == ['ftp://example.com/video', 5]
+    assert V5.job_store.get_job(result['job_id'])['state'] == 'failed'
+    assert not client.started
+
+
+def test_interrupted_submissions_are_failed_on_startup(client):
+    job_id = V5.job_store.create_job(['https://youtu.be/dQw4w9WgXcQ'], False, client.folder, 1, state='submitting')
+    V5.resume_unfinished_jobs()
+    assert V5.job_store.get_job(job_id)['state'] == 'failed'
+    assert job_id not in client.started
+
+
+def test_form_urlencoded_raw_body_is_read_as_the_url_list(client):
+    # What `curl --data-binary @urls.txt` sends.
+    body = 'https://youtu.be/dQw4w9WgXcQ\nhttps://youtu.be/9bZkp7q19f0\n'
+    response = client.post('/api/jobs?folder=' + client.folder, data=body,
+                           content_type='application/x-www-form-urlencoded')
+    assert response.status_code == 202
+    assert response.get_json()['items'] == 2
+
+
+def test_empty_streamed_body_creates_no_job(client):
+    before = V5.job_store.list_jobs(1)[1]
+    response = client.post('/api/jobs?folder=' + client.folder, data='# nothing yet\n\n', content_type='text/plain')
+    assert response.status_code == 400
+    assert 'job_id' not in response.get_json()
+    assert V5.job_store.list_jobs(1)[1] == before
+
+
+def test_stream_of_a_failed_job_replays_the_journal_and_ends(client):
+    job_id = V5.job_store.create_job(['https://youtu.be/dQw4w9WgXcQ'], False, client.folder, 1, state='submitting')
+    V5.resume_unfinished_jobs()
+    response = client.get('/stream/' + job_id)
+    body = response.get_data(as_text=True)
+    assert '[https://youtu.be/dQw4w9WgXcQ] Queued' in body
+    assert 'Job failed.' in body
+    assert body.rstrip().endswith('data: ' + V5.EOF_MARKER)
+    assert V5.get_channel(job_id) is None
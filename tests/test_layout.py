@@ -0,0 +1,36 @@
+import os
+
+import pytest
+
+import V5
+
+
+def media(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb'):
+        pass
+    return path
+
+
+@pytest.mark.skipif(not hasattr(os, 'symlink'), reason='needs symlinks')
+def test_title_links_are_sharded_by_the_title(tmp_path):
+    folder = str(tmp_path)
+    path = media(os.path.join(V5.shard_dir(folder, 'dQw4w9WgXcQ'), 'Never Gonna Give You Up.mp4'))
+    V5.link_title(folder, path, 'dQw4w9WgXcQ')
+    V5.link_title(folder, media(os.path.join(V5.shard_dir(folder, '9bZkp7q19f0'), '¿Qué?.mp4')), '9bZkp7q19f0')
+
+    link = os.path.join(folder, 'by-title', 'n', 'ne', 'Never Gonna Give You Up [dQw4w9WgXcQ].mp4')
+    assert os.path.realpath(link) == os.path.realpath(path)
+    assert os.path.islink(os.path.join(folder, 'by-title', '_', '_q', '¿Qué? [9bZkp7q19f0].mp4'))
+
+
+def test_rebuild_only_takes_ids_from_real_shard_paths(tmp_path):
+    folder = str(tmp_path)
+    sharded = media(os.path.join(V5.shard_dir(folder, 'dQw4w9WgXcQ'), 'Some title.mp4'))
+    # Three levels deep like a shard, but the prefixes do not match the name.
+    media(os.path.join(folder, 'Music', '2024', 'Summer_trip', 'Holiday.mp4'))
+    media(os.path.join(folder, 'xx', 'yy', '9bZkp7q19f0', 'Other.mp4'))
+
+    archive = V5.ArchiveIndex(folder)
+    assert archive.rebuild(probe=False) == (1, 2)
+    assert archive.lookup('dQw4w9WgXcQ', 'mp4') == sharded
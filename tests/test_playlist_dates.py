@@ -0,0 +1,55 @@
+import V5
+
+
+class FakeYdl:
+    def extract_info(self, url, download=False, process=False):
+        raise AssertionError("nested playlists are not expected here")
+
+
+def channel(entries):
+    return {'_type': 'playlist', 'entries': iter(entries)}
+
+
+def flat_entry(video_id, **fields):
+    entry = {'_type': 'url', 'id': video_id, 'url': 'https://www.youtube.com/watch?v=' + video_id}
+    entry.update(fields)
+    return entry
+
+
+def test_flat_entries_with_approximate_timestamp_stop_at_date_after():
+    consumed = []
+
+    def entries():
+        # approximate_date gives flat entries a timestamp but no upload_date.
+        for n, timestamp in enumerate((1717200000, 1714521600, 1709251200, 1704067200)):
+            consumed.append(n)
+            yield flat_entry('video%06d' % n, timestamp=timestamp)
+
+    urls = list(V5.iter_playlist_entries(FakeYdl(), channel(entries()), date_after='20240401'))
+    assert urls == ['https://www.youtube.com/watch?v=video000000', 'https://www.youtube.com/watch?v=video000001']
+    # Paging stops at the first older upload instead of enumerating the channel.
+    assert consumed == [0, 1, 2]
+
+
+def test_flat_entries_without_any_date_are_left_to_daterange():
+    entries = [flat_entry('video%06d' % n) for n in range(3)]
+    urls = list(V5.iter_playlist_entries(FakeYdl(), channel(entries), date_after='20240401'))
+    assert len(urls) == 3
+
+
+def test_checkout_sets_and_clears_date_options():
+    ydl, context = V5.ydl_pool.checkout(False, '.', date_after='20240401')
+    try:
+        assert ydl.params['extractor_args']['youtubetab']['approximate_date'] == ['']
+        # Undated flat entries are still filtered once fully extracted.
+        assert ydl._match_entry({'id': 'old', 'title': 'old', 'upload_date': '20240101'}, incomplete=False)
+        assert ydl._match_entry({'id': 'new', 'title': 'new', 'upload_date': '20240501'}, incomplete=False) is None
+    finally:
+        V5.ydl_pool.checkin(ydl, context, False)
+
+    ydl, context = V5.ydl_pool.checkout(False, '.')
+    try:
+        assert 'youtubetab' not in ydl.params['extractor_args']
+        assert 'daterange' not in ydl.params
+    finally:
+        V5.ydl_pool.checkin(ydl, context, False)
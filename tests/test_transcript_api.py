@@ -0,0 +1,39 @@
+import pytest
+import requests
+
+import yt_transcript_downloader as downloader
+
+
+class Reached(Exception):
+    pass
+
+
+class RecordingSession(requests.Session):
+    """Session that stops at the first request, proving the library used it."""
+
+    def __init__(self):
+        super().__init__()
+        self.urls = []
+
+    def request(self, method, url, *args, **kwargs):
+        self.urls.append(url)
+        raise Reached(url)
+
+
+def test_list_transcripts_uses_the_shared_session_with_the_installed_library():
+    session = RecordingSession()
+    # A TypeError here means the wrong API branch was taken for this library version.
+    with pytest.raises(Reached):
+        downloader.list_transcripts('dQw4w9WgXcQ', session)
+    assert session.urls and 'dQw4w9WgXcQ' in session.urls[0]
+
+
+def test_list_transcripts_prefers_the_1x_api_when_list_transcripts_is_still_defined(monkeypatch):
+    # youtube-transcript-api 1.0 and 1.1 keep the deprecated list_transcripts classmethod.
+    api = downloader.YouTubeTranscriptApi
+    if not hasattr(api, 'list'):
+        pytest.skip("installed youtube-transcript-api predates 1.0")
+    monkeypatch.setattr(api, 'list_transcripts', classmethod(lambda cls, video_id: None), raising=False)
+    session = RecordingSession()
+    with pytest.raises(Reached):
+        downloader.list_transcripts('dQw4w9WgXcQ', session)
@@ -0,0 +1,91 @@
+import numpy as np
+
+import transcript_related
+
+
+def entries(text):
+    return [{'text': text, 'start': 0.0}]
+
+
+def test_scores_match_the_full_width_product(tmp_path, monkeypatch):
+    monkeypatch.setattr(transcript_related, 'QUERY_BATCH', 2)
+    model = transcript_related.RelatedIndex(str(tmp_path / transcript_related.MODEL_FILENAME))
+    texts = {'aaaaaaaaaaa': 'sourdough starter flour water', 'bbbbbbbbbbb': 'sourdough loaf oven',
+             'ccccccccccc': 'guitar chords practice', 'ddddddddddd': 'guitar strings flour'}
+    for video_id, text in texts.items():
+        model.add(video_id, entries(text))
+    model.commit()
+
+    vectors = model.vectors
+    expected = (vectors @ vectors.toarray().T).T
+    np.fill_diagonal(expected, 0)
+    results = model.similar_many(list(texts), k=3)
+    for row, video_id in enumerate(texts):
+        scores = {result['video_id']: result['score'] for result in results[video_id]}
+        assert scores == {model.ids[column]: round(float(expected[row, column]), 4)
+                          for column in np.flatnonzero(expected[row] > 0)}
+
+    assert [result['video_id'] for result in model.query('sourdough oven')] == ['bbbbbbbbbbb', 'aaaaaaaaaaa']
+    assert model.query('nothing matches this') == []
+
+
+def test_query_between_add_and_commit_ignores_uncommitted_terms(tmp_path):
+    model = transcript_related.RelatedIndex(str(tmp_path / transcript_related.MODEL_FILENAME))
+    model.add('aaaaaaaaaaa', entries('sourdough starter'))
+    model.commit()
+    model.add('bbbbbbbbbbb', entries('brandnewterm sourdough'))
+
+    assert model.query('brandnewterm') == []
+    assert [result['video_id'] for result in model.query('brandnewterm sourdough')] == ['aaaaaaaaaaa']
+
+    model.commit()
+    assert [result['video_id'] for result in model.query('brandnewterm')] == ['bbbbbbbbbbb']
+    reloaded = transcript_related.RelatedIndex(model.path)
+    assert reloaded.terms == model.terms
+    assert [result['video_id'] for result in reloaded.query('brandnewterm')] == ['bbbbbbbbbbb']
+
+
+def test_small_commits_go_to_the_delta_until_it_is_folded(tmp_path):
+    model = transcript_related.RelatedIndex(str(tmp_path / transcript_related.MODEL_FILENAME))
+    for number in range(16):
+        model.add('base%07d' % number, entries('sourdough starter number%d' % number))
+    model.commit()
+    main_stamp = transcript_related._stamp(model.path)
+    assert not (tmp_path / 'related-delta.npz').exists()
+
+    model.add('new00000001', entries('guitar chords'))
+    model.add('base0000003', entries('guitar strings'))  # replaces a row of the main file
+    model.commit()
+    model.add('new00000002', entries('guitar practice'))
+    model.commit()
+    assert transcript_related._stamp(model.path) == main_stamp
+    assert (tmp_path / 'related-delta.npz').exists()
+
+    reloaded = transcript_related.RelatedIndex(model.path)
+    assert reloaded.ids == model.ids and reloaded.terms == model.terms
+    assert (reloaded.counts != model.counts).nnz == 0
+    assert [result['video_id'] for result in reloaded.query('guitar strings')][0] == 'base0000003'
+
+    # The fifth delta row outgrows sqrt(20 videos): everything goes back into the main file.
+    for number in range(3, 5):
+        model.add('new%08d' % number, entries('guitar lesson'))
+        model.commit()
+    assert model.delta_rows == 0 and not (tmp_path / 'related-delta.npz').exists()
+    reloaded = transcript_related.RelatedIndex(model.path)
+    assert reloaded.ids == model.ids and reloaded.terms == model.terms
+
+
+def test_delta_left_behind_by_a_fold_is_ignored(tmp_path):
+    model = transcript_related.RelatedIndex(str(tmp_path / transcript_related.MODEL_FILENAME))
+    for number in range(9):
+        model.add('base%07d' % number, entries('sourdough'))
+    model.commit()
+    model.add('new00000001', entries('guitar'))
+    model.commit()
+    stale = (tmp_path / 'related-delta.npz').read_bytes()
+    model.save()
+    # A writer that stopped between writing the main file and removing the delta.
+    (tmp_path / 'related-delta.npz').write_bytes(stale)
+
+    reloaded = transcript_related.RelatedIndex(model.path)
+    assert reloaded.ids == model.ids and reloaded.terms == model.terms
@@ -0,0 +1,111 @@
+import json
+import os
+import random
+import time
+
+import transcript_search
+from yt_transcript_downloader import TranscriptStore
+
+
+def entries(text):
+    return [{'text': text, 'start': 0.0, 'duration': 1.0}]
+
+
+def write_loose(folder, video_id, text, mtime):
+    path = os.path.join(folder, video_id + '.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(entries(text), f)
+    os.utime(path, (mtime, mtime))
+
+
+def test_video_in_store_and_folder_is_yielded_once_from_the_newer_copy(tmp_path):
+    folder = str(tmp_path)
+    store = TranscriptStore(folder)
+    for video_id in ('aaaaaaaaaaa', 'bbbbbbbbbbb', 'ccccccccccc'):
+        store.put(video_id, entries('stored ' + video_id))
+    now = time.time()
+    write_loose(folder, 'aaaaaaaaaaa', 'older loose copy', now - 3600)
+    write_loose(folder, 'bbbbbbbbbbb', 'newer loose copy', now + 3600)
+    write_loose(folder, 'ddddddddddd', 'only loose', now)
+
+    found = {}
+    for video_id, transcript in transcript_search.iter_transcripts(folder, skip={'ccccccccccc'}):
+        assert video_id not in found
+        found[video_id] = transcript[0]['text']
+
+    assert found == {'aaaaaaaaaaa': 'stored aaaaaaaaaaa', 'bbbbbbbbbbb': 'newer loose copy',
+                     'ddddddddddd': 'only loose'}
+
+
+def brute_force_search(transcripts, clauses, limit):
+    """What SearchIndex.search should return, computed from the raw transcripts."""
+    by_video = {}
+    for video_id, texts in transcripts.items():
+        tokens, entry_of = [], []
+        for number, text in enumerate(texts):
+            words = transcript_search.tokenize(text)
+            tokens += words
+            entry_of += [number] * len(words)
+        positions = set()
+        for words, prefix in clauses:
+            starts = {p for p in range(len(tokens) - len(words) + 1)
+                      if all(tokens[p + k] == word or (prefix and k == len(words) - 1 and tokens[p + k].startswith(word))
+                             for k, word in enumerate(words))}
+            if not starts:
+                break
+            positions |= starts
+        else:
+            by_video[video_id] = sorted(positions), entry_of
+    hits = []
+    for video_id, (positions, entry_of) in sorted(by_video.items(), key=lambda item: (-len(item[1][0]), item[0])):
+        for entry in sorted({entry_of[p] for p in positions}):
+            if len(hits) < limit:
+                hits.append((video_id, entry))
+    return sum(len(positions) for positions, _ in by_video.values()), len(by_video), hits
+
+
+def test_search_matches_brute_force_across_segments_and_merges(tmp_path, monkeypatch):
+    monkeypatch.setattr(transcript_search, 'SEGMENT_MAX_DOCS', 7)
+    monkeypatch.setattr(transcript_search, 'MAX_SEGMENTS', 3)
+    monkeypatch.setattr(transcript_search, 'MERGE_CHUNK_POSTINGS', 50)
+    rng = random.Random(5)
+    words = ['alpha', 'alpine', 'beta', 'gamma', 'delta', 'del', 'epsilon', 'zeta']
+    transcripts = {}
+    index = transcript_search.SearchIndex(str(tmp_path / 'index'))
+    for round_number in range(3):
+        # Later rounds index some videos again, which hides their older copies.
+        for number in range(round_number * 10, round_number * 10 + 25):
+            video_id = 'video%06d' % number
+            texts = [' '.join(rng.choice(words) for _ in range(rng.randint(0, 6))) for _ in range(rng.randint(1, 8))]
+            transcripts[video_id] = texts
+            index.add(video_id, [{'text': text, 'start': float(n)} for n, text in enumerate(texts)])
+        index.commit()
+    index = transcript_search.SearchIndex(str(tmp_path / 'index'))
+
+    queries = {'alpha': [(['alpha'], False)], 'al*': [(['al'], True)], '"beta gamma"': [(['beta', 'gamma'], False)],
+               '"gamma del*"': [(['gamma', 'del'], True)], 'beta delta': [(['beta'], False), (['delta'], False)],
+               '"alpha beta" zeta*': [(['alpha', 'beta'], False), (['zeta'], True)], 'missing': [(['missing'], False)]}
+    for query, clauses in queries.items():
+        for limit in (3, 1000):
+            result = index.search(query, limit)
+            total_hits, videos, hits = brute_force_search(transcripts, clauses, limit)
+            assert (result['total_hits'], result['videos']) == (total_hits, videos), query
+            assert [(hit['video_id'], hit['entry']) for hit in result['hits']] == hits, query
+            assert all(hit['start'] == float(hit['entry']) for hit in result['hits'])
+
+
+def test_search_only_locates_the_returned_hits(tmp_path, monkeypatch):
+    index = transcript_search.SearchIndex(str(tmp_path / 'index'))
+    for number in range(200):
+        index.add('video%06d' % number, [{'text': 'common words everywhere', 'start': 0.0}] * 20)
+    index.commit()
+    located = []
+    locate = transcript_search.Segment.locate
+    monkeypatch.setattr(transcript_search.Segment, 'locate',
+                        lambda segment, doc, positions: located.append(doc) or locate(segment, doc, positions))
+
+    result = index.search('common', limit=5)
+
+    assert result['total_hits'] == 4000 and result['videos'] == 200
+    assert len(result['hits']) == 5
+    assert len(located) <= 5
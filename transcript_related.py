@@ -0,0 +1,354 @@
+"""
+Related videos: every transcript becomes a TF-IDF vector, and videos are ranked by
+cosine similarity to another video or to a free-text query.
+
+The model is <transcripts folder>/related.npz, holding the sparse video x term
+count matrix (CSR data/indices/indptr) plus the video IDs and the vocabulary as
+newline-joined UTF-8. Weights are derived from the counts on load (sublinear tf,
+smoothed idf, L2-normalised rows), so adding transcripts only appends count rows.
+A commit writes just the rows and terms added since related.npz was last written,
+to related-delta.npz in the same format; once the delta holds more than
+sqrt(videos) rows it is folded into related.npz. A commit so costs O(sqrt(corpus))
+rows amortised rather than the whole matrix. Both files carry the generation of
+related.npz they belong to, so a delta left behind by a fold is ignored.
+Queries are scored a batch at a time against just the columns of the terms they
+use, and the top k of each are picked with argpartition.
+
+Needs numpy and scipy.
+
+    python transcript_related.py build transcripts/
+    python transcript_related.py similar transcripts/ dQw4w9WgXcQ
+    python transcript_related.py query transcripts/ 'sourdough starter'
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+
+from transcript_search import tokenize, iter_transcripts
+
+MODEL_FILENAME = 'related.npz'
+DELTA_SUFFIX = '-delta.npz'
+DEFAULT_TOP_K = 10
+# Query vectors scored per matrix product; bounds the dense (batch terms x batch)
+# and (videos x batch) blocks it needs
+QUERY_BATCH = 64
+
+
+def _join(strings):
+    return np.frombuffer('\n'.join(strings).encode('utf-8'), dtype=np.uint8)
+
+
+def _split(array):
+    text = array.tobytes().decode('utf-8')
+    return text.split('\n') if text else []
+
+
+def _stamp(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _write(path, counts, ids, terms, generation):
+    temp = path + '.tmp'
+    with open(temp, 'wb') as f:
+        np.savez(f, data=counts.data, indices=counts.indices.astype(np.int32),
+                 indptr=counts.indptr.astype(np.int64), ids=_join(ids), terms=_join(terms),
+                 generation=np.array([generation], dtype=np.uint64))
+    os.replace(temp, path)
+
+
+def _read(data, width):
+    """(ids, terms, generation, counts) of a loaded file; the counts have `width` plus its own terms as columns."""
+    ids, terms = _split(data['ids']), _split(data['terms'])
+    generation = int(data['generation'][0]) if 'generation' in data.files else 0
+    counts = sparse.csr_matrix((data['data'], data['indices'], data['indptr']),
+                               shape=(len(ids), width + len(terms)))
+    return ids, terms, generation, counts
+
+
+class RelatedIndex:
+    """
+    TF-IDF model of one transcripts folder. add() buffers transcripts and commit()
+    appends them to the count matrix and saves them to the delta file (or folds
+    everything into the main file); readers in other processes pick up the new
+    files through refresh().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.delta_path = delta_path(path)
+        self.stamp = None
+        self._clear()
+        self.refresh()
+
+    def _clear(self):
+        self.ids = []
+        self.rows = {}
+        self.terms = []
+        self.vocabulary = {}
+        self.counts = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self.pending = {}
+        self.pending_terms = {}  # terms first seen since the last commit -> their future column
+        self.generation = None  # of the main file; None until there is one
+        self.base_terms = 0  # terms in the main file; later ones are in the delta
+        self.delta_rows = 0  # trailing rows that are in the delta
+        self._vectors = None
+        self._idf = None
+
+    def refresh(self):
+        """Reload the model if another process saved a new one."""
+        stamp = (_stamp(self.path), _stamp(self.delta_path))
+        if stamp[0] is None or stamp == self.stamp:
+            return
+        self._clear()
+        with np.load(self.path, allow_pickle=False) as data:
+            self.ids, self.terms, self.generation, self.counts = _read(data, 0)
+        self.rows = {video_id: row for row, video_id in enumerate(self.ids)}
+        self.base_terms = len(self.terms)
+        if stamp[1] is not None:
+            with np.load(self.delta_path, allow_pickle=False) as data:
+                ids, terms, generation, added = _read(data, self.base_terms)
+            if generation == self.generation:
+                self.terms.extend(terms)
+                self._append(ids, added)
+                self.delta_rows = len(ids)
+        self.vocabulary = {term: column for column, term in enumerate(self.terms)}
+        self.stamp = stamp
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, video_id):
+        return video_id in self.rows
+
+    def add(self, video_id, entries):
+        """
+        Buffer a transcript; a video added again replaces its old row on commit(). New
+        terms stay out of the vocabulary queries use until then, as the matrix lacks them.
+        """
+        counts = Counter(tokenize(' '.join(entry.get('text') or '' for entry in entries)))
+        vocabulary = self.vocabulary
+        pending_terms = self.pending_terms
+        for term in counts:
+            if term not in vocabulary and term not in pending_terms:
+                pending_terms[term] = len(self.terms) + len(pending_terms)
+        columns = np.fromiter((vocabulary[term] if term in vocabulary else pending_terms[term] for term in counts),
+                              dtype=np.int32, count=len(counts))
+        values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        order = np.argsort(columns)
+        self.pending[video_id] = (columns[order], values[order])
+
+    def _append(self, ids, added):
+        """Append count rows for `ids`, dropping the rows they replace; returns the mask of old rows kept."""
+        old = self.counts
+        old.resize((old.shape[0], added.shape[1]))
+        replaced = set(ids)
+        keep = np.fromiter((video_id not in replaced for video_id in self.ids), dtype=bool, count=len(self.ids))
+        if not keep.all():
+            old = old[keep]
+        self.ids = [video_id for video_id, kept in zip(self.ids, keep) if kept] + list(ids)
+        self.rows = {video_id: row for row, video_id in enumerate(self.ids)}
+        self.counts = sparse.vstack([old, added], format='csr', dtype=np.float32)
+        self._vectors = None
+        return keep
+
+    def commit(self):
+        """Append buffered transcripts to the matrix and save them."""
+        if not self.pending:
+            return
+        pending = self.pending
+        self.terms.extend(self.pending_terms)
+        self.vocabulary.update(self.pending_terms)
+        self.pending_terms = {}
+        indptr = np.cumsum([0] + [len(columns) for columns, _ in pending.values()])
+        added = sparse.csr_matrix((np.concatenate([values for _, values in pending.values()]),
+                                   np.concatenate([columns for columns, _ in pending.values()]), indptr),
+                                  shape=(len(pending), len(self.terms)))
+        keep = self._append(list(pending), added)
+        # Replaced delta rows leave the delta; the new rows always join it.
+        self.delta_rows = int(keep[len(keep) - self.delta_rows:].sum()) + len(pending)
+        self.pending = {}
+        if self.generation is None or self.delta_rows ** 2 > len(self.ids):
+            self.save()
+        else:
+            self.save_delta()
+
+    def save(self):
+        """Write the whole model to the main file and drop the delta."""
+        generation = int.from_bytes(os.urandom(8), 'little')
+        _write(self.path, self.counts, self.ids, self.terms, generation)
+        if os.path.exists(self.delta_path):
+            os.remove(self.delta_path)
+        self.generation = generation
+        self.base_terms = len(self.terms)
+        self.delta_rows = 0
+        self.stamp = (_stamp(self.path), None)
+
+    def save_delta(self):
+        """Write the rows and terms added since the main file was written."""
+        first = len(self.ids) - self.delta_rows
+        _write(self.delta_path, self.counts[first:], self.ids[first:], self.terms[self.base_terms:], self.generation)
+        self.stamp = (_stamp(self.path), _stamp(self.delta_path))
+
+    def _weigh(self, counts):
+        """Sublinear tf x idf, rows scaled to unit length."""
+        weights = counts.astype(np.float32)
+        weights.data = 1 + np.log(weights.data)
+        weights = weights @ sparse.diags(self._idf)
+        norms = np.sqrt(np.asarray(weights.multiply(weights).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return sparse.diags(1 / norms) @ weights
+
+    @property
+    def vectors(self):
+        if self._vectors is None:
+            counts = self.counts
+            document_frequency = np.bincount(counts.indices, minlength=counts.shape[1])
+            self._idf = (np.log((1 + counts.shape[0]) / (1 + document_frequency)) + 1).astype(np.float32)
+            self._vectors = self._weigh(counts).tocsr()
+        return self._vectors
+
+    def _top_k(self, queries, k, exclude=None):
+        """Best k (video_id, score) per query row; `exclude` holds a row per query to leave out (or -1)."""
+        vectors = self.vectors
+        k = min(k, len(self.ids))
+        results = []
+        for lo in range(0, queries.shape[0], QUERY_BATCH):
+            # Only the columns of terms the batch uses can score, so just those are made dense;
+            # that beats both a full-width dense batch and sparse x sparse (scores are mostly nonzero).
+            batch = queries[lo:lo + QUERY_BATCH]
+            columns = np.unique(batch.indices)
+            scores = (vectors[:, columns] @ batch[:, columns].T.toarray()).T
+            if exclude is not None:
+                rows = exclude[lo:lo + QUERY_BATCH]
+                excluded = np.flatnonzero(rows >= 0)
+                scores[excluded, rows[excluded]] = 0
+            if k <= 0:
+                results.extend([] for _ in range(len(scores)))
+                continue
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind='stable')
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+            for columns, values in zip(top.tolist(), top_scores.tolist()):
+                results.append([{'video_id': self.ids[column], 'score': round(value, 4)}
+                                for column, value in zip(columns, values) if value > 0])
+        return results
+
+    def similar_many(self, video_ids, k=DEFAULT_TOP_K):
+        """{video_id: [{'video_id', 'score'}, ...]} for every known ID, best match first."""
+        known = [video_id for video_id in video_ids if video_id in self.rows]
+        if not known:
+            return {}
+        rows = np.array([self.rows[video_id] for video_id in known])
+        queries = self.vectors[rows]
+        return dict(zip(known, self._top_k(queries, k, exclude=rows)))
+
+    def similar(self, video_id, k=DEFAULT_TOP_K):
+        """Videos most like `video_id`, or None if it is not in the model."""
+        return self.similar_many([video_id], k).get(video_id)
+
+    def query_many(self, texts, k=DEFAULT_TOP_K):
+        vectors = self.vectors  # sets the idf the queries are weighed with
+        indptr, columns, values = [0], [], []
+        for text in texts:
+            counts = Counter(term for term in tokenize(text) if term in self.vocabulary)
+            columns.extend(self.vocabulary[term] for term in counts)
+            values.extend(counts.values())
+            indptr.append(len(columns))
+        queries = sparse.csr_matrix((np.array(values, dtype=np.float32), np.array(columns, dtype=np.int32),
+                                     indptr), shape=(len(texts), vectors.shape[1]))
+        return self._top_k(self._weigh(queries).tocsr(), k)
+
+    def query(self, text, k=DEFAULT_TOP_K):
+        """Videos whose transcripts best match free text."""
+        return self.query_many([text], k)[0]
+
+
+def model_path(transcripts_dir):
+    return os.path.join(transcripts_dir, MODEL_FILENAME)
+
+
+def delta_path(path):
+    """related.npz -> related-delta.npz"""
+    return os.path.splitext(path)[0] + DELTA_SUFFIX
+
+
+def open_related(transcripts_dir, create=False):
+    """The related-videos model of a transcripts folder, or None if it has none and `create` is false."""
+    path = model_path(transcripts_dir)
+    if not create and not os.path.exists(path):
+        return None
+    return RelatedIndex(path)
+
+
+def build(transcripts_dir, rebuild=False):
+    """Add every transcript in the folder that the model lacks; returns how many were added."""
+    if rebuild:
+        for path in (model_path(transcripts_dir), delta_path(model_path(transcripts_dir))):
+            if os.path.exists(path):
+                os.remove(path)
+    model = open_related(transcripts_dir, create=True)
+    added = 0
+    for video_id, entries in iter_transcripts(transcripts_dir, skip=set(model.ids)):
+        model.add(video_id, entries)
+        added += 1
+    model.commit()
+    return added
+
+
+def print_results(results, as_json):
+    if as_json:
+        print(json.dumps(results, indent=2))
+        return
+    for result in results:
+        print(f"{result['score']:.3f}  https://www.youtube.com/watch?v={result['video_id']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find related videos by comparing their transcripts.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser('build', help='Add transcripts that are not in the model yet')
+    build_parser.add_argument('folder', nargs='?', default='transcripts', help='Transcripts folder')
+    build_parser.add_argument('--rebuild', action='store_true', help='Discard the model and start over')
+    for name, help_text, argument in (('similar', 'Videos similar to a video', 'video_id'),
+                                      ('query', 'Videos matching free text', 'text')):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('folder', help='Transcripts folder')
+        command.add_argument(argument)
+        command.add_argument('-k', '--top', type=int, default=DEFAULT_TOP_K, help='Number of videos to print')
+        command.add_argument('--json', action='store_true', help='Print the result as JSON')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        started = time.perf_counter()
+        added = build(args.folder, args.rebuild)
+        print(f"Added {added} transcripts in {time.perf_counter() - started:.1f}s.")
+        return
+
+    model = open_related(args.folder)
+    if model is None:
+        print(f"No related-videos model in {args.folder}; run: python transcript_related.py build {args.folder}")
+        sys.exit(1)
+    if args.command == 'similar':
+        results = model.similar(args.video_id, args.top)
+        if results is None:
+            print(f"{args.video_id} is not in the model.")
+            sys.exit(1)
+    else:
+        results = model.query(args.text, args.top)
+    print_results(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,542 @@
+"""
+Full-text search over downloaded transcripts, with the time each hit was spoken.
+
+The index lives in <transcripts folder>/search-index/ as immutable segments. Each
+segment is a directory of flat binary files that are memory-mapped at query time:
+
+    ids.json       video IDs, one per document number
+    terms.bin      sorted terms, concatenated UTF-8
+    terms.idx      uint64 start of each term in terms.bin (+1 end offset)
+    postings.idx   uint64 start of each term's postings (+1 end offset)
+    postings.bin   uint32 (document, token position) pairs, sorted
+    docs.idx       uint64 first entry of each document in entries/starts (+1)
+    entries.bin    uint32 first token position of each transcript entry
+    starts.bin     float64 start time (seconds) of each transcript entry
+
+New transcripts are buffered and written as a new segment; once there are more
+than MAX_SEGMENTS they are merged into one, renumbering postings in bulk. A video
+indexed again hides its copies in older segments. manifest.json lists the live
+segments.
+
+Queries work on the mapped posting arrays with numpy: every (document, position)
+posting becomes one int64 key, phrases are matched with searchsorted on the sorted
+keys, and only the hits that are returned are looked up in entries/starts.
+
+Needs numpy.
+
+    python transcript_search.py build transcripts/
+    python transcript_search.py query transcripts/ '"never gonna" giv*'
+"""
+import os
+import re
+import sys
+import json
+import mmap
+import time
+import heapq
+import shutil
+import argparse
+from array import array
+from bisect import bisect_left
+
+import numpy as np
+
+INDEX_DIRNAME = 'search-index'
+MANIFEST_FILENAME = 'manifest.json'
+# Transcripts buffered in memory before they are written out as a segment
+SEGMENT_MAX_DOCS = 500
+MAX_SEGMENTS = 8
+# Upper bound on terms a prefix query expands to
+MAX_PREFIX_TERMS = 500
+# Postings renumbered per step while merging; bounds merge memory (a single larger term still goes whole)
+MERGE_CHUNK_POSTINGS = 1024 * 1024
+DEFAULT_LIMIT = 50
+
+TOKEN_RE = re.compile(r"[\w']+")
+
+
+def tokenize(text):
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower()):
+        token = token.strip("'")
+        if token:
+            tokens.append(token)
+    return tokens
+
+
+def format_time(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class _TermList:
+    """Sequence view of a segment's sorted terms, so bisect can search the mapped file."""
+
+    def __init__(self, segment):
+        self.segment = segment
+
+    def __len__(self):
+        return self.segment.term_count
+
+    def __getitem__(self, i):
+        return self.segment.term(i)
+
+
+def _keys(docs, positions):
+    """(document, position) pairs as sortable int64 keys."""
+    return (docs.astype(np.int64) << 32) | positions
+
+
+def _runs(values):
+    """Distinct values of a sorted array and how often each occurs."""
+    if not len(values):
+        return values, np.zeros(0, dtype=np.int64)
+    starts = np.flatnonzero(np.concatenate(([True], values[1:] != values[:-1])))
+    return values[starts], np.diff(np.append(starts, len(values)))
+
+
+class Segment:
+    def __init__(self, path):
+        self.path = path
+        self.maps = []
+        with open(os.path.join(path, 'ids.json'), encoding='utf-8') as f:
+            self.ids = json.load(f)
+        self.terms = self._map('terms.bin', np.uint8)
+        self.term_offsets = self._map('terms.idx', np.uint64)
+        self.posting_offsets = self._map('postings.idx', np.uint64)
+        self.postings = self._map('postings.bin', np.uint32).reshape(-1, 2)
+        self.doc_entries = self._map('docs.idx', np.uint64)
+        self.entry_tokens = self._map('entries.bin', np.uint32)
+        self.starts = self._map('starts.bin', np.float64)
+        self.term_count = max(0, len(self.term_offsets) - 1)
+
+    def _map(self, name, dtype):
+        with open(os.path.join(self.path, name), 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return np.zeros(0, dtype=dtype)
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.maps.append(mm)
+        return np.frombuffer(mm, dtype=dtype)
+
+    def close(self):
+        """Unmap the files now rather than at garbage collection (best effort: slices may still be alive)."""
+        for name in ('terms', 'term_offsets', 'posting_offsets', 'postings', 'doc_entries', 'entry_tokens', 'starts'):
+            setattr(self, name, None)
+        try:
+            for mm in self.maps:
+                mm.close()
+        except BufferError:
+            pass
+        self.maps = []
+        self.term_count = 0
+
+    def term(self, i):
+        return self.terms[self.term_offsets[i]:self.term_offsets[i + 1]].tobytes().decode('utf-8')
+
+    def all_terms(self):
+        data = self.terms.tobytes()
+        offsets = self.term_offsets.tolist()
+        return [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(self.term_count)]
+
+    def find(self, term):
+        i = bisect_left(_TermList(self), term)
+        return i if i < self.term_count and self.term(i) == term else -1
+
+    def prefix_terms(self, prefix):
+        terms = _TermList(self)
+        lo = bisect_left(terms, prefix)
+        hi = bisect_left(terms, prefix + '\U0010ffff', lo)
+        return range(lo, min(hi, lo + MAX_PREFIX_TERMS))
+
+    def term_keys(self, term_ids):
+        """Sorted (document, position) keys of every posting of the given terms."""
+        offsets = self.posting_offsets
+        parts = [self.postings[offsets[i]:offsets[i + 1]] for i in term_ids]
+        if not parts:
+            return np.zeros(0, dtype=np.int64)
+        pairs = np.concatenate(parts) if len(parts) > 1 else parts[0]
+        keys = _keys(pairs[:, 0], pairs[:, 1])
+        if len(parts) > 1:
+            keys.sort()  # each term's postings are sorted, the concatenation is not
+        return keys
+
+    def phrase(self, tokens, prefix=False):
+        """Sorted (document, position) keys where `tokens` start in sequence (last one as a prefix if asked)."""
+        matches = None
+        for n, token in enumerate(tokens):
+            if prefix and n == len(tokens) - 1:
+                term_ids = self.prefix_terms(token)
+            else:
+                term_id = self.find(token)
+                term_ids = [term_id] if term_id >= 0 else []
+            keys = self.term_keys(term_ids)
+            if matches is None:
+                matches = keys
+            elif len(matches) and len(keys):
+                wanted = matches + n
+                found = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+                matches = matches[keys[found] == wanted]
+            else:
+                matches = keys[:0]
+            if not len(matches):
+                break
+        return matches
+
+    def locate(self, doc, positions):
+        """(start seconds, entry number) of the transcript entries holding the token `positions` of `doc`."""
+        lo, hi = int(self.doc_entries[doc]), int(self.doc_entries[doc + 1])
+        entries = np.maximum(np.searchsorted(self.entry_tokens[lo:hi], positions, side='right') - 1, 0)
+        return self.starts[lo + entries], entries
+
+
+def write_segment(path, ids, doc_entries, entry_tokens, starts, terms):
+    """
+    Write a segment directory. `entry_tokens` and `starts` are sequences of array chunks;
+    `terms` yields (sorted terms, uint32 (doc, position) pairs of all of them, postings per term)
+    in order.
+    """
+    temp = path + '.tmp'
+    shutil.rmtree(temp, ignore_errors=True)
+    os.makedirs(temp)
+    term_offsets = [np.zeros(1, dtype=np.uint64)]
+    posting_offsets = [np.zeros(1, dtype=np.uint64)]
+    term_end = posting_end = 0
+    with open(os.path.join(temp, 'terms.bin'), 'wb') as term_file, \
+            open(os.path.join(temp, 'postings.bin'), 'wb') as posting_file:
+        for chunk_terms, pairs, counts in terms:
+            encoded = [term.encode('utf-8') for term in chunk_terms]
+            term_file.write(b''.join(encoded))
+            term_offsets.append(term_end + np.cumsum([len(term) for term in encoded], dtype=np.uint64))
+            term_end += sum(len(term) for term in encoded)
+            np.ascontiguousarray(pairs, dtype=np.uint32).tofile(posting_file)
+            posting_offsets.append(posting_end + np.cumsum(counts, dtype=np.uint64))
+            posting_end += int(np.sum(counts))
+    for name, chunks, dtype in (('terms.idx', term_offsets, np.uint64), ('postings.idx', posting_offsets, np.uint64),
+                                ('docs.idx', [doc_entries], np.uint64), ('entries.bin', entry_tokens, np.uint32),
+                                ('starts.bin', starts, np.float64)):
+        with open(os.path.join(temp, name), 'wb') as f:
+            for chunk in chunks:
+                np.asarray(chunk, dtype=dtype).tofile(f)
+    with open(os.path.join(temp, 'ids.json'), 'w', encoding='utf-8') as f:
+        json.dump(ids, f)
+    os.replace(temp, path)
+
+
+class SearchIndex:
+    """
+    Segmented inverted index of one transcripts folder. add() buffers transcripts and
+    commit() makes them searchable; readers in other processes pick up new segments
+    through refresh().
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, MANIFEST_FILENAME)
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = None
+        self.segments = []
+        self.hidden = []
+        self.next_segment = 0
+        self.refresh()
+        self._reset_pending()
+
+    def _reset_pending(self):
+        self.pending_ids = []
+        self.pending_doc_entries = [0]
+        self.pending_entry_tokens = array('I')
+        self.pending_starts = array('d')
+        self.pending_postings = {}
+
+    def refresh(self):
+        """Reload the segment list if a writer changed it (the manifest is tiny, so just read it)."""
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {'segments': [], 'next': 0}
+        if manifest == self.manifest:
+            return
+        # Old segments are left to the garbage collector: a concurrent query may still read them.
+        self.segments = [Segment(os.path.join(self.directory, name)) for name in manifest['segments']]
+        self.next_segment = manifest['next']
+        self.manifest = manifest
+        # Newer copies of a video hide older ones.
+        seen = set()
+        hidden = []
+        for segment in reversed(self.segments):
+            hidden.append(np.array([doc for doc, video_id in enumerate(segment.ids) if video_id in seen],
+                                   dtype=np.int64))
+            seen.update(segment.ids)
+        self.hidden = hidden[::-1]
+
+    def indexed_ids(self):
+        ids = set(self.pending_ids)
+        for segment in self.segments:
+            ids.update(segment.ids)
+        return ids
+
+    def add(self, video_id, entries):
+        doc = len(self.pending_ids)
+        self.pending_ids.append(video_id)
+        position = 0
+        for entry in entries:
+            self.pending_entry_tokens.append(position)
+            self.pending_starts.append(float(entry.get('start') or 0))
+            for token in tokenize(entry.get('text') or ''):
+                self.pending_postings.setdefault(token, array('I')).extend((doc, position))
+                position += 1
+        self.pending_doc_entries.append(len(self.pending_entry_tokens))
+        if len(self.pending_ids) >= SEGMENT_MAX_DOCS:
+            self.commit()
+
+    def _write_manifest(self, names):
+        temp = self.manifest_path + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump({'segments': names, 'next': self.next_segment}, f)
+        os.replace(temp, self.manifest_path)
+
+    def _new_segment_path(self):
+        name = f'seg-{self.next_segment:06d}'
+        self.next_segment += 1
+        return name, os.path.join(self.directory, name)
+
+    def commit(self):
+        """Write buffered transcripts as a new segment, merging segments when there are too many."""
+        if not self.pending_ids:
+            return
+        self.refresh()
+        name, path = self._new_segment_path()
+        postings = self.pending_postings
+        terms = sorted(postings)
+        pairs = np.concatenate([np.frombuffer(postings[term], dtype=np.uint32) for term in terms] or
+                               [np.zeros(0, dtype=np.uint32)])
+        counts = [len(postings[term]) // 2 for term in terms]
+        write_segment(path, self.pending_ids, self.pending_doc_entries, [self.pending_entry_tokens],
+                      [self.pending_starts], [(terms, pairs, counts)])
+        self._reset_pending()
+        self._write_manifest([os.path.basename(s.path) for s in self.segments] + [name])
+        self.refresh()
+        if len(self.segments) > MAX_SEGMENTS:
+            self.merge()
+
+    def merge(self):
+        """
+        Rewrite all segments as one, dropping hidden copies. Postings are renumbered and
+        interleaved in bulk, a run of terms holding about MERGE_CHUNK_POSTINGS at a time,
+        and entries are copied a segment at a time.
+        """
+        if len(self.segments) < 2:
+            return
+        segments = self.segments
+        ids = []
+        doc_maps = []  # per segment: merged document number of each document, -1 if hidden
+        entry_masks = []
+        doc_entries = [np.zeros(1, dtype=np.uint64)]
+        for segment, hidden in zip(segments, self.hidden):
+            live = np.ones(len(segment.ids), dtype=bool)
+            live[hidden] = False
+            doc_map = np.full(len(segment.ids), -1, dtype=np.int64)
+            doc_map[live] = len(ids) + np.arange(np.count_nonzero(live))
+            doc_maps.append(doc_map)
+            ids.extend(video_id for video_id, kept in zip(segment.ids, live.tolist()) if kept)
+            sizes = np.diff(segment.doc_entries)
+            entry_masks.append(np.repeat(live, sizes.astype(np.int64)))
+            doc_entries.append(doc_entries[-1][-1] + np.cumsum(sizes[live], dtype=np.uint64))
+
+        segment_terms = [segment.all_terms() for segment in segments]
+        vocabulary = sorted(set().union(*segment_terms))
+        numbers = {term: number for number, term in enumerate(vocabulary)}
+        # Per segment: merged term number of each of its terms (ascending, as both lists are sorted).
+        term_maps = [np.fromiter((numbers[term] for term in terms), dtype=np.int64, count=len(terms))
+                     for terms in segment_terms]
+        del segment_terms, numbers
+        sizes = np.zeros(len(vocabulary), dtype=np.int64)
+        for segment, term_map in zip(segments, term_maps):
+            sizes[term_map] += np.diff(segment.posting_offsets).astype(np.int64)
+        ends = np.cumsum(sizes)
+
+        def merged_terms():
+            lo = 0
+            while lo < len(vocabulary):
+                hi = max(lo + 1, int(np.searchsorted(ends, ends[lo] - sizes[lo] + MERGE_CHUNK_POSTINGS, 'right')))
+                term_parts = []
+                pair_parts = []
+                for segment, term_map, doc_map in zip(segments, term_maps, doc_maps):
+                    a, b = np.searchsorted(term_map, [lo, hi])
+                    offsets = segment.posting_offsets[a:b + 1].astype(np.int64)
+                    pairs = segment.postings[offsets[0]:offsets[-1]]
+                    docs = doc_map[pairs[:, 0]]
+                    kept = docs >= 0
+                    term_parts.append(np.repeat(term_map[a:b], np.diff(offsets))[kept])
+                    pair_parts.append(np.column_stack((docs[kept].astype(np.uint32), pairs[kept, 1])))
+                terms = np.concatenate(term_parts)
+                # A stable sort keeps each term's postings in segment order, hence sorted by document.
+                order = np.argsort(terms, kind='stable')
+                counts = np.bincount(terms - lo, minlength=hi - lo)
+                present = np.flatnonzero(counts)
+                yield [vocabulary[i] for i in (present + lo).tolist()], np.concatenate(pair_parts)[order], counts[present]
+                lo = hi
+
+        def chunks(name):
+            for segment, mask in zip(segments, entry_masks):
+                yield getattr(segment, name)[mask]
+
+        name, path = self._new_segment_path()
+        write_segment(path, ids, np.concatenate(doc_entries), chunks('entry_tokens'), chunks('starts'), merged_terms())
+        self._write_manifest([name])
+        old_paths = [segment.path for segment in segments]
+        for segment in segments:
+            segment.close()
+        self.segments = []
+        self.refresh()
+        for old_path in old_paths:
+            # Readers in other processes may still map these (and on Windows block removal).
+            shutil.rmtree(old_path, ignore_errors=True)
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """
+        Find `query` in the committed transcripts. Quoted text is a phrase, a trailing *
+        makes the last word a prefix, and every clause must occur in the same video.
+        Returns {'total_hits', 'videos', 'hits': [{'video_id', 'start', 'time', 'entry', 'url'}]}
+        with the videos that have the most hits first. Matching and counting run on the
+        posting arrays; only the videos that make the first `limit` hits are located.
+        """
+        clauses = []
+        for match in re.finditer(r'"([^"]*)"|(\S+)', query):
+            text = match.group(1) if match.group(1) is not None else match.group(2)
+            tokens = tokenize(text)
+            if tokens:
+                clauses.append((tokens, text.rstrip('"').endswith('*')))
+        found = []  # (-hits, video_id, segment number, doc)
+        segment_keys = {}  # segment number -> sorted (doc, position) keys of every hit
+        total_hits = 0
+        for n, (segment, hidden) in enumerate(zip(self.segments, self.hidden)):
+            matches = []
+            for tokens, prefix in clauses:
+                keys = segment.phrase(tokens, prefix)
+                if not len(keys):
+                    break
+                matches.append(keys)
+            if not clauses or len(matches) < len(clauses):
+                continue
+            docs = np.setdiff1d(_runs(matches[0] >> 32)[0], hidden, assume_unique=True)
+            for keys in matches[1:]:
+                docs = np.intersect1d(docs, _runs(keys >> 32)[0], assume_unique=True)
+            if not len(docs):
+                continue
+            if len(matches) > 1:
+                # Clauses can match at the same position (w* and w1); each position counts once.
+                keys = np.sort(np.concatenate([keys[np.isin(keys >> 32, docs)] for keys in matches]))
+                keys = _runs(keys)[0]
+            else:
+                keys = matches[0][np.isin(matches[0] >> 32, docs)]
+            docs, counts = _runs(keys >> 32)
+            total_hits += int(counts.sum())
+            segment_keys[n] = keys
+            found.extend(zip((-counts).tolist(), [segment.ids[doc] for doc in docs.tolist()],
+                             [n] * len(docs), docs.tolist()))
+        hits = []
+        # Every video contributes at least one hit, so the first `limit` videos are enough.
+        for _, video_id, n, doc in heapq.nsmallest(limit, found):
+            keys = segment_keys[n]
+            lo, hi = np.searchsorted(keys, [doc << 32, (doc + 1) << 32])
+            starts, entries = self.segments[n].locate(doc, keys[lo:hi] & 0xFFFFFFFF)
+            entries, first = np.unique(entries, return_index=True)  # several matches in one caption line
+            for start, entry in list(zip(starts[first].tolist(), entries.tolist()))[:limit - len(hits)]:
+                hits.append({'video_id': video_id, 'start': start, 'time': format_time(start), 'entry': entry,
+                             'url': f'https://www.youtube.com/watch?v={video_id}&t={int(start)}s'})
+            if len(hits) >= limit:
+                break
+        return {'total_hits': total_hits, 'videos': len(found), 'hits': hits}
+
+
+def index_path(transcripts_dir):
+    return os.path.join(transcripts_dir, INDEX_DIRNAME)
+
+
+def open_index(transcripts_dir, create=False):
+    """The search index of a transcripts folder, or None if it has none and `create` is false."""
+    path = index_path(transcripts_dir)
+    if not create and not os.path.exists(path):
+        return None
+    return SearchIndex(path)
+
+
+def iter_transcripts(transcripts_dir, skip=()):
+    """
+    Yield (video_id, entries) one transcript at a time from a folder of <id>.json files
+    or a compact store. A video in both is yielded once, from whichever copy is newer.
+    """
+    from yt_transcript_downloader import STORE_INDEX_FILENAME, TranscriptStore, record_entries
+    loose = {}  # video_id -> (path, mtime) of <id>.json files
+    for entry in os.scandir(transcripts_dir):
+        video_id, ext = os.path.splitext(entry.name)
+        if ext == '.json' and video_id not in skip and re.fullmatch(r'[\w-]{11}', video_id):
+            loose[video_id] = (entry.path, entry.stat().st_mtime)
+    if os.path.exists(os.path.join(transcripts_dir, STORE_INDEX_FILENAME)):
+        store = TranscriptStore(transcripts_dir)
+        for video_id in store.ids():
+            if video_id in skip:
+                continue
+            record = store.get_record(video_id)
+            if video_id in loose and loose[video_id][1] > store.record_time(video_id, record):
+                continue
+            loose.pop(video_id, None)
+            yield video_id, record_entries(record)
+    for video_id, (path, _) in loose.items():
+        try:
+            with open(path, encoding='utf-8') as f:
+                yield video_id, json.load(f)
+        except ValueError:
+            print(f"Skipping {os.path.basename(path)}: not valid JSON")
+
+
+def build(transcripts_dir, rebuild=False):
+    """Index every transcript in the folder not indexed yet; returns how many were added."""
+    if rebuild:
+        shutil.rmtree(index_path(transcripts_dir), ignore_errors=True)
+    index = open_index(transcripts_dir, create=True)
+    added = 0
+    for video_id, entries in iter_transcripts(transcripts_dir, skip=index.indexed_ids()):
+        index.add(video_id, entries)
+        added += 1
+    index.commit()
+    return added
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query a full-text index of downloaded transcripts.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser('build', help='Index transcripts that are not indexed yet')
+    build_parser.add_argument('folder', nargs='?', default='transcripts', help='Transcripts folder')
+    build_parser.add_argument('--rebuild', action='store_true', help='Discard the index and start over')
+    query_parser = commands.add_parser('query', help='Search the index')
+    query_parser.add_argument('folder', help='Transcripts folder')
+    query_parser.add_argument('query', help='Words, "quoted phrases" and prefix* terms')
+    query_parser.add_argument('-n', '--limit', type=int, default=DEFAULT_LIMIT, help='Maximum hits to print')
+    query_parser.add_argument('--json', action='store_true', help='Print the result as JSON')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        started = time.perf_counter()
+        added = build(args.folder, args.rebuild)
+        print(f"Indexed {added} new transcripts in {time.perf_counter() - started:.1f}s.")
+        return
+
+    index = open_index(args.folder)
+    if index is None:
+        print(f"No search index in {args.folder}; run: python transcript_search.py build {args.folder}")
+        sys.exit(1)
+    started = time.perf_counter()
+    result = index.search(args.query, args.limit)
+    elapsed = (time.perf_counter() - started) * 1000
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    for hit in result['hits']:
+        print(f"{hit['video_id']}  {hit['time']}  {hit['url']}")
+    print(f"{result['total_hits']} hits in {result['videos']} videos ({elapsed:.1f} ms)")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,21 +2,103 @@ import os
 import re
 import sys
 import json
+import gzip
+import time
 import argparse
-from urllib.parse import urlparse, parse_qs
+import threading
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse, parse_qs, urljoin
 import requests
+from requests.adapters import HTTPAdapter
 from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled, NoTranscriptFound
 
+INDEX_FILENAME = '.transcript_index.jsonl'
+# Videos without a (manual) transcript are asked again after this many days
+DEFAULT_RETRY_DAYS = 7
+
+# Compact store (--format store): append-only shards of gzip members, one per
+# transcript, and a JSON-lines offset index (video ID -> shard, offset, length)
+STORE_INDEX_FILENAME = 'store-index.jsonl'
+STORE_SHARD_PATTERN = 'transcripts-{:05d}.ndjson.gz'
+STORE_SHARD_MAX_BYTES = 64 * 1024 * 1024
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'
+}
+# Renderers in ytInitialData / browse responses that stand for one uploaded video
+VIDEO_RENDERERS = ('videoRenderer', 'gridVideoRenderer', 'reelItemRenderer')
+
+def make_session(pool_size=10):
+    """
+    One requests.Session shared by every lookup, so TLS connections to YouTube are
+    reused instead of opened per call. pool_size should be at least the number of
+    concurrent jobs, otherwise connections are dropped after each request.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def list_transcripts(video_id, session):
+    """List a video's transcripts over `session` (youtube-transcript-api 1.x, or 0.6)."""
+    # 1.0 and 1.1 still have the list_transcripts classmethod, so test for the 1.x API.
+    if hasattr(YouTubeTranscriptApi, 'list'):
+        return YouTubeTranscriptApi(http_client=session).list(video_id)
+    # 0.6 opens a new session per call; its fetcher accepts ours instead.
+    from youtube_transcript_api._transcripts import TranscriptListFetcher
+    return TranscriptListFetcher(session).fetch(video_id)
+
+def transcript_entries(fetched):
+    """Plain [{'text', 'start', 'duration'}, ...] from either library version's fetch() result."""
+    if hasattr(fetched, 'to_raw_data'):
+        return fetched.to_raw_data()
+    return list(fetched)
+
 def extract_video_ids_from_html(html):
     # Video IDs are in "href=/watch?v=VIDEO_ID" in the HTML but need regex to extract all unique ones
-    video_ids = set(re.findall(r'/watch\?v=([\w-]{11})', html))
+    # (dict.fromkeys keeps them in page order)
+    video_ids = dict.fromkeys(re.findall(r'/watch\?v=([\w-]{11})', html))
     return list(video_ids)
 
-def get_videos_from_channel(channel_identifier):
+def extract_json_object(html, marker):
+    """Decode the JSON object that starts right after each `marker` in the page, in order."""
+    decoder = json.JSONDecoder()
+    objects = []
+    for match in re.finditer(re.escape(marker) + r'\s*', html):
+        try:
+            objects.append(decoder.raw_decode(html, match.end())[0])
+        except ValueError:
+            continue
+    return objects
+
+def walk_video_items(data):
     """
-    Accepts channel URL, channel ID, username, or custom URL.
-    Returns list of video IDs from the channel's /videos page.
+    Yield ('video', id) and ('continuation', token) from a ytInitialData or browse
+    response in document order, which is upload order (newest first) on /videos.
     """
+    if isinstance(data, list):
+        for item in data:
+            yield from walk_video_items(item)
+        return
+    if not isinstance(data, dict):
+        return
+    for key, value in data.items():
+        if key in VIDEO_RENDERERS and isinstance(value, dict) and value.get('videoId'):
+            yield 'video', value['videoId']
+        elif key == 'lockupViewModel' and isinstance(value, dict) and value.get('contentId') \
+                and value.get('contentType', 'LOCKUP_CONTENT_TYPE_VIDEO') == 'LOCKUP_CONTENT_TYPE_VIDEO':
+            yield 'video', value['contentId']
+        elif key == 'continuationItemRenderer' and isinstance(value, dict):
+            token = (value.get('continuationEndpoint', {}).get('continuationCommand', {}).get('token'))
+            if token:
+                yield 'continuation', token
+        else:
+            yield from walk_video_items(value)
+
+def channel_videos_url(channel_identifier):
+    """Turn a channel URL, channel ID, @handle or username into its /videos page URL."""
     # Normalize channel URL
     possible_prefixes = [
         'https://www.youtube.com/channel/',
@@ -32,6 +114,8 @@ def get_videos_from_channel(channel_identifier):
         # try channel ID format first
         if channel_identifier.startswith('UC'):
             url = f'https://www.youtube.com/channel/{channel_identifier}/videos'
+        elif channel_identifier.startswith('@'):
+            url = f'https://www.youtube.com/{channel_identifier}/videos'
         else:
             # else default to user
             url = f'https://www.youtube.com/user/{channel_identifier}/videos'
@@ -42,50 +126,284 @@ def get_videos_from_channel(channel_identifier):
             url += 'videos'
         else:
             url += '/videos'
+    return url
 
+def iter_channel_video_ids(channel_identifier, session=None):
+    """
+    Lazily yield a channel's video IDs, newest first. The first batch comes from the
+    /videos page; further batches are requested from the browse endpoint (on the same
+    host as the page) with the continuation token of the previous batch, so stopping
+    early also stops the paging.
+    """
+    session = session or make_session(1)
+    url = channel_videos_url(channel_identifier)
     print(f"Fetching videos from: {url}")
 
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'
-    }
-    r = requests.get(url, headers=headers)
+    r = session.get(url, headers=HEADERS)
     if r.status_code != 200:
         print(f"Failed to fetch channel videos page (Status code: {r.status_code})")
-        return []
+        return
 
     html = r.text
+    initial = extract_json_object(html, 'var ytInitialData =')
+    if not initial:
+        # Page layout we do not understand: fall back to the links on the first page
+        print("No ytInitialData on the channel page; only the first page of videos is available.")
+        yield from extract_video_ids_from_html(html)
+        return
 
-    ids = extract_video_ids_from_html(html)
-    print(f"Found {len(ids)} videos on the channel page.")
-    return ids
+    config = {}
+    for cfg in extract_json_object(html, 'ytcfg.set('):
+        config.update(cfg)
+    browse_url = urljoin(url, '/youtubei/v1/browse')
+    if config.get('INNERTUBE_API_KEY'):
+        browse_url += '?key=' + config['INNERTUBE_API_KEY']
+    context = config.get('INNERTUBE_CONTEXT') or {
+        'client': {'clientName': 'WEB', 'clientVersion': config.get('INNERTUBE_CLIENT_VERSION', '2.20240101.00.00')}}
+
+    seen = set()
+    data = initial[0]
+    pages = 1
+    while True:
+        token = None
+        for kind, value in walk_video_items(data):
+            if kind == 'continuation':
+                token = value
+            elif value not in seen:
+                seen.add(value)
+                yield value
+        if not token:
+            print(f"Found {len(seen)} videos in {pages} page(s).")
+            return
+        r = session.post(browse_url, json={'context': context, 'continuation': token}, headers=HEADERS)
+        if r.status_code != 200:
+            print(f"Failed to fetch the next page of videos (Status code: {r.status_code})")
+            return
+        data = r.json()
+        pages += 1
+
+def get_videos_from_channel(channel_identifier, limit=0, session=None):
+    """
+    Accepts channel URL, channel ID, @handle, username, or custom URL.
+    Returns list of video IDs from the channel's /videos tab, newest first
+    (only the latest `limit` when it is set).
+    """
+    ids = iter_channel_video_ids(channel_identifier, session)
+    return list(islice(ids, limit) if limit > 0 else ids)
 
-def download_transcript(video_id):
+def fetch_transcript(video_id, session=None):
+    """
+    Look up and fetch the manual transcript of one video.
+    Returns (status, entries, language) where status is 'present', 'none', 'disabled' or 'error'.
+    """
     try:
         # fetch only manually created transcripts (exclude generated = False)
-        transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
-        transcript = None
-        # Try to get manually created transcript first
-        if transcript_list.find_manually_created_transcript(['en']):
-            transcript = transcript_list.find_manually_created_transcript(['en'])
-        else:
-            # If no 'en' transcript manually created, try without language filter but manual only
-            for t in transcript_list:
-                if not t.is_generated:
-                    transcript = t
-                    break
+        transcript_list = list_transcripts(video_id, session or make_session(1))
+        # One pass over the listing: a manual 'en' transcript first, else any manual one
+        manual = [t for t in transcript_list if not t.is_generated]
+        transcript = next((t for t in manual if t.language_code == 'en'), manual[0] if manual else None)
         if transcript is None:
             print(f"No manually created transcript found for video {video_id}")
-            return None
+            return 'none', None, None
 
         # fetch the transcript
-        return transcript.fetch()
+        return 'present', transcript_entries(transcript.fetch()), transcript.language_code
     except TranscriptsDisabled:
         print(f"Transcripts are disabled for video {video_id}.")
+        return 'disabled', None, None
     except NoTranscriptFound:
         print(f"No transcript found for video {video_id}.")
+        return 'none', None, None
     except Exception as e:
         print(f"Error fetching transcript for video {video_id}: {str(e)}")
-    return None
+        return 'error', None, None
+
+def download_transcript(video_id, session=None):
+    return fetch_transcript(video_id, session)[1]
+
+class TranscriptStore:
+    """
+    Transcripts packed into a few large shard files instead of two files per video.
+    Each transcript is one NDJSON line with columnar start/duration/text arrays,
+    gzip-compressed on its own and appended to the current shard. Concatenated gzip
+    members are still a valid .gz file, and the offset index lets get() seek to one
+    member and decompress only that, so reads by video ID are O(1).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_path = os.path.join(directory, STORE_INDEX_FILENAME)
+        self.offsets = {}  # video_id -> (shard, offset, length)
+        self.shard = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _shard_path(self, shard):
+        return os.path.join(self.directory, STORE_SHARD_PATTERN.format(shard))
+
+    def _load(self):
+        sizes = {}
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        shard, offset, length = record['shard'], record['offset'], record['length']
+                    except (ValueError, KeyError):
+                        continue  # torn last line after a crash
+                    if shard not in sizes:
+                        path = self._shard_path(shard)
+                        sizes[shard] = os.path.getsize(path) if os.path.exists(path) else 0
+                    if offset + length <= sizes[shard]:
+                        self.offsets[record['video_id']] = (shard, offset, length)
+        except FileNotFoundError:
+            pass
+        self.shard = max(sizes) if sizes else 0
+
+    def __contains__(self, video_id):
+        with self.lock:
+            return video_id in self.offsets
+
+    def __len__(self):
+        with self.lock:
+            return len(self.offsets)
+
+    def ids(self):
+        with self.lock:
+            return list(self.offsets)
+
+    def put(self, video_id, entries, language=None):
+        entries = list(entries)
+        record = {'video_id': video_id, 'language': language, 'fetched_at': time.time(),
+                  'start': [e['start'] for e in entries], 'duration': [e['duration'] for e in entries],
+                  'text': [e['text'] for e in entries]}
+        member = gzip.compress((json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8'))
+        with self.lock:
+            path = self._shard_path(self.shard)
+            if os.path.exists(path) and os.path.getsize(path) + len(member) > STORE_SHARD_MAX_BYTES:
+                self.shard += 1
+                path = self._shard_path(self.shard)
+            with open(path, 'ab') as f:
+                offset = f.tell()
+                f.write(member)
+            # The index line goes last: a crash in between only leaves unreferenced bytes
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'video_id': video_id, 'shard': self.shard,
+                                    'offset': offset, 'length': len(member)}) + '\n')
+            self.offsets[video_id] = (self.shard, offset, len(member))
+
+    def get_record(self, video_id):
+        with self.lock:
+            location = self.offsets.get(video_id)
+        if location is None:
+            return None
+        shard, offset, length = location
+        with open(self._shard_path(shard), 'rb') as f:
+            f.seek(offset)
+            return json.loads(gzip.decompress(f.read(length)))
+
+    def get(self, video_id):
+        """The transcript as [{'text', 'start', 'duration'}, ...], or None if not stored."""
+        record = self.get_record(video_id)
+        return None if record is None else record_entries(record)
+
+    def record_time(self, video_id, record):
+        """When a stored record was fetched; the mtime of its shard for records without fetched_at."""
+        if record.get('fetched_at'):
+            return record['fetched_at']
+        with self.lock:
+            shard = self.offsets[video_id][0]
+        return os.path.getmtime(self._shard_path(shard))
+
+def record_entries(record):
+    return [{'text': text, 'start': start, 'duration': duration}
+            for text, start, duration in zip(record['text'], record['start'], record['duration'])]
+
+def convert_folder(source_dir, store):
+    """Copy every <video_id>.json transcript of a folder into `store`; returns how many were added."""
+    added = 0
+    for entry in sorted(os.scandir(source_dir), key=lambda e: e.name):
+        video_id, ext = os.path.splitext(entry.name)
+        if ext != '.json' or not re.fullmatch(r'[\w-]{11}', video_id) or video_id in store:
+            continue
+        try:
+            with open(entry.path, encoding='utf-8') as f:
+                transcript = json.load(f)
+        except ValueError:
+            print(f"Skipping {entry.name}: not valid JSON (truncated by an earlier failed save?)")
+            continue
+        store.put(video_id, transcript)
+        added += 1
+    return added
+
+class TranscriptIndex:
+    """
+    Sync state of an output folder: one JSON line per lookup with the video ID, fetch
+    time, language, kind and status ('present', 'none', 'disabled' or 'error').
+    Later lines override earlier ones.
+    """
+
+    def __init__(self, output_dir, store=None):
+        self.output_dir = output_dir
+        self.store = store
+        self.path = os.path.join(output_dir, INDEX_FILENAME)
+        self.entries = {}
+        self.lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        self.entries[record['video_id']] = record
+                    except (ValueError, KeyError):
+                        continue  # torn last line after a crash
+        except FileNotFoundError:
+            self._seed_from_folder()
+
+    def _seed_from_folder(self):
+        # Folders filled before the index existed: their JSON files count as present
+        if self.store is not None:
+            for video_id in self.store.ids():
+                self.record(video_id, 'present')
+            return
+        if not os.path.isdir(self.output_dir):
+            return
+        for entry in os.scandir(self.output_dir):
+            name, ext = os.path.splitext(entry.name)
+            if ext == '.json' and re.fullmatch(r'[\w-]{11}', name):
+                self.record(name, 'present', fetched_at=entry.stat().st_mtime)
+
+    def record(self, video_id, status, language=None, fetched_at=None):
+        record = {'video_id': video_id, 'fetched_at': fetched_at or time.time(), 'language': language,
+                  'kind': 'manual' if status == 'present' else None, 'status': status}
+        with self.lock:
+            self.entries[video_id] = record
+            os.makedirs(self.output_dir, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + '\n')
+
+    def needs_fetch(self, video_id, retry_after, now=None):
+        """New, failed, missing-on-disk, or a 'none'/'disabled' result older than retry_after seconds."""
+        with self.lock:
+            record = self.entries.get(video_id)
+        if record is None or record['status'] == 'error':
+            return True
+        if record['status'] == 'present':
+            if self.store is not None:
+                return video_id not in self.store
+            return not os.path.exists(os.path.join(self.output_dir, f'{video_id}.json'))
+        return (now or time.time()) - record['fetched_at'] > retry_after
+
+    def counts(self):
+        with self.lock:
+            counts = {}
+            for record in self.entries.values():
+                counts[record['status']] = counts.get(record['status'], 0) + 1
+            return counts
 
 # def save_transcript(video_id, transcript, output_dir):
 #     if not os.path.exists(output_dir):
@@ -117,6 +435,53 @@ def save_transcript(video_id, transcript, output_dir):
             f.write(entry['text'] + '\n')
     print(f"Saved transcript for {video_id} as JSON and TXT.")
 
+def download_transcripts(video_ids, output_dir, jobs=1, session=None, index=None, store=None, indexes=()):
+    """
+    Fetch transcripts for `video_ids` with up to `jobs` requests in flight over one
+    pooled session, saving each one as soon as it arrives (into `store` if given,
+    else as JSON and TXT files) and recording the outcome in `index`, if given.
+    Saved transcripts are also added to each of `indexes` (search index, related-videos
+    model), committed at the end.
+    Returns the number saved.
+    """
+    jobs = max(1, jobs)
+    session = session or make_session(jobs)
+    saved = 0
+
+    def handle(vid, status, transcript, language):
+        nonlocal saved
+        if transcript and store is not None:
+            store.put(vid, transcript, language)
+            print(f"Stored transcript for {vid}.")
+            saved += 1
+        elif transcript:
+            save_transcript(vid, transcript, output_dir)
+            saved += 1
+        else:
+            print(f"No transcript for video {vid}. Skipping.")
+        if transcript:
+            for search_index in indexes:
+                search_index.add(vid, transcript)
+        if index is not None:
+            index.record(vid, status, language)
+
+    try:
+        if jobs == 1:
+            for vid in video_ids:
+                print(f"Downloading transcript for video {vid} ...")
+                handle(vid, *fetch_transcript(vid, session))
+            return saved
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(fetch_transcript, vid, session): vid for vid in video_ids}
+            # Writes happen here, in the main thread, in completion order.
+            for future in as_completed(futures):
+                handle(futures[future], *future.result())
+        return saved
+    finally:
+        for search_index in indexes:
+            search_index.commit()
+
 def extract_video_id_from_url(url):
     """
     Extract video ID from full YouTube video URL or string.
@@ -141,42 +506,100 @@ def main():
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument('-c', '--channel', help='YouTube channel URL, channel ID or username or custom URL')
     group.add_argument('-v', '--video', help='YouTube video URL or video ID')
+    group.add_argument('--convert', metavar='FOLDER',
+                       help='Convert a folder of <video_id>.json transcripts into the compact store at --output')
+    group.add_argument('--read', metavar='VIDEO_ID', help='Print a transcript from the compact store at --output')
+    group.add_argument('--related', metavar='VIDEO_ID_OR_TEXT',
+                       help='List videos in --output related to a video, or matching free text (needs numpy and scipy)')
 
     parser.add_argument('-n', '--number', type=int, default=0,
-                        help='Number of latest videos to process from the channel (0 for all found)')
+                        help='Number of latest videos to process from the channel (0 for all found), or of related videos to list')
     parser.add_argument('-o', '--output', default='transcripts',
                         help='Output folder for transcripts')
+    parser.add_argument('-j', '--jobs', type=int, default=8,
+                        help='Number of transcripts to fetch concurrently (1 for one at a time)')
+    parser.add_argument('-f', '--format', choices=['files', 'store'], default='files',
+                        help='Save <video_id>.json/.txt files, or append to a compact sharded store')
+    parser.add_argument('-s', '--sync', action='store_true',
+                        help=f'Only fetch videos not yet in the output folder index ({INDEX_FILENAME})')
+    parser.add_argument('--retry-after', type=float, default=DEFAULT_RETRY_DAYS,
+                        help='With --sync: days before videos without a transcript are checked again')
+    parser.add_argument('--index', action='store_true',
+                        help='Add new transcripts to the full-text search index (kept up to date once it exists)')
 
     args = parser.parse_args()
+    store = TranscriptStore(args.output) if args.format == 'store' or args.convert or args.read else None
+    indexes = []
+    if args.video or args.channel:
+        if args.index or os.path.exists(os.path.join(args.output, 'search-index')):
+            import transcript_search
+            indexes.append(transcript_search.open_index(args.output, create=True))
+        if os.path.exists(os.path.join(args.output, 'related.npz')):
+            import transcript_related
+            indexes.append(transcript_related.open_related(args.output))
 
-    if args.video:
+    if args.convert:
+        added = convert_folder(args.convert, store)
+        print(f"Added {added} transcripts to the store in {args.output} ({len(store)} in total).")
+
+    elif args.read:
+        transcript = store.get(extract_video_id_from_url(args.read) or args.read)
+        if transcript is None:
+            print(f"No stored transcript for {args.read}.")
+            sys.exit(1)
+        for entry in transcript:
+            print(entry['text'])
+
+    elif args.related:
+        import transcript_related
+        model = transcript_related.open_related(args.output)
+        if model is None:
+            print(f"No related-videos model in {args.output}; run: python transcript_related.py build {args.output}")
+            sys.exit(1)
+        video_id = extract_video_id_from_url(args.related)
+        results = model.similar(video_id, args.number or transcript_related.DEFAULT_TOP_K) if video_id else None
+        if results is None:
+            results = model.query(args.related, args.number or transcript_related.DEFAULT_TOP_K)
+        transcript_related.print_results(results, False)
+
+    elif args.video:
         video_id = extract_video_id_from_url(args.video)
         if not video_id:
             print("Invalid video URL or ID.")
             sys.exit(1)
         print(f"Processing single video: {video_id}")
-        transcript = download_transcript(video_id)
-        if transcript:
+        status, transcript, language = fetch_transcript(video_id)
+        if transcript and store is not None:
+            store.put(video_id, transcript, language)
+            print(f"Stored transcript for {video_id}.")
+        elif transcript:
             save_transcript(video_id, transcript, args.output)
         else:
             print("No transcript available.")
+        if transcript:
+            for search_index in indexes:
+                search_index.add(video_id, transcript)
+                search_index.commit()
 
     elif args.channel:
-        video_ids = get_videos_from_channel(args.channel)
+        session = make_session(max(1, args.jobs))
+        # Paging stops as soon as the latest args.number videos are known
+        video_ids = get_videos_from_channel(args.channel, args.number, session)
         if not video_ids:
             print("No videos found.")
             sys.exit(1)
-        if args.number > 0:
-            video_ids = video_ids[:args.number]
-        print(f"Processing {len(video_ids)} videos...")
-
-        for vid in video_ids:
-            print(f"Downloading transcript for video {vid} ...")
-            transcript = download_transcript(vid)
-            if transcript:
-                save_transcript(vid, transcript, args.output)
-            else:
-                print(f"No transcript for video {vid}. Skipping.")
+        index = None
+        if args.sync:
+            index = TranscriptIndex(args.output, store)
+            now = time.time()
+            pending = [vid for vid in video_ids if index.needs_fetch(vid, args.retry_after * 86400, now)]
+            print(f"Sync: {len(video_ids) - len(pending)} of {len(video_ids)} videos are up to date.")
+            video_ids = pending
+        print(f"Processing {len(video_ids)} videos with {max(1, args.jobs)} concurrent job(s)...")
+        saved = download_transcripts(video_ids, args.output, args.jobs, session, index, store, indexes)
+        print(f"Saved {saved} of {len(video_ids)} transcripts.")
+        if index is not None:
+            print(f"Index: {index.counts()}")
 
 if __name__ == '__main__':
     main()
\ No newline at end of file